@@ -0,0 +1,5 @@
+-- CreateIndex
+CREATE INDEX "Order_userId_date_idx" ON "public"."Order"("userId", "date" DESC);
+
+-- CreateIndex
+CREATE INDEX "OrderItem_orderId_idx" ON "public"."OrderItem"("orderId");
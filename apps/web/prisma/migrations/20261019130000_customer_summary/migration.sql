@@ -0,0 +1,177 @@
+-- CreateTable
+CREATE TABLE "public"."CustomerSummary" (
+    "userId" TEXT NOT NULL,
+    "orderCount" INTEGER NOT NULL DEFAULT 0,
+    "totalSpent" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "lastOrderAt" TIMESTAMP(3),
+    "recentPurchases" JSONB NOT NULL DEFAULT '[]',
+    "favoriteCategories" JSONB NOT NULL DEFAULT '[]',
+    "favoriteBrands" JSONB NOT NULL DEFAULT '[]',
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "CustomerSummary_pkey" PRIMARY KEY ("userId")
+);
+
+-- AddForeignKey
+ALTER TABLE "public"."CustomerSummary" ADD CONSTRAINT "CustomerSummary_userId_fkey" FOREIGN KEY ("userId") REFERENCES "public"."User"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- Rebuild one customer's summary from their orders. It reads only that
+-- customer's rows (through "Order_userId_date_idx" and
+-- "OrderItem_orderId_idx"), so keeping it current costs the same however
+-- large the order tables grow. The lists are bounded: five most recent
+-- distinct products, three favourite categories and brands by quantity.
+CREATE FUNCTION "public"."refresh_customer_summary"(customer_id TEXT) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM "public"."Order" WHERE "userId" = customer_id) THEN
+        DELETE FROM "public"."CustomerSummary" WHERE "userId" = customer_id;
+        RETURN;
+    END IF;
+
+    INSERT INTO "public"."CustomerSummary" (
+        "userId", "orderCount", "totalSpent", "lastOrderAt",
+        "recentPurchases", "favoriteCategories", "favoriteBrands", "updatedAt"
+    )
+    SELECT customer_id,
+           totals.order_count,
+           totals.total_spent,
+           totals.last_order_at,
+           (SELECT COALESCE(jsonb_agg(recent ORDER BY recent."purchasedAt" DESC), '[]'::jsonb)
+              FROM (SELECT latest.name, latest.category, latest.brand, latest."purchasedAt"
+                      FROM (SELECT DISTINCT ON (p.id)
+                                   p.name, c.name AS category, b.name AS brand,
+                                   o.date AS "purchasedAt"
+                              FROM "public"."Order" o
+                              JOIN "public"."OrderItem" i ON i."orderId" = o.id
+                              JOIN "public"."Product" p ON p.id = i."productId"
+                              JOIN "public"."Category" c ON c.id = p."categoryId"
+                              JOIN "public"."Brand" b ON b.id = p."brandId"
+                             WHERE o."userId" = customer_id
+                             ORDER BY p.id, o.date DESC) latest
+                     ORDER BY latest."purchasedAt" DESC
+                     LIMIT 5) recent),
+           (SELECT COALESCE(jsonb_agg(top.name ORDER BY top.quantity DESC, top.name), '[]'::jsonb)
+              FROM (SELECT c.name, sum(i.quantity) AS quantity
+                      FROM "public"."Order" o
+                      JOIN "public"."OrderItem" i ON i."orderId" = o.id
+                      JOIN "public"."Product" p ON p.id = i."productId"
+                      JOIN "public"."Category" c ON c.id = p."categoryId"
+                     WHERE o."userId" = customer_id
+                     GROUP BY c.name
+                     ORDER BY quantity DESC, c.name
+                     LIMIT 3) top),
+           (SELECT COALESCE(jsonb_agg(top.name ORDER BY top.quantity DESC, top.name), '[]'::jsonb)
+              FROM (SELECT b.name, sum(i.quantity) AS quantity
+                      FROM "public"."Order" o
+                      JOIN "public"."OrderItem" i ON i."orderId" = o.id
+                      JOIN "public"."Product" p ON p.id = i."productId"
+                      JOIN "public"."Brand" b ON b.id = p."brandId"
+                     WHERE o."userId" = customer_id
+                     GROUP BY b.name
+                     ORDER BY quantity DESC, b.name
+                     LIMIT 3) top),
+           CURRENT_TIMESTAMP
+      FROM (SELECT count(*) AS order_count,
+                   COALESCE(sum(total), 0) AS total_spent,
+                   max(date) AS last_order_at
+              FROM "public"."Order"
+             WHERE "userId" = customer_id) totals
+    ON CONFLICT ("userId") DO UPDATE SET
+        "orderCount" = EXCLUDED."orderCount",
+        "totalSpent" = EXCLUDED."totalSpent",
+        "lastOrderAt" = EXCLUDED."lastOrderAt",
+        "recentPurchases" = EXCLUDED."recentPurchases",
+        "favoriteCategories" = EXCLUDED."favoriteCategories",
+        "favoriteBrands" = EXCLUDED."favoriteBrands",
+        "updatedAt" = EXCLUDED."updatedAt";
+END;
+$$;
+
+-- The triggers below fire once per statement and see the rows it changed
+-- as transition tables (old_rows, new_rows), so an order placed with many
+-- items, or a bulk import, rebuilds each affected customer once rather than
+-- once per row.
+CREATE FUNCTION "public"."customer_summary_orders_changed"() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT DISTINCT "userId" FROM new_rows) changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT DISTINCT "userId" FROM old_rows) changed;
+    ELSE
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT "userId" FROM old_rows
+                 UNION
+                 SELECT "userId" FROM new_rows) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION "public"."customer_summary_items_changed"() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT DISTINCT o."userId"
+                   FROM "public"."Order" o
+                  WHERE o.id IN (SELECT "orderId" FROM new_rows)) changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT DISTINCT o."userId"
+                   FROM "public"."Order" o
+                  WHERE o.id IN (SELECT "orderId" FROM old_rows)) changed;
+    ELSE
+        PERFORM "public"."refresh_customer_summary"(changed."userId")
+           FROM (SELECT DISTINCT o."userId"
+                   FROM "public"."Order" o
+                  WHERE o.id IN (SELECT "orderId" FROM old_rows
+                                 UNION
+                                 SELECT "orderId" FROM new_rows)) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- CreateTrigger
+CREATE TRIGGER "Order_customer_summary_insert"
+AFTER INSERT ON "public"."Order"
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_orders_changed"();
+
+-- CreateTrigger
+CREATE TRIGGER "Order_customer_summary_update"
+AFTER UPDATE ON "public"."Order"
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_orders_changed"();
+
+-- CreateTrigger
+CREATE TRIGGER "Order_customer_summary_delete"
+AFTER DELETE ON "public"."Order"
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_orders_changed"();
+
+-- CreateTrigger
+CREATE TRIGGER "OrderItem_customer_summary_insert"
+AFTER INSERT ON "public"."OrderItem"
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_items_changed"();
+
+-- CreateTrigger
+CREATE TRIGGER "OrderItem_customer_summary_update"
+AFTER UPDATE ON "public"."OrderItem"
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_items_changed"();
+
+-- CreateTrigger
+CREATE TRIGGER "OrderItem_customer_summary_delete"
+AFTER DELETE ON "public"."OrderItem"
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "public"."customer_summary_items_changed"();
+
+-- Backfill customers who already have orders
+SELECT "public"."refresh_customer_summary"(id)
+  FROM "public"."User" u
+ WHERE EXISTS (SELECT 1 FROM "public"."Order" o WHERE o."userId" = u.id);
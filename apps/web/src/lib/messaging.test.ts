@@ -76,6 +76,20 @@ describe("sendChatMessage", () => {
     expect(result.message).toContain("- [TrailMaster X4 Tent](/products/trailmaster-x4-tent)");
   });
 
+  it("asks the chat service for context references only", async () => {
+    const fetchMock = vi.spyOn(globalThis, "fetch").mockResolvedValue(
+      new Response(JSON.stringify({ answer: "Try the X4.", context: [] }), {
+        status: 200,
+        headers: { "Content-Type": "application/json" },
+      })
+    );
+
+    await sendChatMessage(turn, "1");
+
+    const [, init] = fetchMock.mock.calls[0];
+    expect(JSON.parse(init?.body as string)).toMatchObject({ include_context: "ids" });
+  });
+
   it("does not leak transport detail into the user-facing error", async () => {
     // The failure is logged for operators. "HTTP error! status: 500" tells a
     // shopper nothing and exposes internals; the component's own error path
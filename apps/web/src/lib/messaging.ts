@@ -129,6 +129,8 @@ export const sendChatMessage = async (
     chat_history: "[]",
     question: turn.message,
     customer_id: customerId ? customerId.toString() : null,
+    // Product links need names and slugs, not whole product documents.
+    include_context: "ids",
   };
 
   try {
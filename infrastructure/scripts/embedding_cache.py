@@ -0,0 +1,149 @@
+"""On-disk embedding cache shared by the indexers.
+
+`index_products_local.py` (Chroma's default model) and `seed_gcp_products.py`
+(textembedding-gecko) used to embed every text on every run, although almost
+all of it had not changed since the last one. `EmbeddingCache.embed` looks
+each text up by (model id, sha256 of the text) and only sends the misses to
+the model, in one call.
+
+Each model has its own directory under the cache root, holding two
+append-only files:
+
+- `vectors.f32`: raw little-endian float32 rows of the model's dimension.
+- `index.bin`: fixed-size entries of a 16-byte text digest followed by a
+  little-endian uint32 row number.
+
+Vectors are appended before the index entries that point at them. A run cut
+short can therefore leave at most some unreferenced rows and a torn last
+entry, and both are ignored on load. One writer per model at a time.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import struct
+from collections.abc import Callable, Sequence
+
+import numpy as np
+
+DIGEST_BYTES = 16
+ENTRY = struct.Struct(f"<{DIGEST_BYTES}sI")
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:DIGEST_BYTES]
+
+
+class EmbeddingCache:
+    def __init__(self, root: str, model: str) -> None:
+        self.model = model
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+        self.directory = os.path.join(root, f"{slug}-{hashlib.sha256(model.encode()).hexdigest()[:8]}")
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.hits = 0
+        self.misses = 0
+        self.dimensions: int | None = None
+        self.rows: dict[bytes, int] = {}
+        self._available = 0
+        self._index_bytes = 0
+        self._vectors: np.ndarray | None = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.meta_path, encoding="utf-8") as handle:
+                self.dimensions = int(json.load(handle)["dimensions"])
+        except (OSError, ValueError, KeyError):
+            return
+        available = os.path.getsize(self.vectors_path) // (4 * self.dimensions) if os.path.exists(self.vectors_path) else 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as handle:
+                data = handle.read()
+            self._index_bytes = len(data) - len(data) % ENTRY.size
+            for digest, row in ENTRY.iter_unpack(data[:self._index_bytes]):
+                if row < available:
+                    self.rows[digest] = row
+        self._available = available
+
+    def _stored(self) -> np.ndarray:
+        if self._vectors is None or len(self._vectors) < self._available:
+            self._vectors = np.memmap(
+                self.vectors_path, dtype="<f4", mode="r", shape=(self._available, self.dimensions)
+            )
+        return self._vectors
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def embed(
+        self, texts: Sequence[str], compute: Callable[[list[str]], Sequence[Sequence[float]]]
+    ) -> list[np.ndarray]:
+        """Vectors for `texts`, in order; only uncached texts go to `compute`."""
+        digests = [text_digest(text) for text in texts]
+        found: dict[bytes, np.ndarray] = {}
+        for digest in digests:
+            row = self.rows.get(digest)
+            if row is not None and digest not in found:
+                found[digest] = np.array(self._stored()[row], dtype=np.float32)
+
+        missing = {digest: text for digest, text in zip(digests, texts) if digest not in found}
+        misses = sum(1 for digest in digests if digest in missing)
+        self.hits += len(digests) - misses
+        self.misses += misses
+        if missing:
+            computed = np.asarray(compute(list(missing.values())), dtype=np.float32)
+            if len(computed) != len(missing):
+                raise ValueError(
+                    f"Embedding model {self.model!r} returned {len(computed)} vectors "
+                    f"for {len(missing)} texts"
+                )
+            if computed.ndim == 2 and computed.shape[1]:
+                self._append(list(missing), computed)
+            found.update(zip(missing, computed))
+        return [found[digest] for digest in digests]
+
+    def _append(self, digests: list[bytes], vectors: np.ndarray) -> None:
+        if self.dimensions is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.dimensions = int(vectors.shape[1])
+            with open(self.meta_path, "w", encoding="utf-8") as handle:
+                json.dump({"model": self.model, "dimensions": self.dimensions}, handle)
+        if vectors.shape[1] != self.dimensions:
+            # A model that changed shape under the same id; do not mix them.
+            return
+        first = self._available
+        entries = b"".join(ENTRY.pack(digest, first + n) for n, digest in enumerate(digests))
+        # Truncating first drops whatever an interrupted run left past the
+        # last whole row or entry, so the new ones stay aligned.
+        with open(self.vectors_path, "ab") as handle:
+            handle.truncate(first * 4 * self.dimensions)
+            handle.write(vectors.astype("<f4").tobytes())
+        with open(self.index_path, "ab") as handle:
+            handle.truncate(self._index_bytes)
+            handle.write(entries)
+        self._index_bytes += len(entries)
+        for n, digest in enumerate(digests):
+            self.rows[digest] = first + n
+        self._available = first + len(digests)
+
+    def stats(self) -> dict[str, int | float | str]:
+        looked_up = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / looked_up, 3) if looked_up else 0.0,
+            "cached": len(self.rows),
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"Embedding cache ({stats['model']}): {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['cached']} vectors cached"
+        )
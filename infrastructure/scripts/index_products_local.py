@@ -1,79 +1,633 @@
 import os
+import re
 import sys
+import json
+import glob
+import shutil
 import asyncio
+import hashlib
+import argparse
+import datetime
 import traceback
-from prisma import Prisma
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import asyncpg
+import numpy as np
 import chromadb
 from chromadb.utils import embedding_functions
+from embedding_cache import EmbeddingCache
 
 # Path to ChromaDB persistence directory
 CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", os.path.join(os.path.dirname(__file__), '../data/chroma_db'))
 
-async def index_products():
+# Memory-mapped copies of each collection for the chat workers to share
+# (contoso_chat/embedding_store.py): a <name>.<generation>.npy matrix plus the
+# <name>.json sidecar that names it.
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH") or os.path.join(
+    os.path.dirname(os.path.normpath(CHROMA_DB_PATH)), "embeddings"
+)
+
+# Vectors of texts embedded by earlier runs, keyed by model and text hash
+# (embedding_cache.py), so a reindex only embeds what changed.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.normpath(CHROMA_DB_PATH)), "embedding-cache"
+)
+
+# A prebuilt index (`--build-artifact`) baked into the image or mounted here.
+# `--if-stale` installs it instead of indexing when it matches the catalogue.
+INDEX_ARTIFACT_PATH = os.getenv("INDEX_ARTIFACT_PATH") or os.path.join(
+    os.path.dirname(os.path.normpath(CHROMA_DB_PATH)), "index-artifact"
+)
+# Bump when the index layout or document format changes; older artifacts are
+# then stale whatever their fingerprint.
+INDEX_FORMAT_VERSION = 1
+# Chroma's DefaultEmbeddingFunction; part of the fingerprint so a model change
+# invalidates every artifact built with the old one.
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+MANIFEST = "manifest.json"
+ARTIFACT_PARTS = ("chroma_db", "embeddings")
+
+# The storefront catalogue: products.json plus the manuals/ it links to. The
+# chat image copies it to the same place relative to this script.
+PRODUCT_CATALOG_DIR = os.getenv(
+    "PRODUCT_CATALOG_DIR", os.path.join(os.path.dirname(__file__), '../../apps/web/public')
+)
+MANUAL_CHUNK_SIZE = int(os.getenv("MANUAL_CHUNK_SIZE", "800"))
+MANUAL_CHUNK_OVERLAP = int(os.getenv("MANUAL_CHUNK_OVERLAP", "120"))
+# Chunks sent to the embedding model per upsert; bounds peak memory.
+MANUAL_EMBED_BATCH = int(os.getenv("MANUAL_EMBED_BATCH", "64"))
+# Products per cursor fetch and per embedding batch. One batch is embedded
+# while the next is fetched, so memory holds about two batches whatever the
+# size of the catalogue.
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))
+
+# Same as db.normalize_dsn in the chat service, which this script cannot
+# import: Prisma-only connection-string parameters that asyncpg rejects.
+PRISMA_ONLY_QUERY_KEYS = frozenset(
+    {
+        "schema",
+        "connection_limit",
+        "connect_timeout",
+        "pool_timeout",
+        "pgbouncer",
+        "socket_timeout",
+        "sslcert",
+        "sslidentity",
+        "sslpassword",
+    }
+)
+
+# Identifiers are quoted: Prisma maps models to PascalCase tables and fields
+# to camelCase columns. Ordered so the catalogue fingerprint is stable.
+PRODUCT_COUNT_QUERY = 'SELECT count(*) FROM "Product"'
+PRODUCTS_QUERY = """
+SELECT p.id, p.name, p.description, p.price, p.slug,
+       c.name AS category, b.name AS brand
+  FROM "Product" p
+  LEFT JOIN "Category" c ON c.id = p."categoryId"
+  LEFT JOIN "Brand" b ON b.id = p."brandId"
+ ORDER BY p.id
+"""
+
+
+class EmbeddingStoreWriter:
+    """Writes the store `name` a batch at a time: a unit-row float32 .npy
+    matrix and its JSON sidecar (see contoso_chat/embedding_store.py).
+
+    Rows go straight into a memory-mapped .npy of the final size, and the
+    sidecar's arrays into part files joined at the end, so the catalogue is
+    never held in memory.
+
+    Each run writes its matrix under a new generation name,
+    `<name>.<generation>.npy`, and the sidecar records that name. Renaming the
+    sidecar into place is then the only swap: a worker opening the store, or
+    an indexer that crashed half way, sees either the old pair or the new
+    one, never new vectors with old rows. The previous generation's matrix is
+    kept for workers that read the old sidecar a moment before the swap;
+    older ones are removed. Workers that already have a matrix mapped keep
+    reading it until they restart.
+    """
+
+    SIDECAR_KEYS = ("ids", "metadatas", "documents")
+
+    def __init__(self, name, rows, store_path=None):
+        self.name = name
+        self.rows = rows
+        self.store_path = store_path or EMBEDDING_STORE_PATH
+        os.makedirs(self.store_path, exist_ok=True)
+        self.target = os.path.join(self.store_path, name)
+        generation = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.vectors_name = f"{name}.{generation}.npy"
+        self.written = 0
+        self.matrix = None
+        self.parts = {
+            key: open(f"{self.target}.{key}.tmp", "w+", encoding="utf-8") for key in self.SIDECAR_KEYS
+        }
+
+    def add(self, ids, embeddings, metadatas, documents):
+        batch = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        batch = np.divide(batch, norms, out=np.zeros_like(batch), where=norms > 0)
+        if self.matrix is None:
+            self.matrix = np.lib.format.open_memmap(
+                self.vectors_path + ".tmp", mode="w+", dtype=np.float32, shape=(self.rows, batch.shape[1])
+            )
+        self.matrix[self.written:self.written + len(ids)] = batch
+        for key, values in zip(self.SIDECAR_KEYS, (ids, metadatas, documents)):
+            for number, value in enumerate(values):
+                separator = "," if self.written + number else ""
+                self.parts[key].write(separator + json.dumps(value))
+        self.written += len(ids)
+
+    def close(self):
+        if self.written != self.rows:
+            raise RuntimeError(f"Expected {self.rows} {self.name} rows, wrote {self.written}")
+        if self.matrix is None:
+            with open(self.vectors_path + ".tmp", "wb") as handle:
+                np.save(handle, np.zeros((0, 0), dtype=np.float32))
+        else:
+            self.matrix.flush()
+            self.matrix = None
+        with open(f"{self.target}.json.tmp", "w", encoding="utf-8") as sidecar:
+            sidecar.write(f'{{"vectors": {json.dumps(self.vectors_name)}')
+            for key in self.SIDECAR_KEYS:
+                sidecar.write(f', "{key}": [')
+                part = self.parts[key]
+                part.seek(0)
+                shutil.copyfileobj(part, sidecar)
+                part.close()
+                os.remove(part.name)
+                sidecar.write("]")
+            sidecar.write("}")
+        # Nothing names the new matrix yet, so renaming it cannot be seen.
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(f"{self.target}.json.tmp", f"{self.target}.json")
+        # Generation names sort by time; an unversioned <name>.npy predates them.
+        older = glob.glob(f"{self.target}.npy") + sorted(
+            path for path in glob.glob(f"{self.target}.*.npy") if path != self.vectors_path
+        )
+        for stale in older[:-1]:
+            os.remove(stale)
+        print(f"Wrote {self.written} {self.name} embeddings to {self.store_path}")
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.store_path, self.vectors_name)
+
+
+def split_sections(text):
+    """(heading path, body) pairs for a markdown manual, in document order."""
+    title = ""
+    headings = []
+    sections = []
+    body = []
+
+    def flush():
+        content = "\n".join(body).strip()
+        if content:
+            sections.append((" > ".join([title, *headings] if title else headings), content))
+        body.clear()
+
+    for line in text.splitlines():
+        heading = re.match(r"^(#{1,6})\s+(.*)", line)
+        if not heading:
+            body.append(line)
+            continue
+        flush()
+        level, name = len(heading.group(1)), heading.group(2).strip()
+        if level == 1:
+            title, headings = name, []
+        else:
+            headings = headings[: level - 2] + [name]
+    flush()
+    return title, sections
+
+
+def chunk_text(text, size=MANUAL_CHUNK_SIZE, overlap=MANUAL_CHUNK_OVERLAP):
+    """Windows of about `size` characters overlapping by `overlap`, cut at line ends where possible."""
+    if len(text) <= size:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            newline = text.rfind("\n", start + size // 2, end)
+            if newline != -1:
+                end = newline
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+def pack_sections(sections, size=MANUAL_CHUNK_SIZE, overlap=MANUAL_CHUNK_OVERLAP):
+    """(first heading, text) chunks: short sections packed together, long ones windowed.
+
+    Each section keeps its heading path in the text, so a passage still says
+    which product and section it is from.
+    """
+    chunks = []
+    packed, packed_heading, packed_size = [], "", 0
+
+    def flush():
+        if packed:
+            chunks.append((packed_heading, "\n\n".join(packed)))
+            packed.clear()
+
+    for heading, body in sections:
+        block = f"{heading}\n{body}" if heading else body
+        if len(block) > size:
+            flush()
+            chunks.extend((heading, f"{heading}\n{piece}" if heading else piece) for piece in chunk_text(body, size, overlap))
+            continue
+        if packed and packed_size + len(block) > size:
+            flush()
+        if not packed:
+            packed_heading, packed_size = heading, 0
+        packed.append(block)
+        packed_size += len(block) + 2
+    flush()
+    return chunks
+
+
+def manual_chunks(catalog_dir, product_ids):
+    """Chunk every manual products.json links to, once per manual file.
+
+    Product manuals are parented to their product (`product_ids` maps slugs
+    to database ids); the per-category manuals that most products share are
+    parented to the manual instead of being indexed once per product.
+    """
+    with open(os.path.join(catalog_dir, "products.json"), encoding="utf-8") as handle:
+        catalog = json.load(handle)
+
+    owners = {}
+    for item in catalog:
+        if item.get("manual"):
+            owners.setdefault(item["manual"], []).append(item)
+
+    documents, metadatas, ids = [], [], []
+    for manual, items in sorted(owners.items()):
+        path = os.path.join(catalog_dir, manual.lstrip("/"))
+        if not os.path.isfile(path):
+            print(f"Manual {manual} not found; skipping.")
+            continue
+        with open(path, encoding="utf-8") as handle:
+            title, sections = split_sections(handle.read())
+
+        meta = {"manual": manual, "title": title or manual, "category": items[0].get("category") or "Unknown"}
+        if len(items) == 1:
+            meta.update(
+                parent=items[0].get("slug") or manual,
+                name=items[0]["name"],
+                brand=items[0].get("brand") or "Unknown",
+                product_id=product_ids.get(items[0].get("slug"), ""),
+            )
+        else:
+            meta.update(parent=manual, name=f"All {meta['category']}")
+
+        for number, (heading, chunk) in enumerate(pack_sections(sections)):
+            documents.append(chunk)
+            metadatas.append({**meta, "section": heading, "chunk": number})
+            ids.append(f"{manual}#{number}")
+    return documents, metadatas, ids
+
+
+def catalog_slugs():
+    """Slugs products.json links manuals to; only these need a database id."""
+    try:
+        with open(os.path.join(PRODUCT_CATALOG_DIR, "products.json"), encoding="utf-8") as handle:
+            return {item.get("slug") for item in json.load(handle) if item.get("manual")}
+    except OSError:
+        return set()
+
+
+def load_manual_chunks(product_ids):
+    catalog = os.path.join(PRODUCT_CATALOG_DIR, "products.json")
+    if not os.path.isfile(catalog):
+        print(f"No product catalogue at {catalog}. Skipping manual indexing.")
+        return None
+    return manual_chunks(PRODUCT_CATALOG_DIR, product_ids)
+
+
+def product_records(rows):
+    """(documents, metadatas, ids) for the "products" collection."""
+    documents = []
+    metadatas = []
+    ids = []
+
+    for row in rows:
+        category_name = row["category"] or "Unknown"
+        brand_name = row["brand"] or "Unknown"
+
+        doc_text = f"Product: {row['name']}\nCategory: {category_name}\nBrand: {brand_name}\nDescription: {row['description'] or ''}\nPrice: ${row['price']}"
+        documents.append(doc_text)
+
+        metadatas.append({
+            "id": row["id"],
+            "name": row["name"],
+            "price": row["price"],
+            "slug": row["slug"],
+            "category": category_name,
+            "brand": brand_name
+        })
+
+        ids.append(row["id"])
+    return documents, metadatas, ids
+
+
+def new_fingerprint():
+    """A sha256 over everything that would be embedded, and how; fed with
+    `add_to_fingerprint`.
+
+    Equal fingerprints mean indexing again would produce the same index, so
+    an index built for this fingerprint can be used as is. Records are
+    hashed one at a time, so the batch size does not change it.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([INDEX_FORMAT_VERSION, EMBEDDING_MODEL]).encode("utf-8"))
+    return digest
+
+
+def add_to_fingerprint(digest, records):
+    documents, metadatas, ids = records
+    for record in zip(ids, documents, metadatas):
+        digest.update(json.dumps(record, sort_keys=True, default=str).encode("utf-8"))
+
+
+def file_checksums(root):
+    """sha256 of every file in the artifact's index directories, by relative path."""
+    checksums = {}
+    for part in ARTIFACT_PARTS:
+        for directory, _, files in os.walk(os.path.join(root, part)):
+            for name in files:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, root).replace(os.sep, "/")
+                digest = hashlib.sha256()
+                with open(path, "rb") as handle:
+                    for block in iter(lambda: handle.read(1 << 20), b""):
+                        digest.update(block)
+                checksums[relative] = digest.hexdigest()
+    return dict(sorted(checksums.items()))
+
+
+def read_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def verified_artifact(artifact_dir, fingerprint):
+    """The artifact's manifest if it is complete, intact and current; else None."""
+    manifest = read_manifest(os.path.join(artifact_dir, MANIFEST))
+    if manifest is None:
+        print(f"No index artifact at {artifact_dir}.")
+        return None
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        print(f"Index artifact format {manifest.get('format_version')} is not {INDEX_FORMAT_VERSION}; ignoring it.")
+        return None
+    if manifest.get("catalog_fingerprint") != fingerprint:
+        print("Index artifact was built from a different catalogue; ignoring it.")
+        return None
+    if file_checksums(artifact_dir) != manifest.get("files"):
+        print("Index artifact fails its checksums; ignoring it.")
+        return None
+    return manifest
+
+
+def install_artifact(artifact_dir, manifest):
+    """Copy the artifact's Chroma directory and embedding store into place.
+
+    Chroma writes to its directory, so a baked or mounted (read-only)
+    artifact is copied rather than used where it is.
+    """
+    for source, target in zip(ARTIFACT_PARTS, (CHROMA_DB_PATH, EMBEDDING_STORE_PATH)):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(os.path.join(artifact_dir, source), target)
+    write_manifest(EMBEDDING_STORE_PATH, manifest)
+    print(f"Installed index artifact built {manifest.get('built_at')} ({manifest.get('products')} products).")
+
+
+def write_manifest(directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{MANIFEST}.tmp"), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(os.path.join(directory, f"{MANIFEST}.tmp"), os.path.join(directory, MANIFEST))
+
+
+def index_manuals(client, ef, chunks, chroma_path, store_path, cache):
+    documents, metadatas, ids = chunks
+    # Rebuilt from scratch each run, so a shortened manual leaves no stale chunks.
+    try:
+        client.delete_collection(name="manuals")
+    except Exception:
+        pass
+    collection = client.get_or_create_collection(name="manuals", embedding_function=ef)
+    writer = EmbeddingStoreWriter("manuals", len(ids), store_path)
+    for start in range(0, len(ids), MANUAL_EMBED_BATCH):
+        end = start + MANUAL_EMBED_BATCH
+        index_batch(collection, ef, writer, (documents[start:end], metadatas[start:end], ids[start:end]), cache)
+    writer.close()
+    print(f"Successfully indexed {len(ids)} manual chunks to {chroma_path}")
+
+
+def index_batch(collection, ef, writer, records, cache):
+    """Embed one batch once, for both Chroma and the embedding store.
+
+    Only texts the cache has not seen reach the embedding model.
+    """
+    documents, metadatas, ids = records
+    embeddings = cache.embed(documents, ef)
+    # upsert is idempotent (updates if ID exists, otherwise inserts)
+    collection.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+    writer.add(ids, embeddings, metadatas, documents)
+    return len(ids)
+
+
+def normalize_dsn(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    kept = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in PRISMA_ONLY_QUERY_KEYS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(kept)))
+
+
+async def connect():
+    dsn = os.environ.get("DATABASE_URL")
+    if not dsn:
+        raise RuntimeError("DATABASE_URL is not set.")
+    return await asyncpg.connect(normalize_dsn(dsn))
+
+
+async def product_batches(connection, size=INDEX_BATCH_SIZE):
+    """Products joined to their category and brand, `size` rows at a time.
+
+    A server-side cursor, so only the current batch is ever client-side. It
+    has to run inside a transaction.
+    """
+    batch = []
+    async for row in connection.cursor(PRODUCTS_QUERY, prefetch=size):
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def fingerprint_catalog(connection):
+    """The catalogue fingerprint, from one pass over the products; embeds nothing."""
+    digest = new_fingerprint()
+    wanted = catalog_slugs()
+    product_ids = {}
+    async for rows in product_batches(connection):
+        add_to_fingerprint(digest, product_records(rows))
+        product_ids.update((row["slug"], row["id"]) for row in rows if row["slug"] in wanted)
+    manuals = load_manual_chunks(product_ids)
+    if manuals is not None:
+        add_to_fingerprint(digest, manuals)
+    return digest.hexdigest()
+
+
+async def build_index(connection, count, chroma_path, store_path):
+    """Stream, embed and write the products, then the manual chunks.
+
+    Returns the manifest describing what was built.
+    """
+    os.makedirs(chroma_path, exist_ok=True)
+
+    client = chromadb.PersistentClient(path=chroma_path)
+    ef = embedding_functions.DefaultEmbeddingFunction()
+
+    # get_or_create_collection is idempotent
+    collection = client.get_or_create_collection(name="products", embedding_function=ef)
+    cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL)
+    writer = EmbeddingStoreWriter("products", count, store_path)
+    digest = new_fingerprint()
+    wanted = catalog_slugs()
+    product_ids = {}
+
+    indexed = 0
+    pending = None
+    async for rows in product_batches(connection):
+        records = product_records(rows)
+        add_to_fingerprint(digest, records)
+        product_ids.update((row["slug"], row["id"]) for row in rows if row["slug"] in wanted)
+        if pending is not None:
+            indexed += await pending
+        # Embedding runs in a worker thread while the cursor fetches the next batch.
+        pending = asyncio.ensure_future(asyncio.to_thread(index_batch, collection, ef, writer, records, cache))
+    if pending is not None:
+        indexed += await pending
+    writer.close()
+    print(f"Successfully indexed {indexed} products to {chroma_path}")
+
+    # Chunk and index the product manuals into their own collection
+    manuals = load_manual_chunks(product_ids)
+    if manuals is not None:
+        add_to_fingerprint(digest, manuals)
+        index_manuals(client, ef, manuals, chroma_path, store_path, cache)
+    print(cache.report())
+
+    return {
+        "format_version": INDEX_FORMAT_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "catalog_fingerprint": digest.hexdigest(),
+        "built_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "products": indexed,
+        "manual_chunks": len(manuals[2]) if manuals else 0,
+    }
+
+
+async def index_products(if_stale=False, artifact_dir=None):
+    """Index the catalogue into CHROMA_DB_PATH, or into `artifact_dir`.
+
+    With `if_stale`, an index already built for this catalogue is kept, and a
+    matching artifact at INDEX_ARTIFACT_PATH is installed instead of
+    embedding anything. Only when neither matches does it index live.
+    """
     print("Starting local product indexing...")
-    
+
+    connection = None
     try:
-        # 1. Fetch products from DB
-        db = Prisma()
-        await db.connect()
-        products = await db.product.find_many(include={'category': True, 'brand': True})
-        await db.disconnect()
-        
-        if not products:
-            print("No products found in database. Skipping indexing.")
-            return
-
-        print(f"Fetched {len(products)} products from database.")
-
-        # 2. Initialize ChromaDB
-        os.makedirs(CHROMA_DB_PATH, exist_ok=True)
-        
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        ef = embedding_functions.DefaultEmbeddingFunction()
-        
-        # get_or_create_collection is idempotent
-        collection = client.get_or_create_collection(name="products", embedding_function=ef)
-
-        # 3. Prepare data
-        documents = []
-        metadatas = []
-        ids = []
-
-        for p in products:
-            category_name = p.category.name if p.category else "Unknown"
-            brand_name = p.brand.name if p.brand else "Unknown"
-            
-            doc_text = f"Product: {p.name}\nCategory: {category_name}\nBrand: {brand_name}\nDescription: {p.description or ''}\nPrice: ${p.price}"
-            documents.append(doc_text)
-            
-            metadatas.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "slug": p.slug,
-                "category": category_name,
-                "brand": brand_name
-            })
-            
-            ids.append(p.id)
-
-        # 4. Add to ChromaDB
-        if ids:
-            # upsert is idempotent (updates if ID exists, otherwise inserts)
-            collection.upsert(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            print(f"Successfully indexed {len(ids)} products to {CHROMA_DB_PATH}")
+        # 1. Read the catalogue from one snapshot, so the fingerprint pass and
+        # the indexing pass see the same products
+        connection = await connect()
+        async with connection.transaction(isolation="repeatable_read", readonly=True):
+            count = await connection.fetchval(PRODUCT_COUNT_QUERY)
+            if not count:
+                print("No products found in database. Skipping indexing.")
+                return
+
+            print(f"Streaming {count} products from database.")
+
+            if artifact_dir:
+                # 2a. Offline build: a self-contained, checksummed artifact
+                for part in (*ARTIFACT_PARTS, MANIFEST):
+                    target = os.path.join(artifact_dir, part)
+                    if os.path.isdir(target):
+                        shutil.rmtree(target)
+                    elif os.path.exists(target):
+                        os.remove(target)
+                manifest = await build_index(
+                    connection, count, os.path.join(artifact_dir, "chroma_db"), os.path.join(artifact_dir, "embeddings")
+                )
+                manifest["files"] = file_checksums(artifact_dir)
+                write_manifest(artifact_dir, manifest)
+                print(f"Wrote index artifact {manifest['catalog_fingerprint'][:12]} to {artifact_dir}")
+                return
+
+            if if_stale:
+                # 2b. Reuse what is already current
+                fingerprint = await fingerprint_catalog(connection)
+                installed = read_manifest(os.path.join(EMBEDDING_STORE_PATH, MANIFEST))
+                if installed and installed.get("catalog_fingerprint") == fingerprint and os.path.isdir(CHROMA_DB_PATH):
+                    print(f"Local index {fingerprint[:12]} is current. Skipping indexing.")
+                    return
+                artifact = verified_artifact(INDEX_ARTIFACT_PATH, fingerprint)
+                if artifact is not None:
+                    install_artifact(INDEX_ARTIFACT_PATH, artifact)
+                    return
+                print("Falling back to live indexing.")
+
+            # 2c. Live indexing
+            manifest = await build_index(connection, count, CHROMA_DB_PATH, EMBEDDING_STORE_PATH)
+            write_manifest(EMBEDDING_STORE_PATH, manifest)
     except Exception as e:
         print(f"Error during indexing: {e}", file=sys.stderr)
         traceback.print_exc()
         raise
+    finally:
+        if connection is not None:
+            await connection.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Index the product catalogue for local vector search.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--if-stale",
+        action="store_true",
+        help="keep a current index, or install a matching artifact from INDEX_ARTIFACT_PATH, before indexing live",
+    )
+    mode.add_argument(
+        "--build-artifact",
+        metavar="DIR",
+        help="build a versioned, checksummed index artifact in DIR instead of the live index",
+    )
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(index_products())
+        asyncio.run(index_products(if_stale=args.if_stale, artifact_dir=args.build_artifact))
     except Exception:
         # chat-entrypoint.sh retries this command while it exits nonzero, so a
         # failed attempt has to be visible as one.
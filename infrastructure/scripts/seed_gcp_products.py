@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Idempotent script to seed product data into Google Cloud Discovery Engine.
-This script creates the search datastore, uploads documents, and configures embeddings.
+This script creates the search datastore, uploads documents, and optionally their embeddings.
 """
 
 import os
@@ -9,7 +9,7 @@ import sys
 import csv
 import json
 import logging
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from pathlib import Path
 
 from google.cloud import discoveryengine_v1
@@ -17,12 +17,27 @@ from google.api_core import exceptions
 import vertexai
 from vertexai.language_models import TextEmbeddingModel
 
+from embedding_cache import EmbeddingCache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "textembedding-gecko@003"
+# Shared with index_products_local.py; entries are keyed by model, so the two
+# never read each other's vectors.
+DEFAULT_EMBEDDING_CACHE_DIR = Path(__file__).resolve().parents[1] / "data" / "embedding-cache"
+
 class ProductSeeder:
-    def __init__(self, project_id: str, region: str, datastore_id: str, location: str = "global"):
+    def __init__(
+        self,
+        project_id: str,
+        region: str,
+        datastore_id: str,
+        location: str = "global",
+        cache_dir: Optional[str] = None,
+        embedding_field: Optional[str] = None,
+    ):
         self.project_id = project_id
         self.region = region
         self.location = location
@@ -36,7 +51,14 @@ class ProductSeeder:
         self.parent = f"projects/{project_id}/locations/{location}/dataStores/{datastore_id}/branches/default_branch"
 
         # Initialize embedding model
-        self.embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko@003")
+        self.embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+        # Descriptions embedded by an earlier run are not sent to the model again
+        self.embedding_cache = EmbeddingCache(
+            cache_dir or os.getenv("EMBEDDING_CACHE_DIR") or str(DEFAULT_EMBEDDING_CACHE_DIR),
+            EMBEDDING_MODEL,
+        )
+        # The schema's embedding-vector field, for custom embeddings
+        self.embedding_field = embedding_field or os.getenv("DISCOVERY_ENGINE_EMBEDDING_FIELD")
 
     def check_datastore_exists(self) -> bool:
         """Check if the datastore exists."""
@@ -78,23 +100,27 @@ class ProductSeeder:
             logger.error(f"Error loading products from JSON: {e}")
             raise
 
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        return [embedding.values for embedding in self.embedding_model.get_embeddings(texts)]
+
     def generate_embeddings(self, text: str) -> List[float]:
-        """Generate embeddings for the given text."""
+        """Generate embeddings for the given text, from the cache when it has them."""
         try:
-            embeddings = self.embedding_model.get_embeddings([text])
-            return embeddings[0].values
+            return self.embedding_cache.embed([text], self._embed)[0].tolist()
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
             return []
 
     def create_document(self, product: Dict[str, Any]) -> discoveryengine_v1.Document:
-        """Create a Discovery Engine document from product data."""
-        doc_id = f"product_{product['id']}"
+        """Create a Discovery Engine document from product data.
 
-        # Generate embeddings for the product description
-        embeddings = self.generate_embeddings(product['description'])
+        The description is stored once, in `struct_data`; searches project
+        their results from it. Discovery Engine ignores `derived_struct_data`
+        on import, so the vector is only generated and stored when the schema
+        has a field for it (`DISCOVERY_ENGINE_EMBEDDING_FIELD`).
+        """
+        doc_id = f"product_{product['id']}"
 
-        # Create structured data
         struct_data = {
             "id": product['id'],
             "name": product['name'],
@@ -103,31 +129,14 @@ class ProductSeeder:
             "brand": product['brand'],
             "description": product['description'],
             "url": f"/products/{product['name'].lower().replace(' ', '-')}",
-            "content": product['description']
         }
 
-        document = discoveryengine_v1.Document(
-            id=doc_id,
-            struct_data=struct_data,
-            content=discoveryengine_v1.Document.Content(
-                mime_type="text/plain",
-                raw_bytes=product['description'].encode('utf-8')
-            )
-        )
+        if self.embedding_field:
+            embeddings = self.generate_embeddings(product['description'])
+            if embeddings:
+                struct_data[self.embedding_field] = embeddings
 
-        # Add embeddings if generated successfully
-        if embeddings:
-            document.derived_struct_data = {
-                "extractive_answers": [
-                    {
-                        "content": product['description'],
-                        "page_identifier": doc_id
-                    }
-                ],
-                "embeddings": embeddings
-            }
-
-        return document
+        return discoveryengine_v1.Document(id=doc_id, struct_data=struct_data)
 
     def document_exists(self, doc_id: str) -> bool:
         """Check if a document already exists."""
@@ -205,6 +214,8 @@ class ProductSeeder:
                 document = self.create_document(product)
                 documents.append(document)
 
+            logger.info(self.embedding_cache.report())
+
             # Upload documents
             logger.info(f"Uploading {len(documents)} documents...")
             results = self.batch_upload_documents(documents)
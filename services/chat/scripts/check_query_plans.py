@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Check the query plans of the chat service's SQL against a large dataset.
+
+`db.py`'s queries, and the ones `refresh_customer_summary` runs from the
+order triggers, filter orders by `"Order"."userId"` and join items on
+`"OrderItem"."orderId"`. On the seed data every plan is fast whatever it
+does. Only with production-sized tables does a missing index show up, as a
+sequential scan whose cost grows with every order anyone places.
+
+This seeds a synthetic catalogue, customers, orders and items into the
+database at `DATABASE_URL` (which must have the migrations applied), runs
+`EXPLAIN (ANALYZE, BUFFERS)` for every `_*QUERY` in `db.py` and every
+statement in `TRIGGER_QUERIES` against a sample of customers, and fails when:
+
+- a plan sequentially scans one of the tables the queries look rows up in, or
+- a query's median execution time exceeds `--budget-ms`.
+
+Everything runs in one transaction that is rolled back, so the database is
+left as it was, including the customer summary triggers it pauses while
+seeding. Point it at a local or throwaway database all the same: the
+seeded rows hold locks until the run ends.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "api"))
+
+import db  # noqa: E402
+
+# Tables looked up by key; a sequential scan of any of them is a regression.
+INDEXED_TABLES = ("User", "Order", "OrderItem", "Product", "CustomerSummary")
+PREFIX = "plan-check"
+SUMMARY_TRIGGER_TABLES = ("Order", "OrderItem")
+
+# The per-customer statements of `refresh_customer_summary` (the
+# customer_summary migration), with `customer_id` as `$1`. EXPLAIN on the
+# function call does not show the plans inside it, and every order write runs
+# these, so they are checked as written there.
+TRIGGER_QUERIES = {
+    "refresh_customer_summary: totals": """
+SELECT count(*) AS order_count,
+       COALESCE(sum(total), 0) AS total_spent,
+       max(date) AS last_order_at
+  FROM "Order"
+ WHERE "userId" = $1
+""",
+    "refresh_customer_summary: recent purchases": """
+SELECT DISTINCT ON (p.id)
+       p.name, c.name AS category, b.name AS brand,
+       o.date AS "purchasedAt"
+  FROM "Order" o
+  JOIN "OrderItem" i ON i."orderId" = o.id
+  JOIN "Product" p ON p.id = i."productId"
+  JOIN "Category" c ON c.id = p."categoryId"
+  JOIN "Brand" b ON b.id = p."brandId"
+ WHERE o."userId" = $1
+ ORDER BY p.id, o.date DESC
+""",
+    "refresh_customer_summary: favourite categories": """
+SELECT c.name, sum(i.quantity) AS quantity
+  FROM "Order" o
+  JOIN "OrderItem" i ON i."orderId" = o.id
+  JOIN "Product" p ON p.id = i."productId"
+  JOIN "Category" c ON c.id = p."categoryId"
+ WHERE o."userId" = $1
+ GROUP BY c.name
+ ORDER BY quantity DESC, c.name
+ LIMIT 3
+""",
+    "refresh_customer_summary: favourite brands": """
+SELECT b.name, sum(i.quantity) AS quantity
+  FROM "Order" o
+  JOIN "OrderItem" i ON i."orderId" = o.id
+  JOIN "Product" p ON p.id = i."productId"
+  JOIN "Brand" b ON b.id = p."brandId"
+ WHERE o."userId" = $1
+ GROUP BY b.name
+ ORDER BY quantity DESC, b.name
+ LIMIT 3
+""",
+}
+
+SEED_STATEMENTS = (
+    f"""
+    INSERT INTO "Category" (id, name, slug)
+    VALUES ('{PREFIX}-category', '{PREFIX} category', '{PREFIX}-category')
+    """,
+    f"""
+    INSERT INTO "Brand" (id, name, slug)
+    VALUES ('{PREFIX}-brand', '{PREFIX} brand', '{PREFIX}-brand')
+    """,
+    f"""
+    INSERT INTO "Product" (id, name, price, "categoryId", "brandId", slug, "updatedAt")
+    SELECT '{PREFIX}-product-' || n, '{PREFIX} product ' || n, 10 + n % 500,
+           '{PREFIX}-category', '{PREFIX}-brand', '{PREFIX}-product-' || n, now()
+      FROM generate_series(1, $1::int) AS n
+    """,
+    f"""
+    INSERT INTO "User" (id, email, password, "firstName", membership, "updatedAt")
+    SELECT '{PREFIX}-user-' || n, '{PREFIX}-' || n || '@example.com', 'unused',
+           'Customer ' || n, 'Base', now()
+      FROM generate_series(1, $1::int) AS n
+    """,
+    f"""
+    INSERT INTO "Order" (id, "userId", date, total, "updatedAt")
+    SELECT '{PREFIX}-order-' || n, '{PREFIX}-user-' || (1 + n % $2::int),
+           now() - n * interval '1 minute', 100, now()
+      FROM generate_series(1, $1::int) AS n
+    """,
+    f"""
+    INSERT INTO "OrderItem" (id, "orderId", "productId", quantity, price)
+    SELECT '{PREFIX}-item-' || n, '{PREFIX}-order-' || (1 + n % $1::int),
+           '{PREFIX}-product-' || (1 + n % $2::int), 1 + n % 3, 10
+      FROM generate_series(1, $3::int) AS n
+    """,
+)
+
+
+@dataclass
+class QueryReport:
+    name: str
+    execution_ms: list[float] = field(default_factory=list)
+    planning_ms: list[float] = field(default_factory=list)
+    shared_hit: int = 0
+    shared_read: int = 0
+    seq_scans: set[str] = field(default_factory=set)
+
+    @property
+    def median_ms(self) -> float:
+        return statistics.median(self.execution_ms) if self.execution_ms else 0.0
+
+    def problems(self, budget_ms: float) -> list[str]:
+        found = [
+            f"{self.name}: sequential scan on \"{table}\"" for table in sorted(self.seq_scans)
+        ]
+        if self.median_ms > budget_ms:
+            found.append(
+                f"{self.name}: median execution {self.median_ms:.2f} ms exceeds the {budget_ms:g} ms budget"
+            )
+        return found
+
+
+def plan_nodes(plan: dict[str, Any]) -> list[dict[str, Any]]:
+    """Every node of an EXPLAIN (FORMAT JSON) plan tree, depth first."""
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def record_plan(report: QueryReport, explained: dict[str, Any], tables: tuple[str, ...]) -> None:
+    report.execution_ms.append(float(explained.get("Execution Time", 0.0)))
+    report.planning_ms.append(float(explained.get("Planning Time", 0.0)))
+    root = explained["Plan"]
+    report.shared_hit += int(root.get("Shared Hit Blocks", 0))
+    report.shared_read += int(root.get("Shared Read Blocks", 0))
+    for node in plan_nodes(root):
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in tables:
+            report.seq_scans.add(node["Relation Name"])
+
+
+def chat_queries() -> dict[str, str]:
+    """The `_*QUERY` statements in db.py, as the schema drift test finds them."""
+    return {
+        name: value
+        for name, value in vars(db).items()
+        if name.startswith("_") and name.endswith("QUERY") and isinstance(value, str)
+    }
+
+
+def plan_queries() -> dict[str, str]:
+    """Everything the harness explains: db.py's queries, then the trigger's."""
+    return {**chat_queries(), **TRIGGER_QUERIES}
+
+
+async def seed(connection: Any, args: argparse.Namespace) -> None:
+    orders = args.customers * args.orders_per_customer
+    items = orders * args.items_per_order
+    category, brand, products, users, order_rows, item_rows = SEED_STATEMENTS
+    await connection.execute(category)
+    await connection.execute(brand)
+    await connection.execute(products, args.products)
+    await connection.execute(users, args.customers)
+    # The customer summary triggers would rebuild a summary for every seeded
+    # row; build each customer's once, afterwards, instead.
+    for table in SUMMARY_TRIGGER_TABLES:
+        await connection.execute(f'ALTER TABLE "{table}" DISABLE TRIGGER USER')
+    await connection.execute(order_rows, orders, args.customers)
+    await connection.execute(item_rows, orders, args.products, items)
+    for table in SUMMARY_TRIGGER_TABLES:
+        await connection.execute(f'ALTER TABLE "{table}" ENABLE TRIGGER USER')
+    await connection.execute(
+        f"""SELECT refresh_customer_summary(id) FROM "User" WHERE id LIKE '{PREFIX}-user-%'"""
+    )
+    # Fresh statistics, so the planner sees the tables at their seeded size.
+    for table in INDEXED_TABLES:
+        await connection.execute(f'ANALYZE "{table}"')
+
+
+async def explain(connection: Any, args: argparse.Namespace) -> list[QueryReport]:
+    step = max(1, args.customers // args.samples)
+    customers = [f"{PREFIX}-user-{n}" for n in range(1, args.customers + 1, step)][: args.samples]
+    reports = []
+    for name, sql in plan_queries().items():
+        report = QueryReport(name)
+        for customer_id in customers:
+            raw = await connection.fetchval(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", customer_id
+            )
+            explained = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+            record_plan(report, explained, args.tables)
+        reports.append(report)
+    return reports
+
+
+async def run(args: argparse.Namespace) -> list[QueryReport]:
+    connection = await db.connect()
+    try:
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            await seed(connection, args)
+            return await explain(connection, args)
+        finally:
+            await transaction.rollback()
+    finally:
+        await connection.close()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--orders-per-customer", type=int, default=10)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=25, help="customers explained per query")
+    parser.add_argument("--budget-ms", type=float, default=25.0, help="median execution time per query")
+    parser.add_argument(
+        "--allow-seq-scan",
+        action="append",
+        default=[],
+        metavar="TABLE",
+        help="a table a sequential scan of is not a regression (repeatable)",
+    )
+    args = parser.parse_args(argv)
+    args.tables = tuple(table for table in INDEXED_TABLES if table not in args.allow_seq_scan)
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    reports = asyncio.run(run(args))
+
+    problems: list[str] = []
+    for report in reports:
+        print(
+            f"{report.name}: median {report.median_ms:.2f} ms, "
+            f"max {max(report.execution_ms, default=0.0):.2f} ms, "
+            f"planning {statistics.median(report.planning_ms or [0.0]):.2f} ms, "
+            f"buffers hit={report.shared_hit} read={report.shared_read}"
+        )
+        problems.extend(report.problems(args.budget_ms))
+
+    if problems:
+        print("Query plan check failed:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+
+    print(f"Query plan check passed: {len(reports)} queries within {args.budget_ms:g} ms, no sequential scans.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
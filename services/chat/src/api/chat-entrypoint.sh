@@ -15,9 +15,10 @@ if [[ "${provider}" == "local" ]]; then
     fi
 
     echo "Running local product indexing for vector search..."
-    # Retry in case DB is still starting up.
+    # A current index, or a matching prebuilt artifact, is reused; only a
+    # changed catalogue is embedded again. Retry in case DB is still starting up.
     for i in {1..5}; do
-        if python3 infrastructure/scripts/index_products_local.py; then
+        if python3 infrastructure/scripts/index_products_local.py --if-stale; then
             break
         fi
         echo "Indexing attempt ${i} failed; retrying in 5s..."
@@ -28,4 +29,6 @@ else
 fi
 
 echo "Starting Chat API..."
-exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers 1 --access-log
+# Workers share the memory-mapped embedding store (SEARCH_BACKEND=mapped)
+# through the page cache, so adding workers does not copy the index.
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${CHAT_WORKERS:-1}" --access-log
@@ -0,0 +1,299 @@
+"""Admission control for LLM generation.
+
+Nothing used to bound how many generations ran at once, so a burst of chat
+requests was handed straight to Ollama or Vertex. Ollama serialises past its
+parallel slots and Vertex starts returning quota errors; either way every
+request slowed down together and most ended in the generic fallback answer.
+
+Each (provider, model) pair gets a `ConcurrencyLimiter`: a fixed number of
+in-flight generations, a bounded wait queue with a timeout, and immediate
+rejection once that queue is full. Rejection raises `OverloadedError`, which
+`main.py` turns into a 429 with `Retry-After`, so overload shows up as a fast,
+retryable refusal instead of a request that hangs until something times out.
+Waiters are not served strictly in arrival order: `scheduling.py` orders them
+by traffic class and membership tier.
+
+Settings come from the environment. `LLM_MAX_CONCURRENCY`, `LLM_MAX_QUEUE`,
+`LLM_QUEUE_TIMEOUT_SECONDS` and `LLM_ADAPTIVE_CONCURRENCY` apply to every
+provider; `LLM_<PROVIDER>_...` (e.g. `LLM_LOCAL_MAX_CONCURRENCY`) overrides one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from .scheduling import DEFAULT_PRIORITY, Priority, WeightedFairQueue
+
+# Ollama runs a handful of parallel slots on one machine; Vertex is a shared
+# service whose ceiling is the project quota rather than a local GPU.
+DEFAULT_MAX_CONCURRENCY = {"local": 2, "gcp": 8}
+
+
+class OverloadedError(RuntimeError):
+    """The limiter refused a request rather than queue it (or queue it longer)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def provider_env(provider: str, name: str) -> str | None:
+    """`LLM_<PROVIDER>_<NAME>`, falling back to the shared `LLM_<NAME>`."""
+    return os.getenv(f"LLM_{provider.upper()}_{name}") or os.getenv(f"LLM_{name}")
+
+
+@dataclass(frozen=True)
+class LimiterConfig:
+    max_concurrency: int = 4
+    max_queue: int = 16
+    queue_timeout: float = 10.0
+    # AIMD: grow the limit by ~1 per limit's worth of fast completions, cut it
+    # by `backoff` when a completion fails or runs `latency_tolerance` times
+    # slower than the best latency seen recently.
+    adaptive: bool = False
+    min_concurrency: int = 1
+    max_adaptive_concurrency: int = 32
+    latency_tolerance: float = 2.0
+    backoff: float = 0.9
+
+    @classmethod
+    def from_env(cls, provider: str) -> LimiterConfig:
+        default = DEFAULT_MAX_CONCURRENCY.get(provider, cls.max_concurrency)
+        max_concurrency = int(provider_env(provider, "MAX_CONCURRENCY") or default)
+        return cls(
+            max_concurrency=max(1, max_concurrency),
+            max_queue=max(0, int(provider_env(provider, "MAX_QUEUE") or cls.max_queue)),
+            queue_timeout=float(provider_env(provider, "QUEUE_TIMEOUT_SECONDS") or cls.queue_timeout),
+            adaptive=(provider_env(provider, "ADAPTIVE_CONCURRENCY") or "0").lower() in ("1", "true", "yes"),
+            max_adaptive_concurrency=int(
+                provider_env(provider, "MAX_ADAPTIVE_CONCURRENCY") or max(max_concurrency, 32)
+            ),
+        )
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, config: LimiterConfig):
+        self.name = name
+        self.config = config
+        self.limit = float(config.max_concurrency)
+        self._in_flight = 0
+        self._waiters = WeightedFairQueue()
+        self._baseline_latency: float | None = None
+        self._mean_latency: float | None = None
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def has_capacity(self) -> bool:
+        """True when a request arriving now would start without queueing."""
+        return self._in_flight < int(self.limit) and not self.queue_depth
+
+    def saturated(self, priority: Priority = DEFAULT_PRIORITY) -> bool:
+        """True when a request arriving now would be refused outright."""
+        return (
+            self._in_flight >= int(self.limit)
+            and self.queue_depth >= self.config.max_queue
+            and not self._waiters.sheddable(priority)
+        )
+
+    def _overloaded(self) -> OverloadedError:
+        return OverloadedError(
+            f"{self.name} is at capacity ({self._in_flight} running, "
+            f"{self.queue_depth} queued)",
+            retry_after=self.retry_after(),
+        )
+
+    def check(self, priority: Priority = DEFAULT_PRIORITY) -> None:
+        """Reject now if a new request could not even join the queue.
+
+        Called before the expensive stages that precede generation, so a
+        request that is going to be refused does not run a DB lookup and a
+        search first. A full queue does not refuse a request that outranks
+        someone already waiting; that waiter is shed instead.
+        """
+        if self.saturated(priority):
+            self.rejected += 1
+            raise self._overloaded()
+
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up for a request arriving now."""
+        service_time = self._mean_latency or 1.0
+        waves = (self.queue_depth + 1) / max(int(self.limit), 1)
+        return max(1.0, math.ceil(service_time * waves))
+
+    @asynccontextmanager
+    async def acquire(
+        self, priority: Priority = DEFAULT_PRIORITY, timeout: float | None = None
+    ) -> AsyncIterator[None]:
+        """Hold a slot for the body; `timeout` can only shorten the queue timeout."""
+        queue_timeout = self.config.queue_timeout
+        if timeout is not None:
+            queue_timeout = min(queue_timeout, timeout)
+        await self._admit(priority, queue_timeout)
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self._observe(time.monotonic() - started, ok)
+            self._release()
+
+    async def _admit(self, priority: Priority, queue_timeout: float) -> None:
+        if self.has_capacity():
+            self._in_flight += 1
+            self.admitted += 1
+            self._record_wait(0.0)
+            return
+
+        self.check(priority)
+        if self.queue_depth >= self.config.max_queue:
+            self.rejected += 1
+            self._waiters.shed(priority, self._overloaded())
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.push(waiter, priority)
+        queued = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, queue_timeout)
+        except OverloadedError:
+            # Shed to make room for a heavier request; already counted.
+            raise
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            if isinstance(exc, TimeoutError):
+                self.timed_out += 1
+                raise OverloadedError(
+                    f"Timed out after {queue_timeout:g}s waiting for {self.name}",
+                    retry_after=self.retry_after(),
+                ) from exc
+            raise
+
+        self.admitted += 1
+        self._record_wait(time.monotonic() - queued)
+
+    def _release(self) -> None:
+        # A slot moves straight to the next waiter, so `_in_flight` only drops
+        # when nobody is queued or the limit has shrunk below it.
+        if self._in_flight <= int(self.limit):
+            waiter = self._waiters.pop()
+            if waiter is not None:
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _wake(self) -> None:
+        while self._in_flight < int(self.limit):
+            waiter = self._waiters.pop()
+            if waiter is None:
+                return
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def _record_wait(self, waited: float) -> None:
+        self.last_wait = waited
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _observe(self, latency: float, ok: bool) -> None:
+        if not ok:
+            self.failed += 1
+        else:
+            self._mean_latency = (
+                latency
+                if self._mean_latency is None
+                else self._mean_latency + (latency - self._mean_latency) * 0.2
+            )
+        if not self.config.adaptive:
+            return
+
+        if ok:
+            if self._baseline_latency is None or latency < self._baseline_latency:
+                self._baseline_latency = latency
+            else:
+                # Drift upwards slowly so one lucky fast call early on does not
+                # pin the baseline forever.
+                self._baseline_latency += (latency - self._baseline_latency) * 0.01
+
+        congested = not ok or (
+            self._baseline_latency is not None
+            and latency > self._baseline_latency * self.config.latency_tolerance
+        )
+        if congested:
+            self.limit = max(float(self.config.min_concurrency), self.limit * self.config.backoff)
+        elif self._in_flight >= int(self.limit):
+            # Only grow when the limit was the binding constraint.
+            self.limit = min(
+                float(self.config.max_adaptive_concurrency), self.limit + 1 / self.limit
+            )
+            self._wake()
+
+    def snapshot(self) -> dict[str, Any]:
+        completed = self.admitted - self._in_flight
+        return {
+            "limit": int(self.limit),
+            "adaptive": self.config.adaptive,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.config.max_queue,
+            "queue_timeout_seconds": self.config.queue_timeout,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "wait_seconds": {
+                "last": round(self.last_wait, 4),
+                "max": round(self.max_wait, 4),
+                "mean": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            },
+            "mean_latency_seconds": (
+                round(self._mean_latency, 4) if self._mean_latency is not None else None
+            ),
+            "completed": max(completed, 0),
+            "classes": self._waiters.snapshot(),
+        }
+
+
+_limiters: dict[tuple[str, str], ConcurrencyLimiter] = {}
+
+
+def get_limiter(provider: str, model: str) -> ConcurrencyLimiter:
+    key = (provider, model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = ConcurrencyLimiter(f"{provider}/{model}", LimiterConfig.from_env(provider))
+        _limiters[key] = limiter
+    return limiter
+
+
+def admission_snapshot() -> dict[str, Any]:
+    """Queue depth, wait times and counters for every limiter created so far."""
+    return {limiter.name: limiter.snapshot() for limiter in _limiters.values()}
+
+
+def reset_limiters() -> None:
+    _limiters.clear()
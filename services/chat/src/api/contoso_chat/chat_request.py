@@ -1,93 +1,325 @@
+import asyncio
+import dataclasses
 import json
+import logging
 import os
+import time
+from collections.abc import AsyncIterator, Sequence
 
+from . import scheduling
+from .admission import OverloadedError
+from .deadline import Deadline, DeadlineExceededError
+from .model_tiers import TieringConfig, choose_tier, record_tier_latency
+from .ollama import get_ollama_client
+from .personalization import profile_block
+from .provider_router import ProviderRouter, record_usage
+from .rerank import RetrievalConfig, retrieve
 from .search_service import get_search_service
 
+DEFAULT_BATCH_CONCURRENCY = 8
 
-async def get_customer_from_postgres(customer_id: str):
-    """Retrieves a customer's data from PostgreSQL."""
+logger = logging.getLogger(__name__)
+
+
+async def get_customer_from_postgres(customer_id: str, timeout: float | None = None):
+    """Retrieves a customer's name, membership and purchase summary from PostgreSQL.
+
+    Best effort: on any failure, including running past `timeout`, the
+    response continues for a guest rather than failing.
+    """
     if not customer_id:
         return None
     try:
         # Imported lazily so unit tests can exercise this module without a
         # database driver present, matching the previous client's behaviour.
-        from db import fetch_customer
+        from db import fetch_customer_summary
 
-        return await fetch_customer(customer_id)
+        return await asyncio.wait_for(fetch_customer_summary(customer_id, timeout=timeout), timeout)
     except Exception as e:
         print(f"Error retrieving customer from Postgres: {e}")
         return None
 
-async def generate_llm_response(prompt: str, context: str, user_name: str, provider: str, project_id: str, location: str, model_name: str):
-    """Generates a response using either local Ollama (via LiteLLM) or GCP Vertex AI."""
-    
-    system_instruction = f"""You are a knowledgeable and friendly outdoor gear expert for Contoso Outdoor. 
-    Your goal is to help {user_name} find the best equipment from our catalog.
-
-    Guidelines:
-    - Use the provided Catalog Context to answer the user's question accurately.
-    - Analyze product features (like waterproof materials, weight, or size) to make relevant recommendations.
-    - If multiple products are suitable, compare them to help the user choose.
-    - Be professional, helpful, and conversational.
-    - If the catalog doesn't contain the answer, politely let the user know and suggest the closest alternative.
+# The same for every request and first in every prompt, so a provider that
+# reuses a shared prefix can. Anything per shopper or per question goes in the
+# user message after it. It is far shorter than Gemini's minimum for implicit
+# or explicit context caching, so on its own it is not cached:
+# the cached count `record_usage` keeps shows whether anything is.
+SYSTEM_INSTRUCTION = """You are a knowledgeable and friendly outdoor gear expert for Contoso Outdoor.
+Your goal is to help the shopper find the best equipment from our catalog.
+
+Guidelines:
+- Use the provided Catalog Context to answer the user's question accurately.
+- Analyze product features (like waterproof materials, weight, or size) to make relevant recommendations.
+- If multiple products are suitable, compare them to help the user choose.
+- Be professional, helpful, and conversational.
+- If the catalog doesn't contain the answer, politely let the user know and suggest the closest alternative.
+"""
+
+
+def user_message(prompt: str, context: str, user_name: str, profile: str = "") -> str:
+    """The per-request part of the prompt: shopper, then catalog context, then question."""
+    shopper = f"You are helping {user_name}."
+    if profile:
+        shopper += f"\n{profile}"
+    return f"{shopper}\n\nCatalog Context:\n{context}\n\nUser Question: {prompt}"
+
+
+def _prompt_usage(response) -> tuple[int, int]:
+    """(prompt tokens, of which served from the context cache) of a Vertex response."""
+    usage = getattr(response, "usage_metadata", None)
+    return (
+        int(getattr(usage, "prompt_token_count", 0) or 0),
+        int(getattr(usage, "cached_content_token_count", 0) or 0),
+    )
+
+
+async def generate_llm_response(prompt: str, context: str, user_name: str, provider: str, project_id: str, location: str, model_name: str, profile: str = "", max_output_tokens: int | None = None):
+    """Generates a response using either local Ollama or GCP Vertex AI.
+
+    `model_name` is the Gemini or Ollama model, as the provider router's
+    spec names it. `profile` is the shopper profile from
+    `personalization.profile_block`. `max_output_tokens` caps the answer;
+    None leaves the model's own limit.
+    Prompt token counts, and Vertex's cached-content count, are recorded for
+    `/health/providers`.
     """
+    message = user_message(prompt, context, user_name, profile)
 
     if provider == "local":
-        try:
-            from litellm import completion
-        except ImportError as exc:
-            raise RuntimeError(
-                "Local LLM provider dependencies are not installed. "
-                "Rebuild with CHAT_INSTALL_LOCAL_STACK=1 or install requirements-local.txt."
-            ) from exc
-        api_base = os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")
-        local_model = os.getenv("LOCAL_MODEL_NAME", "gemma3:12b")
-        
-        response = completion(
-            model=f"ollama/{local_model}",
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": f"Catalog Context:\n{context}\n\nUser Question: {prompt}"}
+        # Async clients throughout: they let the admission limiter hold several
+        # generations in flight, and cancelling the awaiting task (timeout,
+        # hedge loser, client gone) actually abandons the HTTP call.
+        options = {"num_predict": max_output_tokens} if max_output_tokens else {}
+        reply = await get_ollama_client().chat(
+            [
+                {"role": "system", "content": SYSTEM_INSTRUCTION},
+                {"role": "user", "content": message}
             ],
-            api_base=api_base,
-            temperature=0.7
+            model=model_name,
+            temperature=0.7,
+            **options,
         )
-        return response.choices[0].message.content
+        # Ollama counts the prompt tokens it evaluated. A prefix it reused from
+        # the previous request's state is left out of that count, and it does
+        # not report it separately, so nothing is counted as cached.
+        record_usage(provider, int(reply.get("prompt_eval_count") or 0), 0)
+        return reply["message"]["content"]
     else:
         import vertexai
         from vertexai.generative_models import GenerativeModel
         vertexai.init(project=project_id, location=location)
-        model = GenerativeModel(model_name)
+        model = GenerativeModel(model_name, system_instruction=SYSTEM_INSTRUCTION)
 
-        full_prompt = f"{system_instruction}\n\nCatalog Context:\n{context}\n\nUser Question: {prompt}"
-        response = model.generate_content(full_prompt)
+        if max_output_tokens:
+            response = await model.generate_content_async(
+                message, generation_config={"max_output_tokens": max_output_tokens}
+            )
+        else:
+            response = await model.generate_content_async(message)
+        record_usage(provider, *_prompt_usage(response))
         return response.text
 
-async def get_response(customer_id, question, chat_history):
-    """Generates a response using the RAG pattern."""
-    
-    project_id = os.environ.get("PROJECT_ID")
-    location = os.environ.get("REGION")
-    
-    # 1. Retrieve customer data
-    customer = await get_customer_from_postgres(customer_id)
-    user_name = customer['firstName'] if customer else 'Guest'
+def _model_settings():
+    """The project and region the generation stage uses; the model is the tier's."""
+    return os.environ.get("PROJECT_ID"), os.environ.get("REGION")
 
-    # 2. Retrieve relevant product documentation (restored to 5 results)
-    search_service = get_search_service()
-    product_context = search_service.search(question, limit=5)
 
-    # 3. Generate a response
-    provider = os.environ.get("LLM_PROVIDER", "gcp")
-    model_name = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+def _check_capacity(traffic_class) -> None:
+    """Refuse now, before the customer lookup and the search, only if no
+    model tier could take the request: a question bound for an idle fast
+    model is not turned away because the strong one is saturated."""
+    priority = scheduling.Priority(scheduling.traffic_class(traffic_class))
+    refusal = None
+    for tier in TieringConfig.from_env().tiers:
+        try:
+            ProviderRouter.from_env(tier.gemini_model, tier.local_model).check(priority)
+            return
+        except OverloadedError as exc:
+            refusal = refusal or exc
+    assert refusal is not None
+    raise refusal
+
+
+def _retrieval_config(diversity=None):
+    retrieval = RetrievalConfig.from_env()
+    if diversity is not None:
+        retrieval = dataclasses.replace(retrieval, diversity=diversity)
+    return retrieval
+
+
+async def _answer(question, customer, product_context, traffic_class, deadline):
+    """Step 3 of the RAG pattern: generate the answer from what was retrieved.
+
+    The model tier (see `model_tiers.py`) is chosen here, once the context is
+    known.
+    """
+    project_id, location = _model_settings()
+    user_name = customer['firstName'] if customer else 'Guest'
+    profile = profile_block(customer)
 
     # Provide richer context to the more capable model
     context_str = json.dumps(product_context, indent=2)
-    
-    answer = await generate_llm_response(question, context_str, user_name, provider, project_id, location, model_name)
-    
+
+    decision = choose_tier(question, product_context)
+    tier = decision.tier
+    router = ProviderRouter.from_env(tier.gemini_model, tier.local_model)
+    priority = scheduling.Priority(
+        scheduling.traffic_class(traffic_class), scheduling.membership_tier(customer)
+    )
+    started = time.monotonic()
+    answer = await router.generate(
+        lambda spec: generate_llm_response(
+            question, context_str, user_name, spec.name, project_id, location, spec.model,
+            profile=profile, max_output_tokens=tier.max_output_tokens,
+        ),
+        priority,
+        deadline,
+    )
+    latency = time.monotonic() - started
+    record_tier_latency(tier.name, latency)
+    logger.info(
+        "Model tier answered",
+        extra={
+            "tier": tier.name,
+            "model": router.primary.model,
+            "reasons": list(decision.reasons),
+            "latency": round(latency, 4),
+        },
+    )
+
     return {
         "question": question,
         "answer": answer,
         "context": product_context
     }
+
+
+async def get_response(
+    customer_id,
+    question,
+    chat_history,
+    traffic_class=scheduling.INTERACTIVE,
+    deadline=None,
+    diversity=None,
+):
+    """Generates a response using the RAG pattern.
+
+    `traffic_class` is `interactive` for shoppers or `batch` for evals and
+    bulk tools; with the customer's membership tier it sets how this request is
+    scheduled when it has to wait for the model. `deadline` bounds the whole
+    response; without one, `CHAT_REQUEST_BUDGET_SECONDS` applies.
+    `diversity` overrides `RETRIEVAL_DIVERSITY` for this request.
+    """
+    if deadline is None:
+        deadline = Deadline.from_env()
+
+    # Refuse up front when every provider is saturated, before paying for the
+    # customer lookup and the search.
+    _check_capacity(traffic_class)
+    
+    # 1. Retrieve customer data
+    customer = await get_customer_from_postgres(
+        customer_id, timeout=deadline.stage_timeout("customer")
+    )
+
+    # 2. Retrieve relevant product documentation: a wide candidate fetch,
+    # reranked and cut to what is relevant and fits the context budget.
+    search_service = get_search_service()
+    retrieval = _retrieval_config(diversity)
+    product_context = await deadline.run(
+        "search", asyncio.to_thread(retrieve, search_service, question, retrieval)
+    )
+
+    # 3. Generate a response
+    return await _answer(question, customer, product_context, traffic_class, deadline)
+
+
+def batch_concurrency() -> int:
+    """How many of one batch's answers may be waiting on or holding the model at once."""
+    return max(1, int(os.getenv("CHAT_BATCH_CONCURRENCY") or DEFAULT_BATCH_CONCURRENCY))
+
+
+async def get_responses(
+    questions: Sequence[tuple[str | None, str]],
+    traffic_class=scheduling.BATCH,
+    deadline=None,
+    diversity=None,
+) -> AsyncIterator[tuple[int, dict | BaseException]]:
+    """Answers several `(customer_id, question)` pairs, sharing the work they have in common.
+
+    Each distinct customer is looked up once. Each distinct question is
+    searched once: the search backend embeds every query text in one call
+    (`SearchService.prepare`), then the searches run side by side. Answers are
+    generated through the provider router like any other request, at most
+    `CHAT_BATCH_CONCURRENCY` at a time, so one batch cannot fill the
+    admission queue by itself.
+
+    Yields `(index, result)` as each answer completes, in completion order;
+    a question that failed yields its exception instead. `deadline` is each
+    question's budget, as for a single request: the shared lookups and
+    searches count against it, and each answer's generation gets the rest,
+    counted from when it takes a concurrency slot. An answer queued behind
+    the others therefore has the same time as the first rather than what the
+    first ones left.
+    """
+    if deadline is None:
+        deadline = Deadline.from_env()
+
+    _check_capacity(traffic_class)
+
+    # 1. Retrieve each customer once
+    customer_ids = list(dict.fromkeys(customer_id for customer_id, _ in questions if customer_id))
+    found = await asyncio.gather(*(
+        get_customer_from_postgres(customer_id, timeout=deadline.stage_timeout("customer"))
+        for customer_id in customer_ids
+    ))
+    customers = dict(zip(customer_ids, found))
+
+    # 2. Search for each question once, with the query embeddings computed
+    # together up front
+    search_service = get_search_service()
+    retrieval = _retrieval_config(diversity)
+    texts = list(dict.fromkeys(question for _, question in questions))
+
+    async def search_all():
+        await asyncio.to_thread(search_service.prepare, texts)
+        return await asyncio.gather(
+            *(asyncio.to_thread(retrieve, search_service, text, retrieval) for text in texts),
+            return_exceptions=True,
+        )
+
+    try:
+        searched = dict(zip(texts, await deadline.run("search", search_all())))
+    except DeadlineExceededError as exc:
+        searched = dict.fromkeys(texts, exc)
+
+    # 3. Generate the answers, reporting each as soon as it is ready
+    slots = asyncio.Semaphore(batch_concurrency())
+    answer_budget = deadline.remaining()
+
+    async def answer(index, customer_id, question):
+        context = searched[question]
+        try:
+            if isinstance(context, BaseException):
+                raise context
+            async with slots:
+                result = await _answer(
+                    question, customers.get(customer_id), context, traffic_class, Deadline(answer_budget)
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            return index, exc
+        return index, result
+
+    pending = [
+        asyncio.ensure_future(answer(index, customer_id, question))
+        for index, (customer_id, question) in enumerate(questions)
+    ]
+    try:
+        for completed in asyncio.as_completed(pending):
+            yield await completed
+    finally:
+        # The caller stopped reading (client gone): abandon what is left.
+        for task in pending:
+            task.cancel()
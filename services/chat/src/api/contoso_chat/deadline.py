@@ -0,0 +1,71 @@
+"""Per-request time budgets, split across the stages of a chat response.
+
+A chat response runs three stages -- customer lookup, product search, LLM
+generation -- and none of them had a bound. A request whose caller had long
+given up still ran all three to completion.
+
+A `Deadline` is created once per request, from the `X-Request-Budget-Ms`
+header when the caller sends one (it can only shorten the budget) and from
+`CHAT_REQUEST_BUDGET_SECONDS` otherwise. The customer lookup and the search
+each get at most a fixed share of the total so a slow database cannot eat the
+time generation needs; generation gets whatever is left. Running out raises
+`DeadlineExceededError`, which `main.py` turns into a 504.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections.abc import Awaitable
+from typing import TypeVar
+
+DEFAULT_BUDGET_SECONDS = 90.0
+# Shares of the total budget; the LLM stage has no share and gets the rest.
+STAGE_SHARES = {"customer": 0.1, "search": 0.15}
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(TimeoutError):
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"Request budget of {budget:g}s exhausted during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self._expires_at = time.monotonic() + budget
+
+    @classmethod
+    def from_env(cls, header_ms: str | None = None) -> Deadline:
+        budget = float(os.getenv("CHAT_REQUEST_BUDGET_SECONDS") or DEFAULT_BUDGET_SECONDS)
+        if header_ms:
+            try:
+                requested = float(header_ms) / 1000
+            except ValueError:
+                requested = budget
+            if requested > 0:
+                budget = min(budget, requested)
+        return cls(budget)
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stage_timeout(self, stage: str) -> float:
+        """Seconds `stage` may run: its share of the budget, capped by what is left."""
+        share = STAGE_SHARES.get(stage)
+        remaining = self.remaining()
+        return remaining if share is None else min(remaining, self.budget * share)
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await `awaitable` within `stage`'s timeout, cancelling it on expiry."""
+        try:
+            return await asyncio.wait_for(awaitable, self.stage_timeout(stage))
+        except TimeoutError as exc:
+            raise DeadlineExceededError(stage, self.budget) from exc
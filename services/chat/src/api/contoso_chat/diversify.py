@@ -0,0 +1,76 @@
+"""Maximal marginal relevance over retrieval candidates.
+
+The catalogue has product lines with several near-identical variants. The top
+results for "a tent for two" were often three versions of the same tent,
+each costing prompt tokens and adding nothing the first did not say.
+
+`mmr` picks candidates greedily, each time taking the one that maximises
+
+    lambda * relevance(candidate) - (1 - lambda) * max similarity(candidate, picked)
+
+so a variant of something already picked has to be much more relevant to get
+in. Everything is vectorised over the candidate set: one matrix product for
+the pairwise similarities and one `np.maximum` per pick.
+
+It needs a vector per candidate. With the local stack those are the
+embedding model's (see `rerank.EmbeddingScorer`). Discovery Engine returns
+no vectors, so `hashed_vectors` builds term vectors with the hashing trick
+from the same tokens BM25 uses. Near-duplicate variants share most of their
+words, which is the signal this needs, so every `SearchService` backend can be
+diversified without another model.
+"""
+
+from __future__ import annotations
+
+import zlib
+from collections.abc import Sequence
+
+import numpy as np
+
+from .lexical import tokenize
+
+HASH_DIMENSIONS = 1024
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def hashed_vectors(texts: Sequence[str], dimensions: int = HASH_DIMENSIONS) -> np.ndarray:
+    """Unit-length signed term-frequency vectors; stable across processes."""
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in tokenize(text):
+            digest = zlib.crc32(token.encode("utf-8"))
+            matrix[row, digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    return normalize_rows(matrix)
+
+
+def mmr(relevance: Sequence[float], vectors: np.ndarray, k: int, lambda_: float) -> list[int]:
+    """Indices of up to `k` candidates in MMR pick order.
+
+    `relevance` is each candidate's query relevance (higher is better) and
+    `vectors` their embeddings, one row each. `lambda_` of 1 is plain
+    relevance order, 0 is pure novelty.
+    """
+    count = len(relevance)
+    if count == 0 or k <= 0:
+        return []
+    scores = np.asarray(relevance, dtype=np.float32)
+    unit = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    similarity = unit @ unit.T
+
+    picked = [int(np.argmax(scores))]
+    available = np.ones(count, dtype=bool)
+    available[picked[0]] = False
+    # Highest similarity of each candidate to anything picked so far.
+    redundancy = similarity[picked[0]].copy()
+    while len(picked) < min(k, count):
+        marginal = lambda_ * scores - (1 - lambda_) * redundancy
+        marginal[~available] = -np.inf
+        choice = int(np.argmax(marginal))
+        picked.append(choice)
+        available[choice] = False
+        np.maximum(redundancy, similarity[choice], out=redundancy)
+    return picked
@@ -0,0 +1,101 @@
+"""Read-only, memory-mapped embedding matrices shared by every worker.
+
+With several uvicorn workers (`CHAT_WORKERS`), each one opening Chroma holds
+its own copy of the collection and its HNSW index. RSS then grows with
+workers times catalogue size, and each worker pays the load at start-up.
+
+`index_products_local.py` also writes each collection as a plain store in
+`EMBEDDING_STORE_PATH`:
+
+- `<name>.<generation>.npy`: a float32 matrix, one unit-length row per entry,
+  in NumPy's `.npy` format.
+- `<name>.json`: the sidecar, `{"vectors": "<name>.<generation>.npy", "ids":
+  [...], "metadatas": [...], "documents": [...]}` in row order. It names the
+  matrix its rows belong to; a store from before generations has no
+  `vectors` and its matrix is `<name>.npy`.
+
+`EmbeddingStore.open` maps the matrix read-only (`np.load(mmap_mode="r")`).
+Opening costs a header read whatever the catalogue size. The pages are the
+kernel's page cache, so every worker on the host shares one copy, and nothing
+is read until a query touches it. The indexer writes each run's matrix under
+a new name and then renames the sidecar into place, so a reader always gets
+a matching pair; a worker keeps the store it opened until it restarts.
+
+Exact search is one matrix-vector product over the catalogue's rows, well
+under a millisecond for thousands of products, and it returns true cosine
+scores, with no approximate index to build in each process.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+
+from .diversify import normalize_rows
+
+
+class EmbeddingStore:
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        ids: Sequence[str],
+        metadatas: Sequence[dict[str, Any]],
+        documents: Sequence[str],
+    ) -> None:
+        if not (len(vectors) == len(ids) == len(metadatas) == len(documents)):
+            raise ValueError(
+                f"Embedding store is inconsistent: {len(vectors)} vectors, {len(ids)} ids, "
+                f"{len(metadatas)} metadatas, {len(documents)} documents"
+            )
+        self.vectors = vectors
+        self.ids = list(ids)
+        self.metadatas = [dict(meta or {}) for meta in metadatas]
+        self.documents = list(documents)
+
+    @classmethod
+    def open(cls, directory: str, name: str) -> EmbeddingStore:
+        """Load `<directory>/<name>.json` and map the matrix it names; raises if either is missing."""
+        for attempt in range(2):
+            with open(os.path.join(directory, f"{name}.json"), encoding="utf-8") as handle:
+                sidecar = json.load(handle)
+            try:
+                vectors = np.load(
+                    os.path.join(directory, sidecar.get("vectors", f"{name}.npy")), mmap_mode="r"
+                )
+                break
+            except FileNotFoundError:
+                # A reindex replaced the sidecar and pruned its matrix since
+                # we read it; the new sidecar names the new one.
+                if attempt:
+                    raise
+        return cls(vectors, sidecar["ids"], sidecar["metadatas"], sidecar["documents"])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def vector(self, row: int) -> np.ndarray:
+        return np.asarray(self.vectors[row])
+
+    def search(
+        self, query_vector: Sequence[float], limit: int, mask: np.ndarray | None = None
+    ) -> list[tuple[int, float]]:
+        """Rows and cosine similarities of the best `limit` entries, best first.
+
+        `mask` is a boolean array over rows; only rows where it is true rank.
+        """
+        if not len(self) or limit <= 0:
+            return []
+        query = normalize_rows(np.asarray([query_vector], dtype=np.float32))[0]
+        scores = np.asarray(self.vectors @ query, dtype=np.float32)
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+        if not len(candidates):
+            return []
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        ranked = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(row), float(scores[row])) for row in ranked]
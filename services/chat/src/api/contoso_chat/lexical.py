@@ -0,0 +1,117 @@
+"""In-process BM25 index over the product documents, and rank fusion.
+
+Chroma's `DefaultEmbeddingFunction` is a small general-purpose sentence model.
+It places "GORE-TEX shell" near any waterproof jacket and a brand or model
+name near nothing in particular. The answer is often in the catalogue
+verbatim, just not in the top five vector hits. So the prompt gets more
+documents than it needs, or the wrong ones.
+
+`BM25Index` is an inverted index over the same documents
+`index_products_local.py` writes to Chroma: a term -> postings map (document
+numbers and term frequencies in `array`s) plus document lengths. A query
+touches only the postings of its own terms, so a lookup over the catalogue
+costs well under a millisecond. `reciprocal_rank_fusion` merges its ranking
+with the vector ranking. It uses ranks only, so the two scorers' incomparable
+scales do not matter, and a document that both rank highly wins.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from array import array
+from collections import Counter
+from collections.abc import Container, Hashable, Iterable, Sequence
+from typing import TypeVar
+
+# Hyphenated compounds ("gore-tex", "trail-ready") are kept whole and also
+# split, so "goretex", "gore-tex" and "gore tex" all find the document.
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its me my of on or "
+    "our so than that the their them they this to was what which with you your".split()
+)
+# The constant from the RRF paper (Cormack et al., 2009); it damps the weight
+# of the very top ranks so one list cannot dominate the fusion.
+RRF_K = 60
+
+K = TypeVar("K", bound=Hashable)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in _TOKEN.findall(text.lower()):
+        if "-" in match or "'" in match:
+            parts = re.split(r"[-']", match)
+            tokens.append("".join(parts))
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+        elif match not in STOPWORDS:
+            tokens.append(match)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, documents: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = array("I")
+        postings: dict[str, tuple[array, array]] = {}
+        for number, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                docs, frequencies = postings.setdefault(term, (array("I"), array("I")))
+                docs.append(number)
+                frequencies.append(frequency)
+        self.postings = postings
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if documents else 0.0
+        count = len(self.doc_lengths)
+        # BM25+ style idf floor at zero: a term in most documents adds nothing
+        # rather than pulling a document down.
+        self.idf = {
+            term: max(0.0, math.log((count - len(docs) + 0.5) / (len(docs) + 0.5) + 1))
+            for term, (docs, _) in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def scores(self, query: str) -> dict[int, float]:
+        """BM25 score of every document sharing at least one term with `query`."""
+        scores: dict[int, float] = {}
+        if not self.avg_length:
+            return scores
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            idf = self.idf[term]
+            for number, frequency in zip(*entry):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[number] / self.avg_length)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + norm
+                )
+        return scores
+
+    def search(
+        self, query: str, limit: int, allowed: Container[int] | None = None
+    ) -> list[tuple[int, float]]:
+        """Document numbers and scores of the best `limit` matches, best first.
+
+        `allowed` restricts the ranking to those document numbers (the ones
+        that pass a query's filters).
+        """
+        scores = self.scores(query)
+        if allowed is not None:
+            scores = {number: score for number, score in scores.items() if number in allowed}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [item for item in ranked[:limit] if item[1] > 0]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[K]], k: int = RRF_K) -> list[K]:
+    """Merge best-first rankings by summed 1 / (k + rank); ties keep first-seen order."""
+    fused: dict[K, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=lambda key: -fused[key])
@@ -0,0 +1,177 @@
+"""Route each question to a fast or a strong model.
+
+Every question went to one model (`GEMINI_MODEL_NAME` or `LOCAL_MODEL_NAME`)
+whatever it asked. "Do you sell hiking boots?" waited as long, and cost as
+much, as a comparison of four tents.
+
+With `MODEL_TIERING=1`, `choose_tier` classifies each request once its context
+is retrieved, from signals that cost nothing to compute:
+
+- the question: long (more than `MODEL_TIER_FAST_MAX_WORDS` words) or asking
+  to compare, recommend or explain;
+- the retrieval: more than `MODEL_TIER_FAST_MAX_PRODUCTS` products to weigh,
+  a best product score below `MODEL_TIER_FAST_MIN_SCORE` (no confident match
+  to read the answer off), or more than `MODEL_TIER_FAST_MAX_CONTEXT_TOKENS`
+  of context.
+
+Any one of them sends the request to the strong tier (the configured models,
+as before). Otherwise it goes to the fast tier: `GEMINI_FAST_MODEL_NAME` or
+`LOCAL_FAST_MODEL_NAME`. Each tier has its own output token limit
+(`MODEL_TIER_FAST_MAX_OUTPUT_TOKENS`, `MODEL_TIER_STRONG_MAX_OUTPUT_TOKENS`;
+empty leaves the model's own). Each model has its own admission limiter
+(see `admission.py`). Decisions are logged with their reasons, and per-tier
+latency is kept for `/health/providers`.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from collections import deque
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from .rerank import estimate_tokens
+
+FAST = "fast"
+STRONG = "strong"
+DEFAULT_FAST_GEMINI_MODEL = "gemini-2.5-flash-lite"
+DEFAULT_FAST_LOCAL_MODEL = "gemma3:4b"
+DEFAULT_FAST_MAX_OUTPUT_TOKENS = 512
+LATENCY_WINDOW = 200
+
+# Questions that ask the model to weigh options or reason, not look one up.
+_STRONG_CUES = re.compile(
+    r"\b(compare|comparison|versus|vs\.?|difference|differences|better|best|which|recommend\w*|"
+    r"pros|cons|trade-?offs?|why|explain|should i)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    gemini_model: str
+    local_model: str
+    max_output_tokens: int | None = None
+
+
+@dataclass(frozen=True)
+class TieringConfig:
+    enabled: bool
+    fast: ModelTier
+    strong: ModelTier
+    max_words: int = 20
+    max_products: int = 3
+    min_score: float = 0.5
+    max_context_tokens: int = 1200
+
+    @classmethod
+    def from_env(cls) -> TieringConfig:
+        return cls(
+            enabled=os.getenv("MODEL_TIERING", "0").lower() in ("1", "true", "yes"),
+            fast=ModelTier(
+                FAST,
+                os.getenv("GEMINI_FAST_MODEL_NAME") or DEFAULT_FAST_GEMINI_MODEL,
+                os.getenv("LOCAL_FAST_MODEL_NAME") or DEFAULT_FAST_LOCAL_MODEL,
+                _tokens(os.getenv("MODEL_TIER_FAST_MAX_OUTPUT_TOKENS", str(DEFAULT_FAST_MAX_OUTPUT_TOKENS))),
+            ),
+            strong=ModelTier(
+                STRONG,
+                os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash"),
+                os.getenv("LOCAL_MODEL_NAME", "gemma3:12b"),
+                _tokens(os.getenv("MODEL_TIER_STRONG_MAX_OUTPUT_TOKENS")),
+            ),
+            max_words=int(os.getenv("MODEL_TIER_FAST_MAX_WORDS") or cls.max_words),
+            max_products=int(os.getenv("MODEL_TIER_FAST_MAX_PRODUCTS") or cls.max_products),
+            min_score=float(os.getenv("MODEL_TIER_FAST_MIN_SCORE") or cls.min_score),
+            max_context_tokens=int(os.getenv("MODEL_TIER_FAST_MAX_CONTEXT_TOKENS") or cls.max_context_tokens),
+        )
+
+
+    @property
+    def tiers(self) -> tuple[ModelTier, ...]:
+        """The tiers a request may be answered by."""
+        return (self.strong, self.fast) if self.enabled else (self.strong,)
+
+
+def _tokens(raw: str | None) -> int | None:
+    # Set but empty, or 0, leaves the model's own limit.
+    return int(raw) if raw and int(raw) > 0 else None
+
+
+@dataclass(frozen=True)
+class TierDecision:
+    tier: ModelTier
+    # Why the request needs the strong tier; empty for the fast one.
+    reasons: tuple[str, ...] = ()
+
+
+def strong_reasons(question: str, context: Sequence[Any], config: TieringConfig) -> list[str]:
+    """Every reason the request is too hard for the fast tier."""
+    reasons = []
+    if len(question.split()) > config.max_words:
+        reasons.append("long question")
+    cue = _STRONG_CUES.search(question)
+    if cue:
+        reasons.append(f"asks to {cue.group(0).lower()}")
+    products = [item for item in context if isinstance(item, Mapping) and "manual" not in item]
+    if len(products) > config.max_products:
+        reasons.append(f"{len(products)} products")
+    scores = [item["score"] for item in products if isinstance(item.get("score"), (int, float))]
+    if scores and max(scores) < config.min_score:
+        reasons.append("no confident match")
+    if sum(estimate_tokens(item) for item in context) > config.max_context_tokens:
+        reasons.append("large context")
+    return reasons
+
+
+def choose_tier(question: str, context: Sequence[Any], config: TieringConfig | None = None) -> TierDecision:
+    """The tier to answer with; always the strong one when tiering is off."""
+    config = config or TieringConfig.from_env()
+    if not config.enabled:
+        return TierDecision(config.strong)
+    reasons = strong_reasons(question, context, config)
+    return TierDecision(config.strong if reasons else config.fast, tuple(reasons))
+
+
+class TierStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, latency: float) -> None:
+        self.requests += 1
+        self._latencies.append(latency)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "latency_seconds": {
+                "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95),
+                "samples": len(self._latencies),
+            },
+        }
+
+
+_stats: dict[str, TierStats] = {}
+
+
+def record_tier_latency(tier: str, latency: float) -> None:
+    _stats.setdefault(tier, TierStats()).record(latency)
+
+
+def tiers_snapshot() -> dict[str, Any]:
+    return {name: stats.snapshot() for name, stats in _stats.items()}
+
+
+def reset_tier_stats() -> None:
+    _stats.clear()
@@ -0,0 +1,217 @@
+"""A managed client for the local Ollama server.
+
+Local generation went through LiteLLM's `acompletion` with a bare `api_base`.
+Connection reuse was whatever LiteLLM did internally, and nothing loaded the
+model before the first shopper asked. Ollama unloads an idle model after five
+minutes, so the first request after start-up or a quiet spell paid the full
+model load.
+
+`OllamaClient` talks to Ollama's HTTP API directly:
+
+- One `httpx2.AsyncClient` per process keeps a pool of keep-alive
+  connections (`OLLAMA_MAX_CONNECTIONS`, default 8), so a request does not
+  open a new connection.
+- `preload` loads a model into Ollama's memory. `main.py` runs it during
+  start-up warm-up for each local model a request may use: `LOCAL_MODEL_NAME`,
+  and `LOCAL_FAST_MODEL_NAME` with `MODEL_TIERING=1`.
+- Every request sends `keep_alive` (`OLLAMA_KEEP_ALIVE`, default 30m; `-1`
+  keeps the model loaded indefinitely), so the model stays resident between
+  requests.
+- `OLLAMA_NUM_CTX` and `OLLAMA_NUM_THREAD`, when set, become the `num_ctx` and
+  `num_thread` options of every request.
+
+The pool belongs to the event loop that first used it; a client is rebuilt
+when called from another loop (e.g. `evaluate.py`'s `asyncio.run`), and the
+one it replaces is closed on its own loop. `close_ollama_clients` closes them
+all at shutdown.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any
+
+DEFAULT_BASE_URL = "http://host.docker.internal:11434"
+DEFAULT_MODEL = "gemma3:12b"
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_MAX_CONNECTIONS = 8
+# Generations are bounded by the provider router's timeout; this only stops a
+# dead server from holding a connection for ever.
+DEFAULT_TIMEOUT_SECONDS = 300.0
+CONNECT_TIMEOUT_SECONDS = 5.0
+# Idle pooled connections are closed after this long.
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+OPTION_ENV = {"num_ctx": "OLLAMA_NUM_CTX", "num_thread": "OLLAMA_NUM_THREAD"}
+
+
+def keep_alive_value(raw: str | None) -> str | int:
+    """`OLLAMA_KEEP_ALIVE` as Ollama takes it: a duration ("30m") or seconds (-1 for ever)."""
+    value = (raw or DEFAULT_KEEP_ALIVE).strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+@dataclass(frozen=True)
+class OllamaConfig:
+    base_url: str = DEFAULT_BASE_URL
+    model: str = DEFAULT_MODEL
+    keep_alive: str | int = DEFAULT_KEEP_ALIVE
+    options: tuple[tuple[str, int], ...] = ()
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    timeout: float = DEFAULT_TIMEOUT_SECONDS
+
+    @classmethod
+    def from_env(cls) -> OllamaConfig:
+        options = tuple(
+            (option, int(os.environ[name])) for option, name in OPTION_ENV.items() if os.getenv(name)
+        )
+        return cls(
+            base_url=os.getenv("OLLAMA_BASE_URL", DEFAULT_BASE_URL).rstrip("/"),
+            model=os.getenv("LOCAL_MODEL_NAME", DEFAULT_MODEL),
+            keep_alive=keep_alive_value(os.getenv("OLLAMA_KEEP_ALIVE")),
+            options=options,
+            max_connections=max(1, int(os.getenv("OLLAMA_MAX_CONNECTIONS") or DEFAULT_MAX_CONNECTIONS)),
+        )
+
+
+def _httpx() -> Any:
+    try:
+        import httpx2
+    except ImportError as exc:
+        raise RuntimeError(
+            "Local LLM provider dependencies are not installed. "
+            "Rebuild with CHAT_INSTALL_LOCAL_STACK=1 or install requirements-local.txt."
+        ) from exc
+    return httpx2
+
+
+class OllamaClient:
+    def __init__(self, config: OllamaConfig, transport: Any = None) -> None:
+        httpx2 = _httpx()
+        self.config = config
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.http = httpx2.AsyncClient(
+            base_url=config.base_url,
+            limits=httpx2.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx2.Timeout(config.timeout, connect=CONNECT_TIMEOUT_SECONDS),
+            transport=transport,
+        )
+
+    async def _post(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        response = await self.http.post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def chat(
+        self, messages: list[dict[str, str]], model: str | None = None, **options: Any
+    ) -> dict[str, Any]:
+        """Ollama's `/api/chat` reply to `messages`, not streamed; `options` add to the configured ones.
+
+        `model` overrides `LOCAL_MODEL_NAME`, e.g. for the fast tier (see
+        `model_tiers.py`); the connection pool is the same.
+        """
+        return await self._post(
+            "/api/chat",
+            {
+                "model": model or self.config.model,
+                "messages": messages,
+                "stream": False,
+                "keep_alive": self.config.keep_alive,
+                "options": {**dict(self.config.options), **options},
+            },
+        )
+
+    async def preload(self, model: str | None = None) -> dict[str, Any]:
+        """Load `model` (default `LOCAL_MODEL_NAME`) into Ollama's memory now rather than on the first chat."""
+        # A generate request without a prompt loads the model and returns.
+        return await self._post(
+            "/api/generate", {"model": model or self.config.model, "keep_alive": self.config.keep_alive}
+        )
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+_clients: dict[OllamaConfig, OllamaClient] = {}
+# Closes scheduled on the running loop, kept referenced until they finish.
+_closing: set[asyncio.Task[None]] = set()
+
+
+def _close(client: OllamaClient) -> None:
+    """Close `client`'s pool on the loop that owns it, without waiting.
+
+    A pool can only be closed on its own loop. If that loop is idle the close
+    runs the next time it does; if it is closed there is nothing left to do.
+    """
+    loop = client.loop
+    if loop is None or loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        task = loop.create_task(client.aclose())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    elif running is None and not loop.is_running():
+        loop.run_until_complete(client.aclose())
+    else:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+
+def get_ollama_client() -> OllamaClient:
+    """The client for the current configuration, shared by every request on this loop."""
+    config = OllamaConfig.from_env()
+    loop = asyncio.get_running_loop()
+    client = _clients.get(config)
+    if client is None or client.loop is not loop:
+        if client is not None:
+            _close(client)
+        client = _clients[config] = OllamaClient(config)
+        client.loop = loop
+    return client
+
+
+async def close_ollama_clients() -> None:
+    """Close every client's connection pool; the app calls this at shutdown."""
+    loop = asyncio.get_running_loop()
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        if client.loop is loop:
+            await client.aclose()
+        else:
+            _close(client)
+
+
+def reset_ollama_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        _close(client)
+
+
+async def preload_local_model(model: str | None = None) -> dict[str, Any]:
+    """Preload `model` (default `LOCAL_MODEL_NAME`) and report what it cost; never raises."""
+    started = time.perf_counter()
+    report: dict[str, Any] = {}
+    try:
+        client = get_ollama_client()
+        report["model"] = model or client.config.model
+        reply = await client.preload(model)
+        # Ollama reports durations in nanoseconds.
+        report["load_seconds"] = round(int(reply.get("load_duration") or 0) / 1e9, 4)
+    except Exception as exc:  # noqa: BLE001
+        report["error"] = f"{type(exc).__name__}: {exc}"
+    report["seconds"] = round(time.perf_counter() - started, 4)
+    return report
@@ -0,0 +1,59 @@
+"""A short shopper profile for the system prompt.
+
+Answers were personalized by first name only. Anything more used to mean
+reading the customer's whole order history (`db.fetch_customer`) on every
+request and either summarising it here or sending it raw, which grows with
+every order they place.
+
+The database keeps a per-customer summary instead ("CustomerSummary",
+maintained by triggers on order writes), and `db.fetch_customer_summary`
+reads it in one row. `profile_block` turns that row into a few lines:
+membership, the most recent purchases, favourite categories and brands. Its
+size is bounded whatever the history. The lists are capped where the summary
+is built, and again here. `CHAT_PERSONALIZATION=0` leaves it out of the
+prompt.
+"""
+
+from __future__ import annotations
+
+import os
+from collections.abc import Mapping, Sequence
+from typing import Any
+
+MAX_RECENT_PURCHASES = 3
+MAX_FAVORITES = 3
+
+
+def personalization_enabled() -> bool:
+    return os.getenv("CHAT_PERSONALIZATION", "1") != "0"
+
+
+def _names(values: Sequence[Any] | None, limit: int) -> str:
+    return ", ".join(str(value) for value in (values or [])[:limit] if value)
+
+
+def _purchase(purchase: Mapping[str, Any]) -> str:
+    details = ", ".join(str(purchase[key]) for key in ("category", "brand") if purchase.get(key))
+    return f"{purchase.get('name')} ({details})" if details else str(purchase.get("name"))
+
+
+def profile_block(customer: Mapping[str, Any] | None) -> str:
+    """The shopper profile for the system prompt; empty for guests or when off."""
+    if not customer or not personalization_enabled():
+        return ""
+
+    lines = []
+    if customer.get("membership"):
+        lines.append(f"- Membership: {customer['membership']}")
+    recent = [_purchase(purchase) for purchase in (customer.get("recentPurchases") or [])[:MAX_RECENT_PURCHASES]]
+    if recent:
+        lines.append(f"- Recent purchases: {'; '.join(recent)}")
+    categories = _names(customer.get("favoriteCategories"), MAX_FAVORITES)
+    if categories:
+        lines.append(f"- Favourite categories: {categories}")
+    brands = _names(customer.get("favoriteBrands"), MAX_FAVORITES)
+    if brands:
+        lines.append(f"- Favourite brands: {brands}")
+    if not lines:
+        return ""
+    return "Shopper profile (use it to tailor suggestions; do not recite it):\n" + "\n".join(lines)
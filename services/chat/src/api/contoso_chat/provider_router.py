@@ -0,0 +1,355 @@
+"""Route generations across LLM providers with timeouts, failover and hedging.
+
+`generate_llm_response` talks to exactly one backend, chosen by `LLM_PROVIDER`,
+with no timeout: a slow or failing Vertex region or a stalled Ollama was passed
+straight through to the shopper. The router puts a policy around that call.
+
+- Candidates are `LLM_PROVIDER` followed by `LLM_FALLBACK_PROVIDERS` (comma
+  separated, e.g. `local`), tried in order until one answers.
+- Every attempt runs inside the provider's admission limiter and under
+  `LLM_<PROVIDER>_TIMEOUT_SECONDS` (or the shared `LLM_TIMEOUT_SECONDS`).
+- A circuit breaker per provider stops sending it traffic after
+  `LLM_BREAKER_FAILURES` consecutive failures and lets a single probe through
+  once `LLM_BREAKER_RESET_SECONDS` have passed.
+- With `LLM_HEDGE=1`, an attempt still running past the provider's recent p95
+  latency starts a second attempt on the next candidate (or the same provider
+  when there is no other), if that limiter has a free slot. The first answer
+  wins and the other attempt is cancelled.
+
+Per-provider outcomes, latency percentiles, breaker state and prompt tokens
+(with how many the provider reports it served from its context cache, see
+`record_usage`) are kept for `/health/providers`. A request `Deadline` caps every attempt and queue wait;
+once it runs out the router stops rather than fail over, and a timeout the
+deadline imposed is not held against the provider.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from .admission import OverloadedError, get_limiter, provider_env
+from .deadline import Deadline, DeadlineExceededError
+from .scheduling import DEFAULT_PRIORITY, Priority
+
+DEFAULT_TIMEOUT_SECONDS = {"local": 120.0, "gcp": 30.0}
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET_SECONDS = 30.0
+# Below this many samples a p95 is noise; hedging waits until there is a history.
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class ProvidersUnavailableError(RuntimeError):
+    """Every candidate provider failed, timed out or has its breaker open."""
+
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    name: str
+    model: str
+    timeout: float
+
+    @classmethod
+    def from_env(cls, name: str, model_name: str, local_model: str | None = None) -> ProviderSpec:
+        model = model_name
+        if name == "local":
+            model = local_model or os.getenv("LOCAL_MODEL_NAME") or "gemma3:12b"
+        timeout = provider_env(name, "TIMEOUT_SECONDS")
+        return cls(name, model, float(timeout) if timeout else DEFAULT_TIMEOUT_SECONDS.get(name, 60.0))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def available(self) -> bool:
+        """Whether `allow` would let an attempt through, without taking the probe."""
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        return not (self.state == self.HALF_OPEN and self._probe_in_flight)
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def record_abandoned(self) -> None:
+        """An attempt was cancelled before it finished; it proves nothing."""
+        self._probe_in_flight = False
+
+
+class ProviderHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            int(os.getenv("LLM_BREAKER_FAILURES") or DEFAULT_BREAKER_FAILURES),
+            float(os.getenv("LLM_BREAKER_RESET_SECONDS") or DEFAULT_BREAKER_RESET_SECONDS),
+        )
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejections = 0
+        self.hedges_started = 0
+        self.hedges_won = 0
+        self.last_error: str | None = None
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def hedge_delay(self) -> float | None:
+        """The p95 latency, once there are enough samples to trust it."""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return self.percentile(0.95)
+
+    def record_success(self, latency: float) -> None:
+        self.successes += 1
+        self._latencies.append(latency)
+        self.breaker.record_success()
+
+    def record_failure(self, exc: BaseException) -> None:
+        if isinstance(exc, TimeoutError):
+            self.timeouts += 1
+        self.failures += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        self.breaker.record_failure()
+
+    def snapshot(self) -> dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejections": self.rejections,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "latency_seconds": {
+                "p50": round(p50, 4) if p50 is not None else None,
+                "p95": round(p95, 4) if p95 is not None else None,
+                "samples": len(self._latencies),
+            },
+            "prompt_tokens": {
+                "total": self.prompt_tokens,
+                "cached": self.cached_prompt_tokens,
+                "cached_ratio": round(self.cached_prompt_tokens / self.prompt_tokens, 3)
+                if self.prompt_tokens
+                else 0.0,
+            },
+            "last_error": self.last_error,
+        }
+
+
+_health: dict[str, ProviderHealth] = {}
+
+
+def provider_health(name: str) -> ProviderHealth:
+    health = _health.get(name)
+    if health is None:
+        health = _health[name] = ProviderHealth(name)
+    return health
+
+
+def record_usage(name: str, prompt_tokens: int, cached_tokens: int) -> None:
+    """Count a generation's prompt tokens, and those served from the provider's cache."""
+    health = provider_health(name)
+    health.prompt_tokens += prompt_tokens
+    health.cached_prompt_tokens += cached_tokens
+
+
+def providers_snapshot() -> dict[str, Any]:
+    return {name: health.snapshot() for name, health in _health.items()}
+
+
+def reset_provider_health() -> None:
+    _health.clear()
+
+
+Generate = Callable[[ProviderSpec], Awaitable[str]]
+
+
+class ProviderRouter:
+    def __init__(self, providers: list[ProviderSpec], hedge: bool = False):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.providers = providers
+        self.hedge = hedge
+
+    @classmethod
+    def from_env(cls, model_name: str, local_model: str | None = None) -> ProviderRouter:
+        names = [os.getenv("LLM_PROVIDER", "gcp")]
+        for name in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(","):
+            if name.strip() and name.strip() not in names:
+                names.append(name.strip())
+        hedge = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+        return cls([ProviderSpec.from_env(name, model_name, local_model) for name in names], hedge=hedge)
+
+    @property
+    def primary(self) -> ProviderSpec:
+        return self.providers[0]
+
+    def check(self, priority: Priority = DEFAULT_PRIORITY) -> None:
+        """Refuse now if no candidate could take the request (see `ConcurrencyLimiter.check`)."""
+        for spec in self.providers:
+            if not provider_health(spec.name).breaker.available():
+                continue
+            if not get_limiter(spec.name, spec.model).saturated(priority):
+                return
+        get_limiter(self.primary.name, self.primary.model).check(priority)
+
+    async def generate(
+        self,
+        call: Generate,
+        priority: Priority = DEFAULT_PRIORITY,
+        deadline: Deadline | None = None,
+    ) -> str:
+        errors: list[BaseException] = []
+        for index, spec in enumerate(self.providers):
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceededError("llm", deadline.budget)
+            health = provider_health(spec.name)
+            if not health.breaker.allow():
+                continue
+            hedge_spec = None
+            if self.hedge:
+                others = self.providers[index + 1:]
+                hedge_spec = others[0] if others else spec
+            try:
+                return await self._generate_hedged(call, spec, hedge_spec, priority, deadline)
+            except (asyncio.CancelledError, DeadlineExceededError):
+                raise
+            except Exception as exc:  # noqa: BLE001
+                errors.append(exc)
+
+        overloads = [exc for exc in errors if isinstance(exc, OverloadedError)]
+        if overloads and len(overloads) == len(errors):
+            raise min(overloads, key=lambda exc: exc.retry_after)
+        detail = "; ".join(f"{type(exc).__name__}: {exc}" for exc in errors)
+        raise ProvidersUnavailableError(
+            "No LLM provider produced a response"
+            + (f" ({detail})" if detail else " (all circuit breakers open)")
+        )
+
+    async def _attempt(
+        self, call: Generate, spec: ProviderSpec, priority: Priority, deadline: Deadline | None
+    ) -> str:
+        health = provider_health(spec.name)
+        remaining = deadline.remaining() if deadline is not None else None
+        try:
+            async with get_limiter(spec.name, spec.model).acquire(priority, remaining):
+                started = time.monotonic()
+                timeout = spec.timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline.remaining())
+                try:
+                    answer = await asyncio.wait_for(call(spec), timeout)
+                except TimeoutError as exc:
+                    if deadline is not None and timeout < spec.timeout:
+                        raise DeadlineExceededError("llm", deadline.budget) from exc
+                    raise
+        except DeadlineExceededError:
+            health.breaker.record_abandoned()
+            raise
+        except OverloadedError:
+            # Capacity, not health: do not trip the breaker over a full queue.
+            health.rejections += 1
+            health.breaker.record_abandoned()
+            raise
+        except asyncio.CancelledError:
+            health.breaker.record_abandoned()
+            raise
+        except Exception as exc:
+            health.record_failure(exc)
+            raise
+        health.record_success(time.monotonic() - started)
+        return answer
+
+    async def _generate_hedged(
+        self,
+        call: Generate,
+        spec: ProviderSpec,
+        hedge_spec: ProviderSpec | None,
+        priority: Priority,
+        deadline: Deadline | None,
+    ) -> str:
+        primary = asyncio.ensure_future(self._attempt(call, spec, priority, deadline))
+        delay = provider_health(spec.name).hedge_delay() if hedge_spec else None
+        if hedge_spec is None or delay is None:
+            return await primary
+
+        hedge: asyncio.Future[str] | None = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge_health = provider_health(hedge_spec.name)
+            if not get_limiter(hedge_spec.name, hedge_spec.model).has_capacity():
+                return await primary
+            if hedge_spec.name != spec.name and not hedge_health.breaker.allow():
+                return await primary
+
+            hedge_health.hedges_started += 1
+            hedge = asyncio.ensure_future(self._attempt(call, hedge_spec, priority, deadline))
+            pending = {primary, hedge}
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            hedge_health.hedges_won += 1
+                        for loser in pending:
+                            loser.cancel()
+                        # Let the loser unwind so its limiter slot is free
+                        # before the winner's answer goes back.
+                        await asyncio.gather(*pending, return_exceptions=True)
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for attempt in (primary, hedge):
+                if attempt is not None and not attempt.done():
+                    attempt.cancel()
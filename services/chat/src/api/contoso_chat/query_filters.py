@@ -0,0 +1,191 @@
+"""Pull price, brand and category constraints out of a shopper's question.
+
+"Tents under $200 from Daybird" went to the search backend as free text. The
+vector ranking has no notion of "under", so five loosely related products came
+back and the LLM was left to do the filtering, often with nothing that fit.
+Every indexed product already carries `price`, `brand` and `category` (the
+Chroma metadata `index_products_local.py` writes, and the Discovery Engine
+`struct_data` from `seed_gcp_products.py`). So `parse_query` extracts the
+constraints, and the backend pushes them down: a Chroma `where` clause, or a
+Discovery Engine `filter` expression. Only matching products are scored.
+
+Brands and categories are recognised against the backend's vocabulary, the
+values actually in the index, so an arbitrary capitalised word never becomes a
+filter. Where no brand vocabulary is available, "from X" / "by X" with a
+capitalised X is taken as the brand.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+# Words shoppers use for each catalogue category. Only categories present in
+# the backend's vocabulary are ever matched.
+CATEGORY_SYNONYMS = {
+    "Backpacks": ("backpack", "backpacks", "daypack", "daypacks", "rucksack"),
+    "Camping Stoves": ("stove", "stoves", "burner", "burners"),
+    "Camping Tables": ("table", "tables"),
+    "Hiking Clothing": (
+        "jacket", "jackets", "clothing", "clothes", "shirt", "shirts", "pants",
+        "trousers", "fleece", "hoodie", "vest", "shorts",
+    ),
+    "Hiking Footwear": ("boot", "boots", "shoe", "shoes", "footwear", "sandals"),
+    "Sleeping Bags": ("sleeping bag", "sleeping bags"),
+    "Tents": ("tent", "tents", "shelter"),
+}
+
+_NUMBER = r"(\d[\d,]*(?:\.\d+)?)"
+_UNITS = (
+    r"people|persons?|man|lbs?|pounds?|kg|kilos?|grams?|g|oz|ounces?|lit(?:er|re)s?|l|"
+    r"inch(?:es)?|in|cm|mm|f(?:ee|oo)?t|degrees?|miles?|hours?|days?|nights?|years?|seasons?|x"
+)
+# A number is a price only when it says so: "$200" or "200 dollars", or a bare
+# number after a price word ("priced under 200"). "At least 3 burners" and
+# "under 4 people" are about the product, not its price.
+_AMOUNT = rf"(?:\$\s*{_NUMBER}|{_NUMBER}\s*(?:dollars|bucks|usd)\b)"
+_BARE = rf"{_NUMBER}(?![\d,.%°\"']|\s*(?:{_UNITS})\b)"
+_PRICE_WORDS = r"(?:price[ds]?|costs?|costing|budget)(?:\s+(?:is|of))?"
+_MAX_WORDS = r"(?:under|below|less than|cheaper than|no more than|at most|up to|max(?:imum)?|within)"
+_MIN_WORDS = r"(?:over|above|more than|at least|min(?:imum)?|starting at)"
+_BETWEEN = re.compile(
+    rf"\bbetween\s+{_AMOUNT}\s+and\s+(?:{_AMOUNT}|{_BARE})"
+    rf"|\bbetween\s+{_BARE}\s+and\s+{_AMOUNT}"
+    rf"|\b{_PRICE_WORDS}\s+between\s+{_BARE}\s+and\s+{_BARE}",
+    re.IGNORECASE,
+)
+_RANGE = re.compile(rf"\$\s*{_NUMBER}\s*(?:-|–|to)\s*\$?\s*{_NUMBER}", re.IGNORECASE)
+_MAX = re.compile(rf"\b{_MAX_WORDS}\s+{_AMOUNT}|\b{_PRICE_WORDS}\s+{_MAX_WORDS}\s+{_BARE}", re.IGNORECASE)
+_MIN = re.compile(rf"\b{_MIN_WORDS}\s+{_AMOUNT}|\b{_PRICE_WORDS}\s+{_MIN_WORDS}\s+{_BARE}", re.IGNORECASE)
+_BRAND_HINT = re.compile(r"\b(?:from|by)\s+([A-Z][A-Za-z0-9]+(?:\s[A-Z][A-Za-z0-9]+)?)")
+
+
+@dataclass(frozen=True)
+class ProductFilters:
+    min_price: float | None = None
+    max_price: float | None = None
+    brands: tuple[str, ...] = ()
+    categories: tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.min_price is not None or self.max_price is not None or self.brands or self.categories
+        )
+
+    def matches(self, metadata: Mapping[str, Any]) -> bool:
+        price = metadata.get("price")
+        if self.min_price is not None and (price is None or float(price) < self.min_price):
+            return False
+        if self.max_price is not None and (price is None or float(price) > self.max_price):
+            return False
+        if self.brands and metadata.get("brand") not in self.brands:
+            return False
+        return not self.categories or metadata.get("category") in self.categories
+
+    def chroma_where(self) -> dict[str, Any] | None:
+        clauses: list[dict[str, Any]] = []
+        if self.min_price is not None:
+            clauses.append({"price": {"$gte": self.min_price}})
+        if self.max_price is not None:
+            clauses.append({"price": {"$lte": self.max_price}})
+        if self.brands:
+            clauses.append({"brand": {"$in": list(self.brands)}})
+        if self.categories:
+            clauses.append({"category": {"$in": list(self.categories)}})
+        if not clauses:
+            return None
+        # Chroma rejects an `$and` with fewer than two operands.
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def discovery_engine_filter(self) -> str:
+        clauses = []
+        if self.min_price is not None:
+            clauses.append(f"price >= {self.min_price:g}")
+        if self.max_price is not None:
+            clauses.append(f"price <= {self.max_price:g}")
+        if self.brands:
+            clauses.append(f"brand: ANY({_quoted(self.brands)})")
+        if self.categories:
+            clauses.append(f"category: ANY({_quoted(self.categories)})")
+        return " AND ".join(clauses)
+
+
+@dataclass(frozen=True)
+class ParsedQuery:
+    text: str
+    filters: ProductFilters
+
+
+def _quoted(values: Iterable[str]) -> str:
+    return ", ".join('"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"' for value in values)
+
+
+def _amounts(match: re.Match[str]) -> list[float]:
+    """The numbers a price pattern captured, whichever of its alternatives matched."""
+    return [float(group.replace(",", "")) for group in match.groups() if group is not None]
+
+
+def _mentions(text: str, phrase: str) -> bool:
+    return re.search(rf"(?<![a-z0-9]){re.escape(phrase.lower())}(?![a-z0-9])", text) is not None
+
+
+def parse_query(
+    query: str,
+    brands: Iterable[str] | None = None,
+    categories: Iterable[str] = CATEGORY_SYNONYMS,
+) -> ParsedQuery:
+    """Split `query` into search text and the filters it states.
+
+    `brands` and `categories` are the values present in the index; `brands`
+    of None means the backend cannot list them (see the module docstring).
+    The returned text has the price phrase removed, since "under $200" only
+    adds noise to a relevance score.
+    """
+    lowered = query.lower()
+    min_price = max_price = None
+    price_spans = []
+
+    between = _BETWEEN.search(query) or _RANGE.search(query)
+    if between:
+        low, high = _amounts(between)
+        min_price, max_price = min(low, high), max(low, high)
+        price_spans.append(between.span())
+    else:
+        upper = _MAX.search(query)
+        if upper:
+            max_price = _amounts(upper)[0]
+            price_spans.append(upper.span())
+        lower = _MIN.search(query)
+        if lower:
+            min_price = _amounts(lower)[0]
+            price_spans.append(lower.span())
+
+    matched_brands: tuple[str, ...]
+    if brands is None:
+        hint = _BRAND_HINT.search(query)
+        matched_brands = (hint.group(1),) if hint else ()
+    else:
+        matched_brands = tuple(sorted(brand for brand in set(brands) if brand and _mentions(lowered, brand)))
+
+    matched_categories = []
+    for category in sorted(set(categories)):
+        phrases = (category, *CATEGORY_SYNONYMS.get(category, ()))
+        if any(_mentions(lowered, phrase) for phrase in phrases):
+            matched_categories.append(category)
+
+    text = query
+    for start, end in sorted(price_spans, reverse=True):
+        text = text[:start] + text[end:]
+    text = " ".join(text.split()) or query
+
+    return ParsedQuery(
+        text=text,
+        filters=ProductFilters(
+            min_price=min_price,
+            max_price=max_price,
+            brands=matched_brands,
+            categories=tuple(matched_categories),
+        ),
+    )
@@ -0,0 +1,370 @@
+"""Two-stage retrieval: a wide candidate fetch, a rerank, and a context budget.
+
+`get_response` used to send exactly `search(question, limit=5)` to the model:
+five full products whether the fifth was relevant or not, and whether or not
+they fitted a sensible prompt. Ranking quality was whatever the first-stage
+index gave, and prompt size was fixed at its worst case.
+
+`retrieve` fetches `RETRIEVAL_CANDIDATES` candidates (default 30, cheap for
+either backend) and scores each against the question with a CPU scorer.
+`adaptive_k` then decides how many to keep. It drops any product scoring
+below `RETRIEVAL_MIN_SCORE`, or more than `RETRIEVAL_MAX_SCORE_GAP` below the
+best hit, and keeps between `RETRIEVAL_MIN_RESULTS` and
+`RETRIEVAL_MAX_RESULTS`. A narrow question with one clear answer then sends
+one product, not five. Finally the estimated prompt tokens are capped at
+`RETRIEVAL_CONTEXT_TOKENS`. Each kept item's `score` is the one that ranked
+it.
+
+Scorers:
+
+- `EmbeddingScorer`, when the search backend has an embedding function (the
+  local Chroma stack). Cosine similarity between the question and each
+  candidate, embedded in one batch. Document vectors are memoised, since the
+  catalogue is small and the same products come back often. With the
+  memory-mapped store (`SEARCH_BACKEND=mapped`) they are read from the store
+  instead of being embedded at all.
+- `LexicalScorer` otherwise. BM25 over the candidates, blended with the
+  backend's own rank so a semantically matched product without the query's
+  words is not thrown away.
+
+Between the cut and the budget, `RETRIEVAL_DIVERSITY` (default 0.3, or per
+request) swaps near-duplicate variants for distinct products by maximal
+marginal relevance (see `diversify.py`).
+
+Manual questions ("how do I pitch the rainfly?") are answered from passages,
+not whole products. `manual_passages` takes the best-matching manual chunks
+(see `index_products_local.py`) and groups them under their parent product,
+or under the category for the shared category manuals. It keeps at most
+`RETRIEVAL_MANUAL_CHUNKS_PER_PRODUCT` passages for each of the best
+`RETRIEVAL_MANUAL_PRODUCTS` parents, all scoring at least
+`RETRIEVAL_MANUAL_MIN_SCORE`, within `RETRIEVAL_MANUAL_TOKENS` of their own
+budget. A question with no manual-level match adds nothing.
+
+With `RETRIEVAL_RERANK=0` the search runs single-stage, and `adaptive_k`
+applies to the `score` the search backend returns (see `search_service.py`).
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any, Protocol, TypeVar
+
+import numpy as np
+
+from .diversify import hashed_vectors, mmr, normalize_rows
+from .lexical import BM25Index
+
+CHARS_PER_TOKEN = 4
+_TEXT_FIELDS = ("name", "category", "brand", "description", "content")
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RetrievalConfig:
+    enabled: bool = True
+    candidates: int = 30
+    min_results: int = 1
+    max_results: int = 5
+    min_score: float | None = None
+    max_score_gap: float | None = 0.3
+    # MMR weight of novelty against relevance; 0 keeps plain relevance order.
+    diversity: float = 0.3
+    context_tokens: int = 2000
+    manual_candidates: int = 12
+    manual_products: int = 2
+    manual_chunks_per_product: int = 2
+    manual_min_score: float = 0.35
+    manual_tokens: int = 800
+
+    @classmethod
+    def from_env(cls) -> RetrievalConfig:
+        min_score = os.getenv("RETRIEVAL_MIN_SCORE")
+        # Set but empty disables the gap cut.
+        max_gap = os.getenv("RETRIEVAL_MAX_SCORE_GAP", str(cls.max_score_gap))
+        max_results = max(1, int(os.getenv("RETRIEVAL_MAX_RESULTS") or cls.max_results))
+        return cls(
+            enabled=os.getenv("RETRIEVAL_RERANK", "1").lower() not in ("0", "false", "no"),
+            candidates=max(1, int(os.getenv("RETRIEVAL_CANDIDATES") or cls.candidates)),
+            min_results=min(max_results, max(0, int(os.getenv("RETRIEVAL_MIN_RESULTS") or cls.min_results))),
+            max_results=max_results,
+            min_score=float(min_score) if min_score else None,
+            max_score_gap=float(max_gap) if max_gap else None,
+            diversity=min(1.0, max(0.0, float(os.getenv("RETRIEVAL_DIVERSITY") or cls.diversity))),
+            manual_candidates=max(0, int(os.getenv("RETRIEVAL_MANUAL_CANDIDATES") or cls.manual_candidates)),
+            manual_products=max(0, int(os.getenv("RETRIEVAL_MANUAL_PRODUCTS") or cls.manual_products)),
+            manual_chunks_per_product=max(
+                1, int(os.getenv("RETRIEVAL_MANUAL_CHUNKS_PER_PRODUCT") or cls.manual_chunks_per_product)
+            ),
+            manual_min_score=float(os.getenv("RETRIEVAL_MANUAL_MIN_SCORE") or cls.manual_min_score),
+            manual_tokens=max(1, int(os.getenv("RETRIEVAL_MANUAL_TOKENS") or cls.manual_tokens)),
+            context_tokens=max(1, int(os.getenv("RETRIEVAL_CONTEXT_TOKENS") or cls.context_tokens)),
+        )
+
+
+class Scorer(Protocol):
+    # Scores below this are dropped unless RETRIEVAL_MIN_SCORE overrides it.
+    default_min_score: float
+
+    def score(self, query: str, documents: Sequence[str]) -> list[float]: ...
+
+    def vectors(self, documents: Sequence[str]) -> np.ndarray: ...
+
+
+def document_text(item: Mapping[str, Any]) -> str:
+    """The text a candidate is scored on, for Chroma or Discovery Engine results."""
+    fields = item.get("struct_data") or item.get("structData") or item
+    if not isinstance(fields, Mapping):
+        fields = item
+    parts = []
+    for field in _TEXT_FIELDS:
+        value = fields.get(field)
+        if value and str(value) not in parts:
+            parts.append(str(value))
+    return "\n".join(parts) if parts else json.dumps(item, default=str)
+
+
+def estimate_tokens(item: Any) -> int:
+    """Roughly what `item` costs in the prompt, as `get_response` serialises it."""
+    return math.ceil(len(json.dumps(item, indent=2, default=str)) / CHARS_PER_TOKEN)
+
+
+class EmbeddingScorer:
+    default_min_score = 0.2
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], Sequence[Sequence[float]]],
+        cache_size: int = 1024,
+        known: Callable[[str], Any] | None = None,
+        known_query: Callable[[str], Any] | None = None,
+    ) -> None:
+        self.embed = embed
+        # Looks up an already indexed document's vector (None if it has none).
+        self.known = known
+        # Looks up a query's vector embedded ahead of time (see `QueryVectors`).
+        self.known_query = known_query
+        self.cache_size = cache_size
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        # Searches run in worker threads and share one scorer.
+        self._lock = threading.Lock()
+
+    def vectors(self, documents: Sequence[str]) -> np.ndarray:
+        """Unit-length document vectors, one row per document."""
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for doc in documents:
+                if doc in self._vectors:
+                    self._vectors.move_to_end(doc)
+                    found[doc] = self._vectors[doc]
+        if self.known is not None:
+            for doc in documents:
+                if doc not in found:
+                    vector = self.known(doc)
+                    if vector is not None:
+                        found[doc] = np.asarray(vector, dtype=np.float32)
+        missing = [doc for doc in dict.fromkeys(documents) if doc not in found]
+        if missing:
+            matrix = normalize_rows(np.asarray(self.embed(missing), dtype=np.float32))
+            embedded = dict(zip(missing, matrix))
+            found.update(embedded)
+            with self._lock:
+                self._vectors.update(embedded)
+                while len(self._vectors) > self.cache_size:
+                    self._vectors.popitem(last=False)
+        return np.stack([found[doc] for doc in documents])
+
+    def score(self, query: str, documents: Sequence[str]) -> list[float]:
+        if not documents:
+            return []
+        vector = self.known_query(query) if self.known_query is not None else None
+        if vector is None:
+            vector = self.embed([query])[0]
+        query_vector = normalize_rows(np.asarray([vector], dtype=np.float32))[0]
+        return [float(score) for score in self.vectors(documents) @ query_vector]
+
+
+class LexicalScorer:
+    # Scores are relative to the best candidate, so this is a fraction of it.
+    default_min_score = 0.25
+
+    def __init__(self, rank_weight: float = 0.3):
+        self.rank_weight = rank_weight
+
+    def score(self, query: str, documents: Sequence[str]) -> list[float]:
+        if not documents:
+            return []
+        raw = BM25Index(documents).scores(query)
+        best = max(raw.values(), default=0.0)
+        count = len(documents)
+        return [
+            (1 - self.rank_weight) * (raw.get(number, 0.0) / best if best else 0.0)
+            + self.rank_weight * (1 - number / count)
+            for number in range(count)
+        ]
+
+    def vectors(self, documents: Sequence[str]) -> np.ndarray:
+        return hashed_vectors(documents)
+
+
+_embedding_scorers: dict[int, EmbeddingScorer] = {}
+
+
+def scorer_for(search_service: Any) -> Scorer:
+    """An embedding scorer when the backend has an embedding model, else lexical."""
+    from .search_service import LocalVectorSearch, MappedVectorSearch
+
+    if isinstance(search_service, (LocalVectorSearch, MappedVectorSearch)) and callable(search_service.ef):
+        scorer = _embedding_scorers.get(id(search_service.ef))
+        if scorer is None:
+            known = search_service.document_vector if isinstance(search_service, MappedVectorSearch) else None
+            scorer = _embedding_scorers[id(search_service.ef)] = EmbeddingScorer(
+                search_service.ef, known=known, known_query=search_service.query_vectors.get
+            )
+        return scorer
+    return LexicalScorer()
+
+
+def adaptive_k(
+    scored: Sequence[tuple[float | None, T]],
+    min_score: float | None,
+    max_gap: float | None,
+    min_results: int,
+    max_results: int,
+) -> list[T]:
+    """Keep, in order, the items whose score clears both cuts, within the bounds.
+
+    An item with no score (a backend that returned none) is never cut. When
+    fewer than `min_results` survive, the best-placed dropped items fill in.
+    """
+    known = [score for score, _ in scored if score is not None]
+    best = max(known, default=None)
+    kept: list[int] = []
+    for number, (score, _) in enumerate(scored):
+        if len(kept) >= max_results:
+            break
+        if score is not None:
+            if min_score is not None and score < min_score:
+                continue
+            if max_gap is not None and best is not None and best - score > max_gap:
+                continue
+        kept.append(number)
+    for number in range(len(scored)):
+        if len(kept) >= min(min_results, max_results):
+            break
+        if number not in kept:
+            kept.append(number)
+    return [scored[number][1] for number in sorted(kept)]
+
+
+def within_budget(items: Sequence[T], context_tokens: int) -> list[T]:
+    """The leading items whose estimated prompt cost fits; the first always does."""
+    kept: list[T] = []
+    tokens = 0
+    for item in items:
+        cost = estimate_tokens(item)
+        if kept and tokens + cost > context_tokens:
+            break
+        kept.append(item)
+        tokens += cost
+    return kept
+
+
+def rerank(
+    query: str,
+    candidates: Sequence[Mapping[str, Any]],
+    scorer: Scorer,
+    config: RetrievalConfig,
+) -> list[Mapping[str, Any]]:
+    """The best candidates by `scorer`, cut by `adaptive_k`, diversified, budgeted."""
+    if not candidates:
+        return []
+    texts = [document_text(item) for item in candidates]
+    scores = scorer.score(query, texts)
+    ranked = sorted(range(len(candidates)), key=lambda number: (-scores[number], number))
+    min_score = config.min_score if config.min_score is not None else scorer.default_min_score
+    # Everything that clears the cuts is eligible; the diversity stage then
+    # chooses which `max_results` of them to send.
+    pool = adaptive_k(
+        [(scores[number], number) for number in ranked],
+        min_score,
+        config.max_score_gap,
+        config.min_results,
+        len(candidates),
+    )
+    chosen = pool[: config.max_results]
+    if config.diversity > 0 and len(pool) > config.max_results:
+        picks = mmr(
+            [scores[number] for number in pool],
+            scorer.vectors([texts[number] for number in pool]),
+            config.max_results,
+            1 - config.diversity,
+        )
+        chosen = [pool[pick] for pick in picks]
+    kept = [{**candidates[number], "score": round(scores[number], 4)} for number in chosen]
+    return within_budget(kept, config.context_tokens)
+
+
+def group_passages(passages: Sequence[Mapping[str, Any]], config: RetrievalConfig) -> list[dict[str, Any]]:
+    """Best-first passages grouped by parent, capped per parent and in total."""
+    groups: dict[str, dict[str, Any]] = {}
+    for passage in passages:
+        score = passage.get("score")
+        if score is not None and score < config.manual_min_score:
+            continue
+        parent = str(passage.get("parent") or passage.get("manual") or "")
+        group = groups.get(parent)
+        if group is None:
+            if len(groups) >= config.manual_products:
+                continue
+            group = groups[parent] = {
+                "manual": passage.get("title") or passage.get("manual"),
+                "product": passage.get("name"),
+                "passages": [],
+            }
+            if score is not None:
+                group["score"] = score
+        if len(group["passages"]) < config.manual_chunks_per_product:
+            group["passages"].append(passage.get("text", ""))
+    return list(groups.values())
+
+
+def manual_passages(search_service: Any, query: str, config: RetrievalConfig) -> list[dict[str, Any]]:
+    from .search_service import SearchService
+
+    if not isinstance(search_service, SearchService) or not (config.manual_products and config.manual_candidates):
+        return []
+    try:
+        passages = search_service.search_manuals(query, limit=config.manual_candidates)
+    except Exception as e:
+        print(f"Error searching product manuals: {e}")
+        return []
+    return within_budget(group_passages(passages, config), config.manual_tokens)
+
+
+def retrieve(search_service: Any, query: str, config: RetrievalConfig | None = None) -> list:
+    """Products, then any relevant manual passages; blocking, so run it in a thread."""
+    config = config or RetrievalConfig.from_env()
+    return retrieve_products(search_service, query, config) + manual_passages(search_service, query, config)
+
+
+def retrieve_products(search_service: Any, query: str, config: RetrievalConfig) -> list:
+    """Candidate fetch plus rerank (or single-stage search with `adaptive_k`)."""
+    if not config.enabled:
+        results = search_service.search(query, limit=config.max_results)
+        kept = adaptive_k(
+            [(item.get("score"), item) for item in results],
+            config.min_score,
+            config.max_score_gap,
+            config.min_results,
+            config.max_results,
+        )
+        return within_budget(kept, config.context_tokens)
+    candidates = search_service.search(query, limit=config.candidates)
+    return rerank(query, candidates, scorer_for(search_service), config)
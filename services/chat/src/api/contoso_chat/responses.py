@@ -0,0 +1,88 @@
+"""What `POST /api/create_response` sends back, and how it is encoded.
+
+The response used to carry every context item in full (product metadata and
+descriptions, Discovery Engine fields, manual passages) next to the answer.
+The web app only turns names and slugs into product links. FastAPI then ran
+the whole body through `jsonable_encoder` and the standard `json` encoder.
+
+- `include_context` (per request, or `CHAT_RESPONSE_CONTEXT` as the default)
+  is `full` (the previous behaviour), `ids` (each item cut to
+  `REFERENCE_FIELDS`, enough to identify and link to it) or `none`.
+- `OrjsonResponse` encodes the body with orjson in one call. It handles
+  datetimes and NumPy scalars natively, so the endpoint returns it directly
+  and skips `jsonable_encoder`. `ndjson_line` does the same for each line of
+  the batch endpoint's stream.
+
+Compression for large bodies is `GZipMiddleware` in `main.py`.
+"""
+
+from __future__ import annotations
+
+import os
+from collections.abc import Mapping, Sequence
+from typing import Any, Literal
+
+import orjson
+from fastapi.responses import JSONResponse
+
+ContextMode = Literal["none", "ids", "full"]
+CONTEXT_MODES: tuple[ContextMode, ...] = ("none", "ids", "full")
+# Identify a product (`id`, `name`, `slug` or `url`) or a manual (`manual`),
+# with the score it was ranked by.
+REFERENCE_FIELDS = ("id", "name", "slug", "url", "manual", "score")
+DEFAULT_GZIP_MIN_BYTES = 1024
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class OrjsonResponse(JSONResponse):
+    """`fastapi.responses.ORJSONResponse`, with the same orjson options.
+
+    FastAPI deprecates its class and warns each time one is built or
+    subclassed. The replacement it recommends, a response model serialized by
+    Pydantic, does not fit here: the context items are free-form dicts that
+    carry NumPy scores.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=_ORJSON_OPTIONS)
+
+
+def ndjson_line(content: Any) -> bytes:
+    return orjson.dumps(content, option=_ORJSON_OPTIONS) + b"\n"
+
+
+def context_mode(requested: str | None = None) -> ContextMode:
+    """The request's `include_context`, else `CHAT_RESPONSE_CONTEXT`, else `full`."""
+    mode = requested or os.getenv("CHAT_RESPONSE_CONTEXT") or "full"
+    for known in CONTEXT_MODES:
+        if mode == known:
+            return known
+    raise ValueError(f"Unknown CHAT_RESPONSE_CONTEXT {mode!r}; expected 'none', 'ids' or 'full'")
+
+
+def shape_context(context: Sequence[Any], mode: ContextMode) -> list[Any] | None:
+    """The context as the response carries it; None drops the key."""
+    if mode == "none":
+        return None
+    if mode == "full":
+        return list(context)
+    return [
+        {field: item[field] for field in REFERENCE_FIELDS if field in item}
+        if isinstance(item, Mapping)
+        else item
+        for item in context
+    ]
+
+
+def response_body(result: Mapping[str, Any], mode: ContextMode) -> dict[str, Any]:
+    """`get_response`'s result with its context shaped for `mode`."""
+    body = {key: value for key, value in result.items() if key != "context"}
+    context = shape_context(result.get("context", []), mode)
+    if context is not None:
+        body["context"] = context
+    return body
+
+
+def gzip_min_bytes() -> int:
+    """Smallest body `GZipMiddleware` compresses (`CHAT_GZIP_MIN_BYTES`); 0 turns it off."""
+    return int(os.getenv("CHAT_GZIP_MIN_BYTES") or DEFAULT_GZIP_MIN_BYTES)
@@ -0,0 +1,198 @@
+"""Weighted-fair ordering of requests waiting for an LLM slot.
+
+`evaluate.py` and internal bulk tools share the chat backend with live
+shoppers. With a FIFO wait queue an eval run that fills the queue makes every
+shopper wait behind it, and a Platinum member waits exactly as long as a guest.
+
+Requests waiting in a `ConcurrencyLimiter` are ordered by start-time fair
+queueing instead. Each request belongs to a class -- its traffic class
+(`interactive` or `batch`) crossed with the customer's membership tier -- and
+each class has a weight. Under contention a class receives slots in proportion
+to its weight; with one class waiting the order is plain FIFO. Two guards keep
+the low-weight classes from starving: any request that has waited longer than
+`SCHEDULER_MAX_WAIT_SECONDS` is served first, oldest first; and a full queue
+sheds its lowest-weight, most recent waiter to make room for a heavier one
+rather than refusing the heavier one.
+
+Weights are configurable: `SCHEDULER_CLASS_WEIGHTS="interactive=8,batch=1"`
+and `SCHEDULER_TIER_WEIGHTS="platinum=4,gold=2,base=1"`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+DEFAULT_CLASS_WEIGHTS = {INTERACTIVE: 8.0, BATCH: 1.0}
+DEFAULT_TIER_WEIGHTS = {"platinum": 4.0, "gold": 2.0, "base": 1.0}
+DEFAULT_TIER = "base"
+DEFAULT_MAX_WAIT_SECONDS = 5.0
+
+
+def _parse_weights(raw: str | None, defaults: dict[str, float]) -> dict[str, float]:
+    weights = dict(defaults)
+    for entry in (raw or "").split(","):
+        name, _, value = entry.partition("=")
+        if name.strip() and value.strip():
+            weights[name.strip().lower()] = max(float(value), 0.01)
+    return weights
+
+
+def class_weights() -> dict[str, float]:
+    return _parse_weights(os.getenv("SCHEDULER_CLASS_WEIGHTS"), DEFAULT_CLASS_WEIGHTS)
+
+
+def tier_weights() -> dict[str, float]:
+    return _parse_weights(os.getenv("SCHEDULER_TIER_WEIGHTS"), DEFAULT_TIER_WEIGHTS)
+
+
+def traffic_class(value: str | None) -> str:
+    """Normalise a caller-supplied traffic class; unknown values are interactive."""
+    normalized = (value or "").strip().lower()
+    return normalized if normalized in class_weights() else INTERACTIVE
+
+
+def membership_tier(customer: dict[str, Any] | None) -> str:
+    """The scheduling tier for a customer row from `db.fetch_customer_summary`."""
+    membership = str((customer or {}).get("membership") or "").strip().lower()
+    return membership if membership in tier_weights() else DEFAULT_TIER
+
+
+@dataclass(frozen=True)
+class Priority:
+    traffic_class: str = INTERACTIVE
+    tier: str = DEFAULT_TIER
+
+    @property
+    def key(self) -> str:
+        return f"{self.traffic_class}:{self.tier}"
+
+    @property
+    def weight(self) -> float:
+        return class_weights().get(self.traffic_class, 1.0) * tier_weights().get(self.tier, 1.0)
+
+
+DEFAULT_PRIORITY = Priority()
+
+
+@dataclass
+class _Entry:
+    waiter: asyncio.Future[None]
+    priority: Priority
+    weight: float
+    tag: float
+    enqueued: float
+
+
+class _ClassStats:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self, waiting: int) -> dict[str, Any]:
+        return {
+            "waiting": waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_seconds": {
+                "max": round(self.max_wait, 4),
+                "mean": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            },
+        }
+
+
+class WeightedFairQueue:
+    """Waiters ordered by start-time fair queueing with an aging override."""
+
+    def __init__(self, max_wait: float | None = None):
+        if max_wait is None:
+            max_wait = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS") or DEFAULT_MAX_WAIT_SECONDS)
+        self.max_wait = max_wait
+        self._entries: list[_Entry] = []
+        self._virtual_time = 0.0
+        self._last_tag: dict[str, float] = {}
+        self._stats: dict[str, _ClassStats] = {}
+
+    def __len__(self) -> int:
+        return sum(1 for entry in self._entries if not entry.waiter.done())
+
+    def push(self, waiter: asyncio.Future[None], priority: Priority) -> None:
+        weight = priority.weight
+        start = max(self._virtual_time, self._last_tag.get(priority.key, 0.0))
+        tag = start + 1.0 / weight
+        self._last_tag[priority.key] = tag
+        self._entries.append(_Entry(waiter, priority, weight, tag, time.monotonic()))
+
+    def pop(self) -> asyncio.Future[None] | None:
+        """Remove and return the next live waiter, or None if none is left."""
+        self._entries = [entry for entry in self._entries if not entry.waiter.done()]
+        if not self._entries:
+            return None
+
+        now = time.monotonic()
+        starved = [entry for entry in self._entries if now - entry.enqueued >= self.max_wait]
+        if starved:
+            chosen = min(starved, key=lambda entry: entry.enqueued)
+        else:
+            chosen = min(self._entries, key=lambda entry: (entry.tag, entry.enqueued))
+
+        self._entries.remove(chosen)
+        self._virtual_time = max(self._virtual_time, chosen.tag - 1.0 / chosen.weight)
+        stats = self._class_stats(chosen.priority)
+        waited = now - chosen.enqueued
+        stats.admitted += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        return chosen.waiter
+
+    def remove(self, waiter: asyncio.Future[None]) -> None:
+        self._entries = [entry for entry in self._entries if entry.waiter is not waiter]
+
+    def sheddable(self, priority: Priority) -> bool:
+        return self._victim(priority) is not None
+
+    def shed(self, priority: Priority, error: BaseException) -> bool:
+        """Fail the lightest, newest waiter lighter than `priority` with `error`."""
+        victim = self._victim(priority)
+        if victim is None:
+            return False
+        self._entries.remove(victim)
+        victim.waiter.set_exception(error)
+        self._class_stats(victim.priority).shed += 1
+        return True
+
+    def _victim(self, priority: Priority) -> _Entry | None:
+        weight = priority.weight
+        lighter = [
+            entry
+            for entry in self._entries
+            if not entry.waiter.done() and entry.weight < weight
+        ]
+        if not lighter:
+            return None
+        return min(lighter, key=lambda entry: (entry.weight, -entry.enqueued))
+
+    def _class_stats(self, priority: Priority) -> _ClassStats:
+        stats = self._stats.get(priority.key)
+        if stats is None:
+            stats = self._stats[priority.key] = _ClassStats()
+        return stats
+
+    def snapshot(self) -> dict[str, Any]:
+        waiting: dict[str, int] = {}
+        for entry in self._entries:
+            if not entry.waiter.done():
+                waiting[entry.priority.key] = waiting.get(entry.priority.key, 0) + 1
+        keys = sorted(set(self._stats) | set(waiting))
+        return {
+            key: self._stats.get(key, _ClassStats()).snapshot(waiting.get(key, 0))
+            for key in keys
+        }
@@ -1,26 +1,112 @@
+import importlib
 import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
 from types import SimpleNamespace
 from typing import Any
 
-from google.cloud import discoveryengine_v1alpha as discoveryengine
+import numpy as np
 
-try:
-    import chromadb as _chromadb
-    from chromadb.utils import embedding_functions as _embedding_functions
+from .embedding_store import EmbeddingStore
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .query_filters import CATEGORY_SYNONYMS, parse_query
+from .rerank import document_text
 
-    chromadb: Any = _chromadb
-    embedding_functions: Any = _embedding_functions
-except ImportError:
-    chromadb = SimpleNamespace(PersistentClient=None)
-    embedding_functions = SimpleNamespace(DefaultEmbeddingFunction=None)
+# The provider SDKs are imported on first use, not with this module. Each is
+# only needed by one backend, and between them they cost seconds of import
+# time and hundreds of MB of RSS on a cold start. `discoveryengine`,
+# `chromadb` and `embedding_functions` still resolve as module attributes
+# (PEP 562), so `patch("contoso_chat.search_service.chromadb....")` works.
+_LAZY_MODULES = {
+    "discoveryengine": "google.cloud.discoveryengine_v1alpha",
+    "chromadb": "chromadb",
+    "embedding_functions": "chromadb.utils.embedding_functions",
+}
+# Stand-ins when the optional local stack is not installed.
+_MISSING_LOCAL_STACK = {
+    "chromadb": SimpleNamespace(PersistentClient=None),
+    "embedding_functions": SimpleNamespace(DefaultEmbeddingFunction=None),
+}
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        module: Any = importlib.import_module(module_name)
+    except ImportError:
+        if name not in _MISSING_LOCAL_STACK:
+            raise
+        module = _MISSING_LOCAL_STACK[name]
+    globals()[name] = module
+    return module
+
+
+def _lazy(name: str) -> Any:
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+class QueryVectors:
+    """Query embeddings computed ahead of the searches that need them.
+
+    A batch of questions (`chat_request.get_responses`) embeds all of its
+    query texts in one call to the model, not one call per search. The
+    searches and the reranker's query vector then find theirs here. Texts
+    nobody primed are not cached, so single requests behave as before.
+    """
+
+    def __init__(self, embed: Callable[[list[str]], Sequence[Sequence[float]]], size: int = 1024) -> None:
+        self.embed = embed
+        self.size = size
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        # Searches run in worker threads and share one service.
+        self._lock = threading.Lock()
+
+    def prime(self, texts: Sequence[str]) -> None:
+        with self._lock:
+            missing = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        if not missing:
+            return
+        vectors = self.embed(missing)
+        with self._lock:
+            for text, vector in zip(missing, vectors):
+                self._vectors[text] = np.asarray(vector, dtype=np.float32)
+            while len(self._vectors) > self.size:
+                self._vectors.popitem(last=False)
+
+    def get(self, text: str) -> np.ndarray | None:
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is not None:
+                self._vectors.move_to_end(text)
+        return vector
+
+
+def _query(collection: Any, query_vectors: QueryVectors, text: str, **options: Any) -> Any:
+    """`collection.query` for one text, with its primed embedding when there is one."""
+    vector = query_vectors.get(text)
+    if vector is None:
+        return collection.query(query_texts=[text], **options)
+    return collection.query(query_embeddings=[vector.tolist()], **options)
 
 
 class SearchService:
     def search(self, query: str, limit: int = 5) -> list:
         raise NotImplementedError
 
+    def prepare(self, queries: Sequence[str]) -> None:
+        """Do up front, together, the work `search` would repeat for each of `queries`."""
+
+    def search_manuals(self, query: str, limit: int = 12) -> list:
+        """Manual passages (`text`, `score` and their parent metadata), best first."""
+        return []
+
 class LocalVectorSearch(SearchService):
-    def __init__(self):
+    def __init__(self) -> None:
+        chromadb = _lazy("chromadb")
+        embedding_functions = _lazy("embedding_functions")
         if not callable(getattr(chromadb, "PersistentClient", None)) or not callable(
             getattr(embedding_functions, "DefaultEmbeddingFunction", None)
         ):
@@ -34,23 +120,60 @@ class LocalVectorSearch(SearchService):
         self.chroma_path = os.getenv("CHROMA_DB_PATH", "/app/data/chroma_db")
         self.client = chromadb.PersistentClient(path=self.chroma_path)
         self.ef = embedding_functions.DefaultEmbeddingFunction()
+        self.query_vectors = QueryVectors(self.ef)
         try:
             self.collection = self.client.get_collection(name="products", embedding_function=self.ef)
         except Exception as e:
             print(f"Error initializing local vector search: {e}")
             self.collection = None
+        self.brands: set[str] = set()
+        self.categories: set[str] = set()
+        self._manuals: Any = None
+
+    def _learn_vocabulary(self, metadatas) -> None:
+        # Brand and category filters are only ever built from values that are
+        # actually in the index.
+        for meta in metadatas or []:
+            if meta.get("brand"):
+                self.brands.add(meta["brand"])
+            if meta.get("category"):
+                self.categories.add(meta["category"])
+
+    def _ensure_vocabulary(self) -> None:
+        if self.brands or self.categories or not self.collection:
+            return
+        try:
+            self._learn_vocabulary(self.collection.get(include=["metadatas"])["metadatas"])
+        except Exception as e:
+            print(f"Error reading local search vocabulary: {e}")
+
+    def prepare(self, queries: Sequence[str]) -> None:
+        if not self.collection:
+            return
+        self._ensure_vocabulary()
+        texts = []
+        for query in queries:
+            texts += [query, parse_query(query, self.brands, self.categories).text]
+        self.query_vectors.prime(texts)
 
     def search(self, query: str, limit: int = 5) -> list:
         if not self.collection:
             return []
-            
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=limit
-        )
+
+        self._ensure_vocabulary()
+        parsed = parse_query(query, self.brands, self.categories)
+        where = parsed.filters.chroma_where()
+        results = None
+        if where is not None:
+            results = _query(self.collection, self.query_vectors, parsed.text, n_results=limit, where=where)
+        if not results or not results['ids'] or not results['ids'][0]:
+            # Nothing matches the stated constraints; let the model say so
+            # with the nearest products in hand rather than with none.
+            results = _query(self.collection, self.query_vectors, query, n_results=limit)
         
         # Format results to match Discovery Engine structure roughly (list of dicts)
         formatted_results = []
+        distances = (results.get('distances') or [None])[0]
         if results['metadatas'] and results['documents']:
             for i, meta in enumerate(results['metadatas'][0]):
                 # Add the document text as 'content' or similar to match what the prompt expects
@@ -58,34 +181,351 @@ class LocalVectorSearch(SearchService):
                 # We'll just put the text in a key that the prompt can use.
                 item = meta.copy()
                 item['content'] = results['documents'][0][i]
+                if distances:
+                    item['score'] = self.similarity(distances[i])
                 formatted_results.append(item)
         
         return formatted_results
 
+    def search_manuals(self, query: str, limit: int = 12) -> list:
+        # Built by index_products_local.py alongside "products"; an index from
+        # before manuals were indexed simply has no passages.
+        if self._manuals is None:
+            try:
+                self._manuals = self.client.get_collection(name="manuals", embedding_function=self.ef)
+            except Exception:
+                return []
+        results = _query(self._manuals, self.query_vectors, query, n_results=limit)
+        passages = []
+        if results['metadatas'] and results['documents']:
+            distances = (results.get('distances') or [None])[0]
+            for i, meta in enumerate(results['metadatas'][0]):
+                passage = dict(meta)
+                passage['text'] = results['documents'][0][i]
+                if distances:
+                    passage['score'] = self.similarity(distances[i])
+                passages.append(passage)
+        return passages
+
+    def similarity(self, distance: float) -> float:
+        """Chroma's distance as a relevance score: 1 is identical, 0 unrelated."""
+        metadata = getattr(self.collection, "metadata", None)
+        space = metadata.get("hnsw:space", "l2") if isinstance(metadata, dict) else "l2"
+        # The default embedding model emits unit vectors, so squared L2 is
+        # 2 - 2cos; "cosine" and "ip" distances are already 1 - cos.
+        similarity = 1 - distance / 2 if space == "l2" else 1 - distance
+        return round(max(0.0, min(1.0, similarity)), 4)
+
+
+class HybridSearch(LocalVectorSearch):
+    """Local vector search fused with a BM25 index over the same documents.
+
+    The lexical index is built from the Chroma collection when the service is
+    built, so it always matches what `index_products_local.py` last wrote.
+    Each query takes `CANDIDATE_MULTIPLIER * limit` candidates from both
+    rankers and fuses them by reciprocal rank (see `lexical.py`).
+    """
+
+    CANDIDATE_MULTIPLIER = 4
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+        if self.collection is not None:
+            corpus = self.collection.get(include=["documents", "metadatas"])
+            self.ids = list(corpus["ids"])
+            self.documents = list(corpus["documents"] or [])
+            self.metadatas = [dict(meta or {}) for meta in corpus["metadatas"] or []]
+        self.positions = {doc_id: number for number, doc_id in enumerate(self.ids)}
+        self.lexical = BM25Index(self.documents)
+        self._learn_vocabulary(self.metadatas)
+
+    def search(self, query: str, limit: int = 5) -> list:
+        if not self.collection:
+            return []
+
+        parsed = parse_query(query, self.brands, self.categories)
+        allowed = {
+            number for number, meta in enumerate(self.metadatas) if parsed.filters.matches(meta)
+        }
+        where = parsed.filters.chroma_where()
+        text = parsed.text
+        if where is None or not allowed:
+            # No constraints, or nothing satisfies them: rank the whole catalogue.
+            where, text, allowed = None, query, set(range(len(self.ids)))
+
+        candidates = min(max(limit, limit * self.CANDIDATE_MULTIPLIER), max(len(allowed), 1))
+        if where is None:
+            vector = _query(self.collection, self.query_vectors, text, n_results=candidates)
+        else:
+            vector = _query(self.collection, self.query_vectors, text, n_results=candidates, where=where)
+        vector_ranking = [
+            self.positions[doc_id] for doc_id in vector["ids"][0] if doc_id in self.positions
+        ]
+        distances = (vector.get("distances") or [None])[0] or []
+        vector_scores = {
+            self.positions[doc_id]: self.similarity(distance)
+            for doc_id, distance in zip(vector["ids"][0], distances)
+            if doc_id in self.positions
+        }
+        lexical_ranking = [number for number, _ in self.lexical.search(text, candidates, allowed)]
+
+        formatted_results = []
+        for number in reciprocal_rank_fusion([vector_ranking, lexical_ranking])[:limit]:
+            item = self.metadatas[number].copy()
+            item['content'] = self.documents[number]
+            # RRF ranks are not scores; the vector similarity is the absolute
+            # signal. Lexical-only hits have none and are not cut by threshold.
+            if number in vector_scores:
+                item['score'] = vector_scores[number]
+            formatted_results.append(item)
+        return formatted_results
+
+
+def embedding_store_path() -> str:
+    """Where the indexer writes the memory-mapped stores: EMBEDDING_STORE_PATH,
+    or an `embeddings` directory next to the Chroma one."""
+    chroma_path = os.getenv("CHROMA_DB_PATH", "/app/data/chroma_db")
+    return os.getenv("EMBEDDING_STORE_PATH") or os.path.join(
+        os.path.dirname(os.path.normpath(chroma_path)), "embeddings"
+    )
+
+
+class MappedVectorSearch(SearchService):
+    """Exact vector search over the memory-mapped stores (see `embedding_store.py`).
+
+    Chroma is never opened: the only per-process state is the sidecar
+    metadata and the embedding model that embeds the query. The vectors
+    themselves are shared with every other worker through the page cache.
+    """
+
+    def __init__(self) -> None:
+        embedding_functions = _lazy("embedding_functions")
+        if not callable(getattr(embedding_functions, "DefaultEmbeddingFunction", None)):
+            raise RuntimeError(
+                "Local vector search dependencies are not installed. "
+                "Rebuild with CHAT_INSTALL_LOCAL_STACK=1 or install requirements-local.txt."
+            )
+        self.store_path = embedding_store_path()
+        self.ef = embedding_functions.DefaultEmbeddingFunction()
+        self.query_vectors = QueryVectors(self.ef)
+        try:
+            self.collection: EmbeddingStore | None = EmbeddingStore.open(self.store_path, "products")
+        except Exception as e:
+            print(f"Error opening embedding store: {e}")
+            self.collection = None
+        self._manuals: EmbeddingStore | None = None
+        self.brands: set[str] = set()
+        self.categories: set[str] = set()
+        for meta in self.collection.metadatas if self.collection else []:
+            if meta.get("brand"):
+                self.brands.add(meta["brand"])
+            if meta.get("category"):
+                self.categories.add(meta["category"])
+        # Rerank scores `document_text` of each result, not the indexed
+        # document, so its stored vector is looked up by that text.
+        self.rerank_rows = {
+            document_text(self._result(row)): row for row in range(len(self.collection or ()))
+        }
+
+    def _result(self, row: int) -> dict:
+        assert self.collection is not None
+        item = self.collection.metadatas[row].copy()
+        item['content'] = self.collection.documents[row]
+        return item
+
+    def _embed(self, text: str) -> Any:
+        vector = self.query_vectors.get(text)
+        return vector if vector is not None else self.ef([text])[0]
+
+    def prepare(self, queries: Sequence[str]) -> None:
+        if not self.collection:
+            return
+        texts = []
+        for query in queries:
+            texts += [query, parse_query(query, self.brands, self.categories).text]
+        self.query_vectors.prime(texts)
+
+    def search(self, query: str, limit: int = 5) -> list:
+        store = self.collection
+        if not store:
+            return []
+
+        parsed = parse_query(query, self.brands, self.categories)
+        hits: list[tuple[int, float]] = []
+        if parsed.filters:
+            mask = np.fromiter(
+                (parsed.filters.matches(meta) for meta in store.metadatas), dtype=bool, count=len(store)
+            )
+            if mask.any():
+                hits = store.search(self._embed(parsed.text), limit, mask)
+        if not hits:
+            # As in LocalVectorSearch: nothing matches, so rank everything.
+            hits = store.search(self._embed(query), limit)
+
+        formatted_results = []
+        for row, score in hits:
+            item = self._result(row)
+            item['score'] = round(max(0.0, min(1.0, score)), 4)
+            formatted_results.append(item)
+        return formatted_results
+
+    def search_manuals(self, query: str, limit: int = 12) -> list:
+        if self._manuals is None:
+            try:
+                self._manuals = EmbeddingStore.open(self.store_path, "manuals")
+            except Exception:
+                return []
+        store = self._manuals
+        passages = []
+        for row, score in store.search(self._embed(query), limit):
+            passage = dict(store.metadatas[row])
+            passage['text'] = store.documents[row]
+            passage['score'] = round(max(0.0, min(1.0, score)), 4)
+            passages.append(passage)
+        return passages
+
+    def document_vector(self, text: str) -> Any:
+        """The indexed vector of a product result's `document_text`, so rerank need not embed it again."""
+        row = self.rerank_rows.get(text)
+        return None if row is None or self.collection is None else self.collection.vector(row)
+
+
+# What the prompt and reranker use of a Discovery Engine result; see
+# `VertexAISearch._project`.
+RESULT_FIELDS = ("id", "name", "price", "category", "brand", "description", "url")
+
+
 class VertexAISearch(SearchService):
     def __init__(self, project_id: str, location: str, search_app_id: str):
         self.project_id = project_id
         self.location = location
         self.search_app_id = search_app_id
-        self.client = discoveryengine.SearchServiceClient()
+        self.discoveryengine = _lazy("discoveryengine")
+        self.client = self.discoveryengine.SearchServiceClient()
         self.serving_config = f"projects/{self.project_id}/locations/global/collections/default_collection/dataStores/{self.search_app_id}/servingConfigs/default_config"
 
     def search(self, query: str, limit: int = 5) -> list:
+        # The datastore cannot cheaply list its brands, so they come from
+        # "from X" / "by X"; categories are the catalogue's fixed taxonomy.
+        parsed = parse_query(query, brands=None, categories=CATEGORY_SYNONYMS)
+        expression = parsed.filters.discovery_engine_filter()
+        if expression:
+            try:
+                results = self._search(parsed.text, limit, filter=expression)
+            except Exception as e:
+                # e.g. price/brand/category not marked filterable in the schema.
+                print(f"Error applying Vertex AI Search filter {expression!r}: {e}")
+                results = []
+            if results:
+                return results
         try:
-            request = discoveryengine.SearchRequest(
-                serving_config=self.serving_config,
-                query=query,
-                page_size=limit,
-            )
-            response = self.client.search(request)
-            return [discoveryengine.Document.to_dict(r.document) for r in response.results]
+            return self._search(query, limit)
         except Exception as e:
             print(f"Error searching products in Vertex AI Search: {e}")
             return []
 
+    def _search(self, query: str, limit: int, **options: Any) -> list:
+        threshold = os.getenv("VERTEX_SEARCH_RELEVANCE_THRESHOLD")
+        if threshold:
+            # Server-side cut: LOWEST, LOW, MEDIUM or HIGH.
+            options["relevance_threshold"] = self.discoveryengine.SearchRequest.RelevanceThreshold[
+                threshold.upper()
+            ]
+        request = self.discoveryengine.SearchRequest(
+            serving_config=self.serving_config,
+            query=query,
+            page_size=limit,
+            **options,
+        )
+        response = self.client.search(request)
+        documents = []
+        for r in response.results:
+            document = self._project(r.document)
+            score = self._relevance(r)
+            if score is not None:
+                document["score"] = score
+            documents.append(document)
+        return documents
+
+    @staticmethod
+    def _project(document: Any) -> dict[str, Any]:
+        """The prompt's fields of a result, read straight off its `struct_data`.
+
+        `Document.to_dict` converted the whole message (name, schema id,
+        content, derived data) only for `get_response` to serialise all of it
+        into the prompt. The result has the same flat shape as the local
+        backends' results.
+        """
+        fields = getattr(document, "struct_data", None) or {}
+        item = {field: fields[field] for field in RESULT_FIELDS if field in fields}
+        if "id" not in item and getattr(document, "id", None):
+            item["id"] = document.id
+        return item
+
+    @staticmethod
+    def _relevance(result: Any) -> float | None:
+        """The result's relevance score, where the serving config returns one."""
+        model_scores = getattr(result, "model_scores", None)
+        if model_scores and "relevance_score" in model_scores:
+            values = list(model_scores["relevance_score"].values)
+            if values:
+                return round(float(values[0]), 4)
+        signals = getattr(result, "rank_signals", None)
+        value = getattr(signals, "relevance_score", None)
+        return round(float(value), 4) if value else None
+
+_services: dict[tuple[str | None, ...], SearchService] = {}
+
+
 def get_search_service() -> SearchService:
+    """The search backend for the current configuration, built once and reused.
+
+    Construction is the expensive part -- a Discovery Engine gRPC channel, or
+    Chroma plus its ONNX embedding model -- so it happens once per process
+    (normally during warm-up) rather than on every request. A local index
+    that is not there yet is not cached, so it is picked up once it is built.
+    """
     provider = os.getenv("LLM_PROVIDER", "gcp")
     if provider == "local":
+        key: tuple[str | None, ...] = (
+            provider,
+            os.getenv("CHROMA_DB_PATH"),
+            os.getenv("SEARCH_BACKEND", "vector"),
+            os.getenv("EMBEDDING_STORE_PATH"),
+        )
+    else:
+        key = (
+            provider,
+            os.getenv("PROJECT_ID"),
+            os.getenv("REGION"),
+            os.getenv("DISCOVERY_ENGINE_DATASTORE_ID"),
+        )
+    service = _services.get(key)
+    if service is None:
+        service = _build_search_service(provider)
+        if getattr(service, "collection", True) is not None:
+            _services[key] = service
+    return service
+
+
+def reset_search_services() -> None:
+    _services.clear()
+
+
+def _build_search_service(provider: str) -> SearchService:
+    if provider == "local":
+        backend = os.getenv("SEARCH_BACKEND", "vector")
+        if backend == "hybrid":
+            return HybridSearch()
+        if backend == "mapped":
+            return MappedVectorSearch()
+        if backend != "vector":
+            raise ValueError(
+                f"Unknown SEARCH_BACKEND {backend!r}; expected 'vector', 'hybrid' or 'mapped'"
+            )
         return LocalVectorSearch()
 
     project_id = os.getenv("PROJECT_ID")
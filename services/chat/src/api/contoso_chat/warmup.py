@@ -0,0 +1,90 @@
+"""Controlled start-up warm-up for the configured providers.
+
+The provider SDKs are imported lazily (see `search_service.py`), which keeps
+an instance that only talks to Vertex from ever loading Chroma and torch. Left
+alone, though, the configured provider's SDK would then load inside the first
+shopper's request. `warm_up` imports exactly the configured providers' modules
+and builds the search service during start-up, before the instance takes
+traffic, and reports what each step cost in time and resident memory.
+
+With the local provider configured, `main.py` then preloads the Ollama model
+(see `ollama.py`). `CHAT_WARMUP=0` skips both, e.g. for tests or one-off
+scripts.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import resource
+import sys
+import time
+from importlib import import_module
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_MODULES = {
+    "gcp": ("vertexai", "vertexai.generative_models", "google.cloud.discoveryengine_v1alpha"),
+    "local": ("httpx2", "chromadb", "chromadb.utils.embedding_functions"),
+}
+
+
+def configured_providers() -> list[str]:
+    providers = [os.getenv("LLM_PROVIDER", "gcp")]
+    for name in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(","):
+        if name.strip() and name.strip() not in providers:
+            providers.append(name.strip())
+    return providers
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _timed(step: str, action: Any, report: dict[str, Any]) -> None:
+    before_rss = rss_mb()
+    started = time.perf_counter()
+    entry: dict[str, Any] = {}
+    try:
+        action()
+    except Exception as exc:  # noqa: BLE001
+        entry["error"] = f"{type(exc).__name__}: {exc}"
+    entry["seconds"] = round(time.perf_counter() - started, 4)
+    entry["rss_delta_mb"] = round(rss_mb() - before_rss, 1)
+    report["steps"][step] = entry
+
+
+def warm_up(providers: list[str] | None = None) -> dict[str, Any]:
+    """Import the providers' SDKs and build the search service; return a report."""
+    from .search_service import get_search_service
+
+    providers = providers if providers is not None else configured_providers()
+    report: dict[str, Any] = {
+        "providers": providers,
+        "rss_mb_before": round(rss_mb(), 1),
+        "steps": {},
+    }
+    started = time.perf_counter()
+    for provider in providers:
+        for module in PROVIDER_MODULES.get(provider, ()):
+            _timed(f"import {module}", lambda module=module: import_module(module), report)
+    # The search backend for LLM_PROVIDER loads its client (and, locally, the
+    # embedding model) on construction; `get_search_service` keeps it.
+    _timed("search service", get_search_service, report)
+
+    report["seconds"] = round(time.perf_counter() - started, 4)
+    report["rss_mb_after"] = round(rss_mb(), 1)
+    report["modules_loaded"] = len(sys.modules)
+    logger.info("Warm-up complete", extra={"warmup": report})
+    return report
@@ -7,16 +7,21 @@ removes. Because the web app and the chat service generated from the same
 tracking Prisma releases.
 
 The chat service only ever read from the database -- one customer lookup and a
-health probe -- so it talks to Postgres directly instead.
+health probe -- so it talks to Postgres directly instead. Because it only
+reads, the customer lookup can be served by a read replica (see
+`ReplicaRouter`).
 """
 
 from __future__ import annotations
 
 import os
+import time
+from datetime import datetime
 from typing import Any
 from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import asyncpg
+import orjson
 
 # Prisma accepts connection-string parameters that asyncpg rejects. `schema` is
 # the common one: the repo's own .env.example ships `?schema=public`.
@@ -49,11 +54,28 @@ def normalize_dsn(url: str) -> str:
     return urlunsplit(parts._replace(query=urlencode(kept)))
 
 
-async def connect() -> asyncpg.Connection:
+async def connect(timeout: float | None = None) -> asyncpg.Connection:
+    """Open a connection; `timeout` bounds the connect and every statement on it.
+
+    The statement bound is applied twice: `statement_timeout` makes Postgres
+    cancel the query server-side, and `command_timeout` stops the client
+    waiting if the server never answers at all.
+    """
     dsn = os.environ.get("DATABASE_URL")
     if not dsn:
         raise RuntimeError("DATABASE_URL is not set.")
-    return await asyncpg.connect(normalize_dsn(dsn))
+    return await _connect(dsn, timeout)
+
+
+async def _connect(dsn: str, timeout: float | None) -> asyncpg.Connection:
+    if timeout is None:
+        return await asyncpg.connect(normalize_dsn(dsn))
+    return await asyncpg.connect(
+        normalize_dsn(dsn),
+        timeout=timeout,
+        command_timeout=timeout,
+        server_settings={"statement_timeout": str(max(1, int(timeout * 1000)))},
+    )
 
 
 async def check_connection() -> tuple[bool, str | None]:
@@ -70,6 +92,169 @@ async def check_connection() -> tuple[bool, str | None]:
             await connection.close()
 
 
+# Read replicas. Everything the chat service runs is a read, so with
+# `DATABASE_REPLICA_URLS` (comma separated) set, reads go to a replica and the
+# primary is left to the web app's writes. Replicas are taken in turn. One
+# that fails to connect, or whose replay lag is over
+# `DATABASE_REPLICA_MAX_LAG_SECONDS`, is skipped for
+# `DATABASE_REPLICA_RETRY_SECONDS`. Lag is measured on a fresh connection at
+# most every `DATABASE_REPLICA_CHECK_SECONDS`, not on every read. With no
+# usable replica, the read goes to `DATABASE_URL`.
+DEFAULT_REPLICA_MAX_LAG_SECONDS = 5.0
+DEFAULT_REPLICA_CHECK_SECONDS = 10.0
+DEFAULT_REPLICA_RETRY_SECONDS = 30.0
+
+# Seconds the replica is behind the primary. Replay-timestamp lag alone grows
+# while the primary is idle, so a replica that has replayed everything it
+# received counts as current. (Not a `_*QUERY`: it reads no Prisma model, so
+# the schema drift test has nothing to check in it.)
+_REPLICA_LAG_SQL = """
+SELECT CASE
+         WHEN NOT pg_is_in_recovery() THEN 0
+         WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END
+"""
+
+
+class Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.lag: float | None = None
+        self.checked_at: float | None = None
+        self.skip_until = 0.0
+        self.reads = 0
+        self.failures = 0
+        self.last_error: str | None = None
+
+    @property
+    def host(self) -> str:
+        """The replica's address, for health output; never its credentials."""
+        parts = urlsplit(self.dsn)
+        return f"{parts.hostname or ''}:{parts.port or 5432}"
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        dsns: list[str],
+        max_lag: float = DEFAULT_REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = DEFAULT_REPLICA_CHECK_SECONDS,
+        retry_after: float = DEFAULT_REPLICA_RETRY_SECONDS,
+    ):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.primary_reads = 0
+        self._next = 0
+
+    @classmethod
+    def from_env(cls) -> ReplicaRouter:
+        urls = os.getenv("DATABASE_REPLICA_URLS", "")
+        return cls(
+            [url.strip() for url in urls.split(",") if url.strip()],
+            float(os.getenv("DATABASE_REPLICA_MAX_LAG_SECONDS") or DEFAULT_REPLICA_MAX_LAG_SECONDS),
+            float(os.getenv("DATABASE_REPLICA_CHECK_SECONDS") or DEFAULT_REPLICA_CHECK_SECONDS),
+            float(os.getenv("DATABASE_REPLICA_RETRY_SECONDS") or DEFAULT_REPLICA_RETRY_SECONDS),
+        )
+
+    def candidates(self) -> list[Replica]:
+        """Usable replicas, starting from the next one in turn."""
+        now = time.monotonic()
+        count = len(self.replicas)
+        start = self._next
+        self._next = (self._next + 1) % count if count else 0
+        ordered = [self.replicas[(start + offset) % count] for offset in range(count)]
+        return [replica for replica in ordered if replica.skip_until <= now]
+
+    def needs_lag_check(self, replica: Replica) -> bool:
+        return replica.checked_at is None or time.monotonic() - replica.checked_at >= self.check_interval
+
+    def record_lag(self, replica: Replica, lag: float) -> bool:
+        """Store a lag measurement; return whether the replica may serve reads."""
+        replica.lag = lag
+        replica.checked_at = time.monotonic()
+        if lag <= self.max_lag:
+            return True
+        replica.last_error = f"replication lag {lag:.1f}s over {self.max_lag:g}s"
+        replica.skip_until = replica.checked_at + self.retry_after
+        return False
+
+    def record_failure(self, replica: Replica, exc: BaseException) -> None:
+        replica.failures += 1
+        replica.last_error = str(exc) or type(exc).__name__
+        replica.skip_until = time.monotonic() + self.retry_after
+        # Measure again before trusting it once it is back.
+        replica.checked_at = None
+
+    def snapshot(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "primary_reads": self.primary_reads,
+            "replicas": [
+                {
+                    "host": replica.host,
+                    "available": replica.skip_until <= now,
+                    "lag_seconds": replica.lag,
+                    "reads": replica.reads,
+                    "failures": replica.failures,
+                    "last_error": replica.last_error,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+_routers: dict[tuple[str | None, ...], ReplicaRouter] = {}
+
+
+def replica_router() -> ReplicaRouter:
+    """The router for the current replica settings, kept for the process."""
+    key = tuple(
+        os.getenv(name)
+        for name in (
+            "DATABASE_REPLICA_URLS",
+            "DATABASE_REPLICA_MAX_LAG_SECONDS",
+            "DATABASE_REPLICA_CHECK_SECONDS",
+            "DATABASE_REPLICA_RETRY_SECONDS",
+        )
+    )
+    router = _routers.get(key)
+    if router is None:
+        router = _routers[key] = ReplicaRouter.from_env()
+    return router
+
+
+async def connect_for_read(timeout: float | None = None) -> asyncpg.Connection:
+    """A connection for reads: a current replica if there is one, else the primary."""
+    router = replica_router()
+    for replica in router.candidates():
+        try:
+            connection = await _connect(replica.dsn, timeout)
+        except Exception as exc:  # noqa: BLE001
+            router.record_failure(replica, exc)
+            continue
+        if router.needs_lag_check(replica):
+            try:
+                current = router.record_lag(replica, float(await connection.fetchval(_REPLICA_LAG_SQL)))
+            except Exception as exc:  # noqa: BLE001
+                router.record_failure(replica, exc)
+                current = False
+            if not current:
+                await connection.close()
+                continue
+        replica.reads += 1
+        return connection
+    router.primary_reads += 1
+    return await connect(timeout)
+
+
+def replica_status() -> dict[str, Any]:
+    """Replica routing state for the dependency health endpoint."""
+    return replica_router().snapshot()
+
+
 # Table and column identifiers are quoted: Prisma maps models to PascalCase
 # tables and fields to camelCase columns, neither of which survives Postgres
 # identifier folding unquoted.
@@ -111,6 +296,84 @@ SELECT o.id            AS order_id,
 """
 
 
+# The same customer in one statement: each order and each order's items are
+# aggregated by Postgres (`json_agg` over LATERAL subqueries) into an `orders`
+# json column, already in the nested shape `_build_orders` produces. One round
+# trip instead of two, and no per-item folding in Python.
+_CUSTOMER_JSON_QUERY = """
+SELECT u.id, u.email, u.name, u.avatar, u."addressLine1", u."addressLine2",
+       u.city, u.state, u."zipCode", u.country, u."phoneNumber",
+       u."firstName", u."lastName", u.age, u.membership, u."createdAt",
+       u."updatedAt",
+       COALESCE(orders.orders, '[]'::json) AS orders
+  FROM "User" u
+  LEFT JOIN LATERAL (
+        SELECT json_agg(
+                 json_build_object(
+                   'id', o.id,
+                   'userId', o."userId",
+                   'date', o.date,
+                   'total', o.total,
+                   'createdAt', o."createdAt",
+                   'updatedAt', o."updatedAt",
+                   'items', items.items
+                 )
+                 ORDER BY o.date DESC
+               ) AS orders
+          FROM "Order" o
+         CROSS JOIN LATERAL (
+               SELECT COALESCE(
+                        json_agg(
+                          json_build_object(
+                            'id', i.id,
+                            'orderId', i."orderId",
+                            'productId', i."productId",
+                            'quantity', i.quantity,
+                            'price', i.price,
+                            'product', json_build_object(
+                              'id', p.id,
+                              'name', p.name,
+                              'description', p.description,
+                              'price', p.price,
+                              'image', p.image,
+                              'categoryId', p."categoryId",
+                              'brandId', p."brandId",
+                              'slug', p.slug,
+                              'createdAt', p."createdAt",
+                              'updatedAt', p."updatedAt"
+                            )
+                          )
+                          ORDER BY i.id
+                        ),
+                        '[]'::json
+                      ) AS items
+                 FROM "OrderItem" i
+                 LEFT JOIN "Product" p ON p.id = i."productId"
+                WHERE i."orderId" = o.id
+               ) items
+         WHERE o."userId" = u.id
+       ) orders ON true
+ WHERE u.id = $1
+"""
+
+# The customer and their precomputed purchase summary: two primary-key
+# lookups, one row. "CustomerSummary" is kept current by triggers on "Order"
+# and "OrderItem" (see the customer_summary migration); a customer without
+# orders has no summary row, so its columns are null.
+_CUSTOMER_SUMMARY_QUERY = """
+SELECT u.id, u."firstName", u."lastName", u.membership,
+       s."orderCount", s."totalSpent", s."lastOrderAt", s."recentPurchases",
+       s."favoriteCategories", s."favoriteBrands"
+  FROM "User" u
+  LEFT JOIN "CustomerSummary" s ON s."userId" = u.id
+ WHERE u.id = $1
+"""
+
+# JSON has no timestamp type; these keys come back as ISO 8601 strings and are
+# turned back into the datetimes the two-query path returns.
+_TIMESTAMP_KEYS = ("date", "createdAt", "updatedAt")
+
+
 def _build_orders(rows: list[asyncpg.Record]) -> list[dict[str, Any]]:
     """Fold the joined rows back into the nested shape the client returned."""
     orders: dict[str, dict[str, Any]] = {}
@@ -159,11 +422,62 @@ def _build_orders(rows: list[asyncpg.Record]) -> list[dict[str, Any]]:
     return list(orders.values())
 
 
-async def fetch_customer(customer_id: str) -> dict[str, Any] | None:
+def _parse_timestamps(record: dict[str, Any]) -> None:
+    for key in _TIMESTAMP_KEYS:
+        value = record.get(key)
+        if isinstance(value, str):
+            record[key] = datetime.fromisoformat(value)
+
+
+def _decode_orders(orders: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Restore datetimes in the `orders` column of `_CUSTOMER_JSON_QUERY`."""
+    for order in orders:
+        _parse_timestamps(order)
+        for item in order["items"]:
+            _parse_timestamps(item["product"])
+    return orders
+
+
+async def _use_orjson(connection: asyncpg.Connection) -> None:
+    """Decode `json` and `jsonb` columns with orjson rather than returning text.
+
+    A codec on a built-in `pg_catalog` type needs no type introspection, so
+    registering it costs no round trip.
+    """
+    for typename in ("json", "jsonb"):
+        await connection.set_type_codec(
+            typename,
+            schema="pg_catalog",
+            encoder=lambda value: orjson.dumps(value).decode(),
+            decoder=orjson.loads,
+        )
+
+
+def customer_query_mode() -> str:
+    """`json` (default): one aggregated statement; `split`: user, then order rows."""
+    mode = os.getenv("CUSTOMER_QUERY_MODE", "json")
+    if mode not in {"json", "split"}:
+        raise ValueError(f"Unknown CUSTOMER_QUERY_MODE {mode!r}; expected 'json' or 'split'")
+    return mode
+
+
+async def fetch_customer(
+    customer_id: str, timeout: float | None = None
+) -> dict[str, Any] | None:
     """Return a customer with nested orders/items/products, or None."""
+    mode = customer_query_mode()
     connection = None
     try:
-        connection = await connect()
+        connection = await connect_for_read(timeout)
+        if mode == "json":
+            await _use_orjson(connection)
+            row = await connection.fetchrow(_CUSTOMER_JSON_QUERY, customer_id)
+            if row is None:
+                return None
+            customer = dict(row)
+            customer["orders"] = _decode_orders(customer["orders"])
+            return customer
+
         user_row = await connection.fetchrow(_USER_QUERY, customer_id)
         if user_row is None:
             return None
@@ -176,3 +490,28 @@ async def fetch_customer(customer_id: str) -> dict[str, Any] | None:
     finally:
         if connection is not None:
             await connection.close()
+
+
+async def fetch_customer_summary(
+    customer_id: str, timeout: float | None = None
+) -> dict[str, Any] | None:
+    """Return a customer's name, membership and purchase summary, or None.
+
+    What the chat prompt needs of a customer, without reading their order
+    history: see `_CUSTOMER_SUMMARY_QUERY`.
+    """
+    connection = None
+    try:
+        connection = await connect_for_read(timeout)
+        await _use_orjson(connection)
+        row = await connection.fetchrow(_CUSTOMER_SUMMARY_QUERY, customer_id)
+        if row is None:
+            return None
+        customer = dict(row)
+        for key in ("recentPurchases", "favoriteCategories", "favoriteBrands"):
+            customer[key] = customer[key] or []
+        customer["orderCount"] = customer["orderCount"] or 0
+        return customer
+    finally:
+        if connection is not None:
+            await connection.close()
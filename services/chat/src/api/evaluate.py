@@ -4,7 +4,8 @@ import json
 
 import jsonlines
 import pandas as pd
-from contoso_chat.chat_request import get_response
+from contoso_chat.chat_request import get_responses
+from contoso_chat.ollama import close_ollama_clients
 from evaluators.custom_evals.coherence import coherence_evaluation
 from evaluators.custom_evals.fluency import fluency_evaluation
 from evaluators.custom_evals.groundedness import groundedness_evaluation
@@ -26,34 +27,49 @@ def load_data():
 
 # %%
 async def create_response_data_async(df):
-    results = []
-
-    for _, row in df.iterrows():
-        customer_id = row["customerId"]
-        question = row["question"]
-
-        # Run contoso-chat/chat_request flow to get response.
-        response = await get_response(customer_id=customer_id, question=question, chat_history=[])
+    questions = [(row["customerId"], row["question"]) for _, row in df.iterrows()]
+    results = [None] * len(questions)
+
+    # Run contoso-chat/chat_request flow for the whole dataset as one batch,
+    # sharing customer lookups and searches across questions.
+    async for index, response in get_responses(questions, traffic_class="batch"):
+        if isinstance(response, BaseException):
+            # Keep the rest of the run; the failure is reported, not scored.
+            print(f"Question {index} failed: {type(response).__name__}: {response}")
+            results[index] = {"question": questions[index][1], "error": f"{type(response).__name__}: {response}"}
+            continue
         print(response)
 
-        # Add results to list.
-        result = {
-            "question": question,
+        # Add results to list, in dataset order.
+        results[index] = {
+            "question": questions[index][1],
             "context": response["context"],
             "answer": response["answer"],
         }
-        results.append(result)
 
-    # Save results to a JSONL file.
+    failed = [result for result in results if "error" in result]
+    if failed:
+        print(f"{len(failed)} of {len(results)} questions failed and are left out of the evaluation.")
+
+    # Save the answered results to a JSONL file.
     with open("result.jsonl", "w") as file:
         for result in results:
-            file.write(json.dumps(result) + "\n")
+            if "error" not in result:
+                file.write(json.dumps(result) + "\n")
     return results
 
 
+async def _create_response_data_and_close(df):
+    try:
+        return await create_response_data_async(df)
+    finally:
+        # Before asyncio.run closes the loop the Ollama pool belongs to.
+        await close_ollama_clients()
+
+
 @trace
 def create_response_data(df):
-    return asyncio.run(create_response_data_async(df))
+    return asyncio.run(_create_response_data_and_close(df))
 
 # %%
 @trace
@@ -28,6 +28,17 @@ def _fetch_ollama_models(ollama_base_url: str) -> list[str]:
     return sorted(models)
 
 
+def _fetch_loaded_models(ollama_base_url: str) -> list[str]:
+    ps_url = f"{ollama_base_url.rstrip('/')}/api/ps"
+    with urllib.request.urlopen(ps_url, timeout=8) as response:
+        payload = json.loads(response.read().decode("utf-8"))
+    return sorted(
+        entry["name"]
+        for entry in payload.get("models", [])
+        if isinstance(entry, dict) and isinstance(entry.get("name"), str)
+    )
+
+
 def evaluate_local_provider_health() -> dict[str, Any]:
     provider = os.getenv("LLM_PROVIDER", "gcp")
     local_model = os.getenv("LOCAL_MODEL_NAME", "gemma3:12b")
@@ -43,6 +54,7 @@ def evaluate_local_provider_health() -> dict[str, Any]:
         "missing_python_packages": [],
         "ollama_reachable": None,
         "model_available": None,
+        "model_loaded": None,
         "available_models": [],
         "warnings": [],
         "errors": [],
@@ -51,7 +63,7 @@ def evaluate_local_provider_health() -> dict[str, Any]:
     if provider != "local":
         return health
 
-    missing = _missing_python_packages(["chromadb", "litellm"])
+    missing = _missing_python_packages(["chromadb", "httpx2"])
     health["missing_python_packages"] = missing
     if missing:
         health["errors"].append(
@@ -99,6 +111,18 @@ def evaluate_local_provider_health() -> dict[str, Any]:
             )
         else:
             health["errors"].append("Ollama returned no installed models.")
+    else:
+        # Installed is enough to serve; loaded decides whether the next chat
+        # also pays for the model load.
+        try:
+            health["model_loaded"] = local_model in _fetch_loaded_models(health["effective_ollama_base_url"])
+        except (urllib.error.URLError, TimeoutError, ValueError, json.JSONDecodeError):
+            pass
+        if health["model_loaded"] is False:
+            health["warnings"].append(
+                f"LOCAL_MODEL_NAME '{local_model}' is installed but not loaded; "
+                "the next chat request will wait for Ollama to load it."
+            )
 
     health["ready"] = len(health["errors"]) == 0
     return health
@@ -129,6 +153,7 @@ def main() -> int:
             print(f"local_model_name={health['local_model_name']}")
             print(f"ollama_reachable={health['ollama_reachable']}")
             print(f"model_available={health['model_available']}")
+            print(f"model_loaded={health['model_loaded']}")
             if health["available_models"]:
                 print("available_models=" + ",".join(health["available_models"]))
             if health["warnings"]:
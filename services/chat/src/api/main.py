@@ -1,18 +1,36 @@
+import asyncio
 import logging
 import os
 import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, Optional
 
+from contoso_chat.admission import OverloadedError, admission_snapshot
+from contoso_chat.deadline import Deadline, DeadlineExceededError
+from contoso_chat.model_tiers import TieringConfig, tiers_snapshot
+from contoso_chat.ollama import close_ollama_clients, preload_local_model
+from contoso_chat.provider_router import providers_snapshot
+from contoso_chat.responses import (
+    ContextMode,
+    OrjsonResponse,
+    context_mode,
+    gzip_min_bytes,
+    ndjson_line,
+    response_body,
+)
+from contoso_chat.warmup import configured_providers, warm_up
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from local_provider_health import evaluate_local_provider_health
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 # Import our real chat logic (simplified)
 try:
-    from contoso_chat.chat_request import get_response
+    from contoso_chat.chat_request import get_response, get_responses
     REAL_CHAT_AVAILABLE = True
 except ImportError:
     REAL_CHAT_AVAILABLE = False
@@ -28,7 +46,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Contoso Chat", version="1.0.0")
+startup_report: dict[str, Any] = {"warmup": "pending"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the configured provider's SDKs and search backend before taking
+    # traffic, so the first shopper does not pay for them.
+    if REAL_CHAT_AVAILABLE and os.getenv("CHAT_WARMUP", "1") != "0":
+        startup_report.update(warmup=await asyncio.to_thread(warm_up))
+        # On the app's event loop, so the preload opens the pooled
+        # connections requests then reuse. Every model a request may be
+        # routed to, so the first fast-tier answer does not load one.
+        if "local" in configured_providers():
+            models = dict.fromkeys(tier.local_model for tier in TieringConfig.from_env().tiers)
+            startup_report.update(ollama=[await preload_local_model(model) for model in models])
+    else:
+        startup_report.update(warmup="skipped")
+    yield
+    await close_ollama_clients()
+
+
+app = FastAPI(title="Contoso Chat", version="1.0.0", lifespan=lifespan)
 
 # Middleware for request logging
 @app.middleware("http")
@@ -81,6 +120,12 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],
 )
 
+# Compress large bodies (chat responses with full context) for clients that
+# accept gzip; small ones are not worth the CPU. Streams opt out (see
+# `STREAM_HEADERS`).
+if gzip_min_bytes() > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=gzip_min_bytes())
+
 
 # Request model
 class ChatRequest(BaseModel):
@@ -89,6 +134,30 @@ class ChatRequest(BaseModel):
     question: str
     customer_id: Optional[str] = None
     chat_history: Optional[Any] = "[]"
+    # How strongly to favour distinct products over near-duplicates (0-1);
+    # defaults to RETRIEVAL_DIVERSITY.
+    diversity: Optional[float] = Field(default=None, ge=0, le=1)
+    # How much retrieval context to return: "full", "ids" (identifying fields
+    # only) or "none"; defaults to CHAT_RESPONSE_CONTEXT.
+    include_context: Optional[ContextMode] = None
+
+class BatchQuestion(BaseModel):
+    question: str
+    customer_id: Optional[str] = None
+
+
+class BatchChatRequest(BaseModel):
+    questions: list[BatchQuestion] = Field(min_length=1)
+    diversity: Optional[float] = Field(default=None, ge=0, le=1)
+    include_context: Optional[ContextMode] = None
+
+
+DEFAULT_BATCH_MAX_QUESTIONS = 50
+
+
+def batch_max_questions() -> int:
+    return int(os.getenv("CHAT_BATCH_MAX_QUESTIONS") or DEFAULT_BATCH_MAX_QUESTIONS)
+
 
 @app.get("/")
 async def root():
@@ -115,6 +184,15 @@ async def check_database_connection() -> tuple[bool, str | None]:
         return False, str(exc)
 
 
+def database_replica_status() -> dict[str, Any] | None:
+    try:
+        from db import replica_status
+
+        return replica_status()
+    except Exception:  # noqa: BLE001
+        return None
+
+
 @app.get("/health/dependencies")
 async def health_dependencies():
     logger.info("Dependency health endpoint accessed")
@@ -128,18 +206,55 @@ async def health_dependencies():
         "database": {
             "connected": db_connected,
             "error": db_error,
+            # Reads fall back to the primary, so replicas do not affect status.
+            "read_routing": database_replica_status(),
         },
         "local_provider": local_provider,
     }
 
+@app.get("/health/startup")
+async def health_startup():
+    """What warm-up imported and built, with the time and RSS each step cost."""
+    return startup_report
+
+@app.get("/health/admission")
+async def health_admission():
+    """Per-model LLM limiter state: limit, in-flight, queue depth, wait times."""
+    return {"limiters": admission_snapshot()}
+
+@app.get("/health/providers")
+async def health_providers():
+    """Per-provider outcomes, latency percentiles and circuit-breaker state, and per model tier latency."""
+    return {"providers": providers_snapshot(), "tiers": tiers_snapshot()}
+
+# nginx's "client closed request"; nobody reads it, but the access log does.
+CLIENT_CLOSED_REQUEST = 499
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+async def cancel_on_disconnect(http_request: Request, work: asyncio.Future) -> bool:
+    """Cancel `work` if the client goes away first; return whether it did."""
+    while not work.done():
+        if await http_request.is_disconnected():
+            work.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    return False
+
+
 @app.post("/api/create_response")
-async def create_response(request: ChatRequest):
+async def create_response(request: ChatRequest, http_request: Request):
+    # Bulk callers (evals, internal tools) mark themselves `batch` so shoppers
+    # are served first when the model is contended.
+    traffic_class = http_request.headers.get("X-Traffic-Class", "interactive")
+    deadline = Deadline.from_env(http_request.headers.get("X-Request-Budget-Ms"))
     logger.info(
         "Chat request received",
         extra={
             "customer_id": request.customer_id,
             "question_length": len(request.question),
             "has_chat_history": len(str(request.chat_history or "")) > 2,
+            "traffic_class": traffic_class,
             "real_chat_available": REAL_CHAT_AVAILABLE
         }
     )
@@ -148,7 +263,32 @@ async def create_response(request: ChatRequest):
         if REAL_CHAT_AVAILABLE:
             # Use real chat logic
             logger.info("Processing request with real chat logic")
-            result = await get_response(request.customer_id, request.question, request.chat_history)
+            work = asyncio.ensure_future(
+                get_response(
+                    request.customer_id,
+                    request.question,
+                    request.chat_history,
+                    traffic_class=traffic_class,
+                    deadline=deadline,
+                    diversity=request.diversity,
+                )
+            )
+            watcher = asyncio.ensure_future(cancel_on_disconnect(http_request, work))
+            try:
+                result = await work
+            except asyncio.CancelledError:
+                if not (watcher.done() and watcher.result()):
+                    raise
+                logger.info(
+                    "Chat request cancelled: client disconnected",
+                    extra={
+                        "customer_id": request.customer_id,
+                        "elapsed": deadline.budget - deadline.remaining(),
+                    },
+                )
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+            finally:
+                watcher.cancel()
 
             logger.info(
                 "Chat response generated",
@@ -159,7 +299,9 @@ async def create_response(request: ChatRequest):
                     "success": True
                 }
             )
-            return result
+            body = response_body(result, context_mode(request.include_context))
+            # Returned as a response, so FastAPI does not re-encode it first.
+            return OrjsonResponse(body)
         else:
             # Mock response for testing
             logger.warning("Using mock response - real chat logic not available")
@@ -169,6 +311,46 @@ async def create_response(request: ChatRequest):
                 "chat_history": request.chat_history,
                 "mock": True
             }
+    except OverloadedError as e:
+        retry_after = int(e.retry_after)
+        logger.warning(
+            "Chat request rejected: LLM capacity exhausted",
+            extra={
+                "customer_id": request.customer_id,
+                "error": str(e),
+                "retry_after": retry_after,
+            },
+        )
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+            content={
+                "answer": "We're helping a lot of shoppers right now. Please try again in a moment.",
+                "customer_id": request.customer_id,
+                "chat_history": request.chat_history,
+                "error": str(e),
+                "retry_after": retry_after,
+            },
+        )
+    except DeadlineExceededError as e:
+        logger.warning(
+            "Chat request exceeded its time budget",
+            extra={
+                "customer_id": request.customer_id,
+                "stage": e.stage,
+                "budget": deadline.budget,
+            },
+        )
+        return JSONResponse(
+            status_code=504,
+            content={
+                "answer": f"I'm having trouble processing your request about '{request.question}' right now. Please try again later.",
+                "customer_id": request.customer_id,
+                "chat_history": request.chat_history,
+                "error": str(e),
+                "fallback": True,
+            },
+        )
     except Exception as e:
         # Log the error for debugging
         logger.error(
@@ -189,3 +371,111 @@ async def create_response(request: ChatRequest):
             "error": str(e),
             "fallback": True
         }
+
+
+def batch_error_line(index: int, question: str, error: BaseException) -> dict[str, Any]:
+    """A failed question's line, with the status a single request would have had."""
+    line: dict[str, Any] = {"index": index, "question": question, "error": str(error)}
+    if isinstance(error, OverloadedError):
+        line.update(status=429, retry_after=int(error.retry_after))
+    elif isinstance(error, DeadlineExceededError):
+        line.update(status=504)
+    else:
+        line.update(status=500)
+    return line
+
+
+# Marks a streamed body as already encoded, so `GZipMiddleware` passes each
+# line through as it is sent rather than buffering it in the compressor.
+STREAM_HEADERS = {"Content-Encoding": "identity"}
+
+
+@app.post("/api/create_response/batch")
+async def create_response_batch(request: BatchChatRequest, http_request: Request):
+    """Answer many questions in one call, streamed back as NDJSON as each completes.
+
+    Every line carries the `index` of its question in the request. Failed
+    questions get a line with `error` and `status` instead of an answer.
+    """
+    # Bulk traffic by definition, unless the caller says otherwise.
+    traffic_class = http_request.headers.get("X-Traffic-Class", "batch")
+    deadline = Deadline.from_env(http_request.headers.get("X-Request-Budget-Ms"))
+    questions = [(item.customer_id, item.question) for item in request.questions]
+    logger.info(
+        "Batch chat request received",
+        extra={
+            "questions": len(questions),
+            "customers": len({customer_id for customer_id, _ in questions if customer_id}),
+            "traffic_class": traffic_class,
+            "real_chat_available": REAL_CHAT_AVAILABLE,
+        },
+    )
+    if len(questions) > batch_max_questions():
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"A batch takes at most {batch_max_questions()} questions; got {len(questions)}"},
+        )
+
+    if not REAL_CHAT_AVAILABLE:
+        async def mock_lines():
+            for index, (customer_id, question) in enumerate(questions):
+                yield ndjson_line({
+                    "index": index,
+                    "question": question,
+                    "answer": f"Mock response: You asked about '{question}'.",
+                    "customer_id": customer_id,
+                    "mock": True,
+                })
+
+        return StreamingResponse(mock_lines(), media_type="application/x-ndjson", headers=STREAM_HEADERS)
+
+    mode = context_mode(request.include_context)
+    responses = get_responses(
+        questions, traffic_class=traffic_class, deadline=deadline, diversity=request.diversity
+    )
+    try:
+        # Reject the whole batch up front when the model has no room for it.
+        first = await anext(responses)
+    except OverloadedError as e:
+        retry_after = int(e.retry_after)
+        logger.warning(
+            "Batch chat request rejected: LLM capacity exhausted",
+            extra={"questions": len(questions), "retry_after": retry_after},
+        )
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+            content={"error": str(e), "retry_after": retry_after},
+        )
+    except Exception as e:
+        logger.error(
+            "Error processing batch chat request",
+            extra={"questions": len(questions), "error": str(e), "error_type": type(e).__name__},
+            exc_info=True,
+        )
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    async def lines():
+        answered = failed = 0
+        try:
+            index, result = first
+            while True:
+                if isinstance(result, BaseException):
+                    failed += 1
+                    yield ndjson_line(batch_error_line(index, questions[index][1], result))
+                else:
+                    answered += 1
+                    yield ndjson_line({"index": index, **response_body(result, mode)})
+                try:
+                    index, result = await anext(responses)
+                except StopAsyncIteration:
+                    break
+        finally:
+            # Cancels whatever is still generating if the client went away.
+            await responses.aclose()
+            logger.info(
+                "Batch chat response streamed",
+                extra={"questions": len(questions), "answered": answered, "failed": failed},
+            )
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=STREAM_HEADERS)
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+from contoso_chat import admission
+from contoso_chat.admission import (
+    ConcurrencyLimiter,
+    LimiterConfig,
+    OverloadedError,
+    admission_snapshot,
+    get_limiter,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    admission.reset_limiters()
+    yield
+    admission.reset_limiters()
+
+
+async def _hold(limiter, release: asyncio.Event, started: asyncio.Event | None = None):
+    async with limiter.acquire():
+        if started is not None:
+            started.set()
+        await release.wait()
+
+
+@pytest.mark.anyio
+async def test_admits_up_to_the_limit_and_queues_the_rest():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=2, max_queue=4))
+    release = asyncio.Event()
+
+    tasks = [asyncio.create_task(_hold(limiter, release)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    assert limiter.in_flight == 2
+    assert limiter.queue_depth == 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert limiter.in_flight == 0
+    assert limiter.queue_depth == 0
+    assert limiter.admitted == 3
+
+
+@pytest.mark.anyio
+async def test_rejects_immediately_when_the_queue_is_full():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1, max_queue=1))
+    release = asyncio.Event()
+    tasks = [asyncio.create_task(_hold(limiter, release)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(OverloadedError) as excinfo:
+        async with limiter.acquire():
+            pass
+
+    assert excinfo.value.retry_after >= 1
+    assert limiter.rejected == 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.anyio
+async def test_check_rejects_before_any_work_when_saturated():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1, max_queue=0))
+    release = asyncio.Event()
+    task = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(OverloadedError):
+        limiter.check()
+
+    release.set()
+    await task
+    limiter.check()
+
+
+@pytest.mark.anyio
+async def test_queue_timeout_raises_overloaded_and_frees_the_queue_slot():
+    limiter = ConcurrencyLimiter(
+        "test", LimiterConfig(max_concurrency=1, max_queue=2, queue_timeout=0.01)
+    )
+    release = asyncio.Event()
+    task = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(OverloadedError, match="Timed out"):
+        async with limiter.acquire():
+            pass
+
+    assert limiter.timed_out == 1
+    assert limiter.queue_depth == 0
+
+    release.set()
+    await task
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_does_not_leak_a_slot():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1, max_queue=2))
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(limiter, release))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold(limiter, asyncio.Event()))
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    release.set()
+    await holder
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_a_failed_call_still_releases_its_slot():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1))
+
+    with pytest.raises(RuntimeError):
+        async with limiter.acquire():
+            raise RuntimeError("provider error")
+
+    assert limiter.in_flight == 0
+    assert limiter.failed == 1
+
+
+@pytest.mark.anyio
+async def test_adaptive_limit_backs_off_on_failures():
+    limiter = ConcurrencyLimiter(
+        "test", LimiterConfig(max_concurrency=10, adaptive=True, backoff=0.5)
+    )
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            async with limiter.acquire():
+                raise RuntimeError("quota exceeded")
+
+    assert limiter.snapshot()["limit"] == 1
+
+
+@pytest.mark.anyio
+async def test_adaptive_limit_grows_when_saturated_and_fast():
+    limiter = ConcurrencyLimiter(
+        "test", LimiterConfig(max_concurrency=1, adaptive=True, max_adaptive_concurrency=4)
+    )
+
+    for _ in range(5):
+        async with limiter.acquire():
+            pass
+
+    assert limiter.limit > 1
+
+
+def test_config_reads_provider_overrides(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_QUEUE", "7")
+    monkeypatch.setenv("LLM_LOCAL_MAX_CONCURRENCY", "3")
+
+    local = LimiterConfig.from_env("local")
+    gcp = LimiterConfig.from_env("gcp")
+
+    assert (local.max_concurrency, local.max_queue) == (3, 7)
+    assert (gcp.max_concurrency, gcp.max_queue) == (8, 7)
+
+
+def test_registry_keys_limiters_by_provider_and_model():
+    assert get_limiter("gcp", "gemini-2.5-flash") is get_limiter("gcp", "gemini-2.5-flash")
+    assert get_limiter("gcp", "gemini-2.5-pro") is not get_limiter("gcp", "gemini-2.5-flash")
+
+    snapshot = admission_snapshot()
+    assert set(snapshot) == {"gcp/gemini-2.5-flash", "gcp/gemini-2.5-pro"}
+    assert snapshot["gcp/gemini-2.5-flash"]["queue_depth"] == 0
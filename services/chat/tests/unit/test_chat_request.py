@@ -1,14 +1,23 @@
+import asyncio
 import json
 import sys
+import time
 from types import SimpleNamespace
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
+from contoso_chat import model_tiers, provider_router
+from contoso_chat.admission import OverloadedError
 from contoso_chat.chat_request import (
+    SYSTEM_INSTRUCTION,
     generate_llm_response,
     get_customer_from_postgres,
     get_response,
+    get_responses,
+    user_message,
 )
+from contoso_chat.deadline import Deadline, DeadlineExceededError
+from contoso_chat.ollama import reset_ollama_clients
 
 
 @pytest.fixture
@@ -18,7 +27,7 @@ def anyio_backend():
 
 @pytest.mark.anyio
 async def test_get_customer_from_postgres_returns_none_for_empty_id():
-    with patch("db.fetch_customer") as mock_fetch:
+    with patch("db.fetch_customer_summary") as mock_fetch:
         result = await get_customer_from_postgres("")
 
     assert result is None
@@ -27,16 +36,16 @@ async def test_get_customer_from_postgres_returns_none_for_empty_id():
 
 @pytest.mark.anyio
 async def test_get_customer_from_postgres_returns_customer():
-    with patch("db.fetch_customer", AsyncMock(return_value={"firstName": "Taylor"})) as mock_fetch:
+    with patch("db.fetch_customer_summary", AsyncMock(return_value={"firstName": "Taylor"})) as mock_fetch:
         result = await get_customer_from_postgres("cust-1")
 
     assert result == {"firstName": "Taylor"}
-    mock_fetch.assert_awaited_once_with("cust-1")
+    mock_fetch.assert_awaited_once_with("cust-1", timeout=None)
 
 
 @pytest.mark.anyio
 async def test_get_customer_from_postgres_returns_none_when_missing():
-    with patch("db.fetch_customer", AsyncMock(return_value=None)):
+    with patch("db.fetch_customer_summary", AsyncMock(return_value=None)):
         result = await get_customer_from_postgres("cust-1")
 
     assert result is None
@@ -44,7 +53,7 @@ async def test_get_customer_from_postgres_returns_none_when_missing():
 
 @pytest.mark.anyio
 async def test_get_customer_from_postgres_returns_none_on_exception():
-    with patch("db.fetch_customer", AsyncMock(side_effect=RuntimeError("db down"))):
+    with patch("db.fetch_customer_summary", AsyncMock(side_effect=RuntimeError("db down"))):
         result = await get_customer_from_postgres("cust-1")
 
     assert result is None
@@ -52,20 +61,10 @@ async def test_get_customer_from_postgres_returns_none_on_exception():
 
 @pytest.mark.anyio
 async def test_generate_llm_response_local_provider():
-    mock_completion = MagicMock(
-        return_value=SimpleNamespace(
-            choices=[SimpleNamespace(message=SimpleNamespace(content="local answer"))]
-        )
-    )
+    client = MagicMock()
+    client.chat = AsyncMock(return_value={"message": {"content": "local answer"}, "prompt_eval_count": 42})
 
-    with patch.dict(
-        sys.modules,
-        {"litellm": SimpleNamespace(completion=mock_completion)},
-    ), patch.dict(
-        "os.environ",
-        {"OLLAMA_BASE_URL": "http://ollama:11434", "LOCAL_MODEL_NAME": "mistral"},
-        clear=False,
-    ):
+    with patch("contoso_chat.chat_request.get_ollama_client", return_value=client):
         result = await generate_llm_response(
             prompt="Best tent?",
             context='[{"sku":"abc123"}]',
@@ -77,16 +76,18 @@ async def test_generate_llm_response_local_provider():
         )
 
     assert result == "local answer"
-    mock_completion.assert_called_once()
-    kwargs = mock_completion.call_args.kwargs
-    assert kwargs["model"] == "ollama/mistral"
-    assert kwargs["api_base"] == "http://ollama:11434"
-    assert kwargs["temperature"] == 0.7
+    client.chat.assert_awaited_once()
+    messages = client.chat.call_args.args[0]
+    assert messages[0] == {"role": "system", "content": SYSTEM_INSTRUCTION}
+    assert "abc123" in messages[1]["content"]
+    assert client.chat.call_args.kwargs == {"model": "unused-model", "temperature": 0.7}
+    provider_router.reset_provider_health()
 
 
 @pytest.mark.anyio
 async def test_generate_llm_response_local_provider_requires_optional_dependencies():
-    with patch.dict(sys.modules, {"litellm": None}):
+    reset_ollama_clients()
+    with patch.dict(sys.modules, {"httpx2": None}):
         with pytest.raises(
             RuntimeError,
             match="Local LLM provider dependencies are not installed",
@@ -106,7 +107,9 @@ async def test_generate_llm_response_local_provider_requires_optional_dependenci
 async def test_generate_llm_response_gcp_provider():
     mock_init = MagicMock()
     mock_model_instance = MagicMock()
-    mock_model_instance.generate_content.return_value = SimpleNamespace(text="gcp answer")
+    mock_model_instance.generate_content_async = AsyncMock(
+        return_value=SimpleNamespace(text="gcp answer")
+    )
     mock_model_class = MagicMock(return_value=mock_model_instance)
 
     with patch.dict(
@@ -130,9 +133,9 @@ async def test_generate_llm_response_gcp_provider():
 
     assert result == "gcp answer"
     mock_init.assert_called_once_with(project="project-1", location="us-central1")
-    mock_model_class.assert_called_once_with("gemini-2.5-flash")
-    mock_model_instance.generate_content.assert_called_once()
-    sent_prompt = mock_model_instance.generate_content.call_args.args[0]
+    mock_model_class.assert_called_once_with("gemini-2.5-flash", system_instruction=SYSTEM_INSTRUCTION)
+    mock_model_instance.generate_content_async.assert_awaited_once()
+    sent_prompt = mock_model_instance.generate_content_async.call_args.args[0]
     assert isinstance(sent_prompt, str)
     assert "Best tent?" in sent_prompt
     assert "abc123" in sent_prompt
@@ -161,6 +164,8 @@ async def test_get_response_uses_customer_name_and_env_settings():
             "REGION": "us-central1",
             "LLM_PROVIDER": "local",
             "GEMINI_MODEL_NAME": "custom-model",
+            "LOCAL_MODEL_NAME": "custom-local-model",
+            "RETRIEVAL_RERANK": "0",
         },
         clear=True,
     ):
@@ -171,7 +176,7 @@ async def test_get_response_uses_customer_name_and_env_settings():
         "answer": "answer text",
         "context": product_context,
     }
-    mock_get_customer.assert_awaited_once_with("cust-1")
+    mock_get_customer.assert_awaited_once_with("cust-1", timeout=ANY)
     mock_get_search_service.assert_called_once_with()
     mock_search_service.search.assert_called_once_with("Best tent?", limit=5)
     mock_generate.assert_awaited_once_with(
@@ -181,10 +186,70 @@ async def test_get_response_uses_customer_name_and_env_settings():
         "local",
         "project-1",
         "us-central1",
-        "custom-model",
+        "custom-local-model",
+        profile="",
+        max_output_tokens=None,
     )
 
 
+@pytest.mark.anyio
+async def test_get_response_sends_the_shopper_profile():
+    customer = {
+        "firstName": "Taylor",
+        "membership": "Gold",
+        "recentPurchases": [{"name": "TrailMaster X4 Tent", "category": "Tents", "brand": "OutdoorLiving"}],
+        "favoriteCategories": ["Tents"],
+        "favoriteBrands": [],
+    }
+    mock_search_service = MagicMock()
+    mock_search_service.search.return_value = [{"sku": "abc123"}]
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres",
+        new=AsyncMock(return_value=customer),
+    ), patch(
+        "contoso_chat.chat_request.get_search_service",
+        return_value=mock_search_service,
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response",
+        new=AsyncMock(return_value="answer"),
+    ) as mock_generate, patch.dict("os.environ", {"RETRIEVAL_RERANK": "0"}, clear=True):
+        await get_response("cust-1", "Best tent?", "[]")
+
+    profile = mock_generate.call_args.kwargs["profile"]
+    assert "- Membership: Gold" in profile
+    assert "- Recent purchases: TrailMaster X4 Tent (Tents, OutdoorLiving)" in profile
+
+
+@pytest.mark.anyio
+async def test_generate_llm_response_puts_the_profile_before_the_catalog_context():
+    mock_model_instance = MagicMock()
+    mock_model_instance.generate_content_async = AsyncMock(return_value=SimpleNamespace(text="answer"))
+
+    with patch.dict(
+        sys.modules,
+        {
+            "vertexai": SimpleNamespace(init=MagicMock()),
+            "vertexai.generative_models": SimpleNamespace(
+                GenerativeModel=MagicMock(return_value=mock_model_instance),
+            ),
+        },
+    ):
+        await generate_llm_response(
+            prompt="Best tent?",
+            context="[]",
+            user_name="Taylor",
+            provider="gcp",
+            project_id="project-1",
+            location="us-central1",
+            model_name="gemini-2.5-flash",
+            profile="Shopper profile:\n- Membership: Gold",
+        )
+
+    sent_prompt = mock_model_instance.generate_content_async.call_args.args[0]
+    assert sent_prompt.index("- Membership: Gold") < sent_prompt.index("Catalog Context:")
+
+
 @pytest.mark.anyio
 async def test_get_response_defaults_to_guest_and_default_model():
     product_context = [{"sku": "abc123"}]
@@ -200,7 +265,7 @@ async def test_get_response_defaults_to_guest_and_default_model():
     ), patch(
         "contoso_chat.chat_request.generate_llm_response",
         new=AsyncMock(return_value="guest answer"),
-    ) as mock_generate, patch.dict("os.environ", {}, clear=True):
+    ) as mock_generate, patch.dict("os.environ", {"RETRIEVAL_RERANK": "0"}, clear=True):
         result = await get_response("cust-1", "Best tent?", "[]")
 
     assert result["answer"] == "guest answer"
@@ -212,4 +277,322 @@ async def test_get_response_defaults_to_guest_and_default_model():
         None,
         None,
         "gemini-2.5-flash",
+        profile="",
+        max_output_tokens=None,
     )
+
+
+@pytest.mark.anyio
+async def test_get_response_sends_simple_questions_to_the_fast_tier():
+    model_tiers.reset_tier_stats()
+    mock_search_service = MagicMock()
+    mock_search_service.search.return_value = [{"name": "TrailMaster X4 Tent", "score": 0.9}]
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres",
+        new=AsyncMock(return_value=None),
+    ), patch(
+        "contoso_chat.chat_request.get_search_service",
+        return_value=mock_search_service,
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response",
+        new=AsyncMock(return_value="yes"),
+    ) as mock_generate, patch.dict(
+        "os.environ", {"RETRIEVAL_RERANK": "0", "MODEL_TIERING": "1"}, clear=True
+    ):
+        await get_response("cust-1", "Is the TrailMaster X4 waterproof?", "[]")
+        await get_response("cust-1", "Which tent is best for winter?", "[]")
+
+    snapshot = model_tiers.tiers_snapshot()
+    model_tiers.reset_tier_stats()
+    provider_router.reset_provider_health()
+
+    fast, strong = mock_generate.await_args_list
+    assert fast.args[6] == "gemini-2.5-flash-lite"
+    assert fast.kwargs["max_output_tokens"] == 512
+    assert strong.args[6] == "gemini-2.5-flash"
+    assert strong.kwargs["max_output_tokens"] is None
+    assert snapshot["fast"]["requests"] == 1
+    assert snapshot["strong"]["requests"] == 1
+
+
+@pytest.mark.anyio
+async def test_get_response_is_only_refused_when_every_tier_is_saturated():
+    def strong_saturated(router, priority):
+        if router.primary.model == "gemini-2.5-flash":
+            raise OverloadedError("gcp/gemini-2.5-flash is at capacity", 2)
+
+    mock_search_service = MagicMock()
+    mock_search_service.search.return_value = [{"name": "TrailMaster X4 Tent", "score": 0.9}]
+
+    with patch(
+        "contoso_chat.chat_request.ProviderRouter.check", new=strong_saturated
+    ), patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock(return_value=None)
+    ), patch(
+        "contoso_chat.chat_request.get_search_service", return_value=mock_search_service
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=AsyncMock(return_value="yes")
+    ), patch.dict("os.environ", {"RETRIEVAL_RERANK": "0"}, clear=True):
+        with pytest.raises(OverloadedError):
+            await get_response("cust-1", "Is the TrailMaster X4 waterproof?", "[]")
+
+        with patch.dict("os.environ", {"MODEL_TIERING": "1"}):
+            result = await get_response("cust-1", "Is the TrailMaster X4 waterproof?", "[]")
+
+    model_tiers.reset_tier_stats()
+    provider_router.reset_provider_health()
+    assert result["answer"] == "yes"
+
+
+@pytest.mark.anyio
+async def test_get_response_reranks_a_wide_candidate_fetch():
+    candidates = [
+        {"name": "Alpine Explorer Tent", "content": "A roomy tent"},
+        {"name": "PowerBurner Stove", "content": "A camping stove"},
+    ]
+    mock_search_service = MagicMock()
+    mock_search_service.search.return_value = candidates
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres",
+        new=AsyncMock(return_value=None),
+    ), patch(
+        "contoso_chat.chat_request.get_search_service",
+        return_value=mock_search_service,
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response",
+        new=AsyncMock(return_value="answer"),
+    ), patch.dict("os.environ", {}, clear=True):
+        result = await get_response("cust-1", "Which stove?", "[]")
+
+    mock_search_service.search.assert_called_once_with("Which stove?", limit=30)
+    assert [item["name"] for item in result["context"]] == ["PowerBurner Stove"]
+    assert result["context"][0]["score"] > 0
+
+
+@pytest.mark.anyio
+async def test_get_response_rejects_before_lookup_when_llm_is_saturated():
+    with patch(
+        "contoso_chat.chat_request.ProviderRouter.check",
+        side_effect=OverloadedError("gcp/gemini-2.5-flash is at capacity", 2),
+    ), patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock()
+    ) as mock_get_customer, patch.dict("os.environ", {}, clear=True):
+        with pytest.raises(OverloadedError):
+            await get_response("cust-1", "Best tent?", "[]")
+
+    mock_get_customer.assert_not_awaited()
+
+
+@pytest.mark.anyio
+async def test_get_customer_from_postgres_gives_up_after_timeout():
+    async def slow_fetch(customer_id, timeout=None):
+        await asyncio.sleep(1)
+
+    with patch("db.fetch_customer_summary", new=slow_fetch):
+        result = await get_customer_from_postgres("cust-1", timeout=0.01)
+
+    assert result is None
+
+
+@pytest.mark.anyio
+async def test_get_response_stops_when_the_search_exhausts_the_budget():
+    slow_search = MagicMock()
+    slow_search.search.side_effect = lambda *args, **kwargs: time.sleep(0.2)
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres",
+        new=AsyncMock(return_value=None),
+    ), patch(
+        "contoso_chat.chat_request.get_search_service", return_value=slow_search
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=AsyncMock()
+    ) as mock_generate, patch.dict("os.environ", {}, clear=True):
+        with pytest.raises(DeadlineExceededError) as excinfo:
+            await get_response("cust-1", "Best tent?", "[]", deadline=Deadline(0.1))
+
+    assert excinfo.value.stage == "search"
+    mock_generate.assert_not_awaited()
+
+
+async def _collect(responses):
+    return [item async for item in responses]
+
+
+@pytest.mark.anyio
+async def test_get_responses_shares_lookups_and_searches_across_the_batch():
+    customers = {"cust-1": {"firstName": "Taylor"}, "cust-2": {"firstName": "Sam"}}
+    search_service = MagicMock()
+    search_service.search.side_effect = lambda query, limit: [{"name": f"{query} result"}]
+
+    async def generate(question, context, user_name, *args, **kwargs):
+        return f"{user_name}: {question}"
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres",
+        new=AsyncMock(side_effect=lambda customer_id, timeout=None: customers[customer_id]),
+    ) as mock_get_customer, patch(
+        "contoso_chat.chat_request.get_search_service", return_value=search_service
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=generate
+    ), patch.dict("os.environ", {"RETRIEVAL_RERANK": "0"}, clear=True):
+        results = dict(await _collect(get_responses([
+            ("cust-1", "Best tent?"),
+            ("cust-2", "Best tent?"),
+            ("cust-1", "Best stove?"),
+            (None, "Best stove?"),
+        ])))
+
+    assert [results[index]["answer"] for index in range(4)] == [
+        "Taylor: Best tent?",
+        "Sam: Best tent?",
+        "Taylor: Best stove?",
+        "Guest: Best stove?",
+    ]
+    assert results[3]["context"] == [{"name": "Best stove? result"}]
+    assert sorted(call.args[0] for call in mock_get_customer.await_args_list) == ["cust-1", "cust-2"]
+    search_service.prepare.assert_called_once_with(["Best tent?", "Best stove?"])
+    assert sorted(call.args[0] for call in search_service.search.call_args_list) == ["Best stove?", "Best tent?"]
+
+
+@pytest.mark.anyio
+async def test_get_responses_yields_answers_as_they_complete_and_failures_in_place():
+    search_service = MagicMock()
+    search_service.search.return_value = []
+
+    async def generate(question, *args, **kwargs):
+        if question == "slow":
+            await asyncio.sleep(0.05)
+        if question == "broken":
+            raise RuntimeError("model error")
+        return question
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock(return_value=None)
+    ), patch(
+        "contoso_chat.chat_request.get_search_service", return_value=search_service
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=generate
+    ), patch.dict("os.environ", {"RETRIEVAL_RERANK": "0"}, clear=True):
+        results = await _collect(get_responses([(None, "slow"), (None, "fast"), (None, "broken")]))
+
+    assert [index for index, _ in results][-1] == 0
+    assert results[0] == (1, {"question": "fast", "answer": "fast", "context": []})
+    failed = dict(results)[2]
+    assert isinstance(failed, Exception)
+    assert "model error" in str(failed)
+    # The failure counted against the provider; do not leave it to other tests.
+    provider_router.reset_provider_health()
+
+
+@pytest.mark.anyio
+async def test_get_responses_caps_the_batch_in_flight():
+    search_service = MagicMock()
+    search_service.search.return_value = []
+    running = 0
+    peak = 0
+
+    async def generate(*args, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return "ok"
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock(return_value=None)
+    ), patch(
+        "contoso_chat.chat_request.get_search_service", return_value=search_service
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=generate
+    ), patch.dict("os.environ", {"RETRIEVAL_RERANK": "0", "CHAT_BATCH_CONCURRENCY": "2"}, clear=True):
+        results = await _collect(get_responses([(None, f"q{n}") for n in range(6)]))
+
+    assert len(results) == 6
+    assert peak == 2
+
+
+@pytest.mark.anyio
+async def test_get_responses_gives_queued_answers_their_own_budget():
+    search_service = MagicMock()
+    search_service.search.return_value = []
+
+    async def generate(*args, **kwargs):
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    with patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock(return_value=None)
+    ), patch(
+        "contoso_chat.chat_request.get_search_service", return_value=search_service
+    ), patch(
+        "contoso_chat.chat_request.generate_llm_response", new=generate
+    ), patch.dict("os.environ", {"RETRIEVAL_RERANK": "0", "CHAT_BATCH_CONCURRENCY": "1"}, clear=True):
+        # Three answers one after another take 0.3s; each fits 0.25s.
+        results = await _collect(get_responses([(None, f"q{n}") for n in range(3)], deadline=Deadline(0.25)))
+
+    assert [result["answer"] for _, result in sorted(results, key=lambda pair: pair[0])] == ["ok"] * 3
+    provider_router.reset_provider_health()
+
+
+@pytest.mark.anyio
+async def test_get_responses_rejects_the_batch_when_llm_is_saturated():
+    with patch(
+        "contoso_chat.chat_request.ProviderRouter.check",
+        side_effect=OverloadedError("gcp/gemini-2.5-flash is at capacity", 2),
+    ), patch(
+        "contoso_chat.chat_request.get_customer_from_postgres", new=AsyncMock()
+    ) as mock_get_customer, patch.dict("os.environ", {}, clear=True):
+        with pytest.raises(OverloadedError):
+            await _collect(get_responses([("cust-1", "Best tent?")]))
+
+    mock_get_customer.assert_not_awaited()
+
+
+def test_prompt_prefix_is_shared_by_every_shopper():
+    taylor = user_message("Best tent?", "[]", "Taylor", "Shopper profile:\n- Membership: Gold")
+    guest = user_message("Best tent?", "[]", "Guest")
+
+    # Nothing per request in the system instruction, so providers can cache it.
+    assert "{" not in SYSTEM_INSTRUCTION
+    assert taylor.startswith("You are helping Taylor.\nShopper profile:")
+    assert guest.index("Catalog Context:") < guest.index("User Question: Best tent?")
+
+
+@pytest.mark.anyio
+async def test_generate_llm_response_records_cached_prompt_tokens():
+    usage = SimpleNamespace(prompt_token_count=1200, cached_content_token_count=1024)
+    mock_model_instance = MagicMock()
+    mock_model_instance.generate_content_async = AsyncMock(
+        return_value=SimpleNamespace(text="answer", usage_metadata=usage)
+    )
+    provider_router.reset_provider_health()
+
+    with patch.dict(
+        sys.modules,
+        {
+            "vertexai": SimpleNamespace(init=MagicMock()),
+            "vertexai.generative_models": SimpleNamespace(
+                GenerativeModel=MagicMock(return_value=mock_model_instance),
+            ),
+        },
+    ):
+        for _ in range(2):
+            await generate_llm_response(
+                prompt="Best tent?",
+                context="[]",
+                user_name="Taylor",
+                provider="gcp",
+                project_id="project-1",
+                location="us-central1",
+                model_name="gemini-2.5-flash",
+            )
+
+    assert provider_router.providers_snapshot()["gcp"]["prompt_tokens"] == {
+        "total": 2400,
+        "cached": 2048,
+        "cached_ratio": 0.853,
+    }
+    provider_router.reset_provider_health()
@@ -0,0 +1,94 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import db
+
+SCRIPT_PATH = Path(__file__).resolve().parents[2] / "scripts" / "check_query_plans.py"
+MIGRATION_PATH = (
+    Path(__file__).resolve().parents[4]
+    / "apps" / "web" / "prisma" / "migrations" / "20261019130000_customer_summary" / "migration.sql"
+)
+spec = importlib.util.spec_from_file_location("check_query_plans", SCRIPT_PATH)
+assert spec is not None and spec.loader is not None
+check_query_plans = importlib.util.module_from_spec(spec)
+# Registered before it runs: its dataclasses look their module up by name.
+sys.modules["check_query_plans"] = check_query_plans
+spec.loader.exec_module(check_query_plans)
+
+
+def _explained(*nodes, execution=1.0):
+    return {
+        "Plan": {
+            "Node Type": "Nested Loop",
+            "Shared Hit Blocks": 12,
+            "Shared Read Blocks": 3,
+            "Plans": list(nodes),
+        },
+        "Planning Time": 0.2,
+        "Execution Time": execution,
+    }
+
+
+def test_flags_a_sequential_scan_on_a_looked_up_table():
+    report = check_query_plans.QueryReport("_ORDER_ITEMS_QUERY")
+    explained = _explained(
+        {"Node Type": "Index Scan", "Relation Name": "Order"},
+        {
+            "Node Type": "Hash",
+            "Plans": [{"Node Type": "Seq Scan", "Relation Name": "OrderItem"}],
+        },
+    )
+
+    check_query_plans.record_plan(report, explained, check_query_plans.INDEXED_TABLES)
+
+    assert report.seq_scans == {"OrderItem"}
+    assert report.problems(budget_ms=25) == ['_ORDER_ITEMS_QUERY: sequential scan on "OrderItem"']
+    assert (report.shared_hit, report.shared_read) == (12, 3)
+
+
+def test_allowed_tables_and_index_scans_pass():
+    report = check_query_plans.QueryReport("_USER_QUERY")
+    explained = _explained({"Node Type": "Seq Scan", "Relation Name": "Product"})
+
+    check_query_plans.record_plan(report, explained, ("User", "Order", "OrderItem"))
+
+    assert report.problems(budget_ms=25) == []
+
+
+def test_median_latency_over_budget_fails():
+    report = check_query_plans.QueryReport("_USER_QUERY")
+    for execution in (1.0, 40.0, 45.0):
+        check_query_plans.record_plan(report, _explained(execution=execution), ())
+
+    assert report.problems(budget_ms=25) == [
+        "_USER_QUERY: median execution 40.00 ms exceeds the 25 ms budget"
+    ]
+
+
+def test_checks_every_chat_service_query():
+    assert set(check_query_plans.chat_queries()) == {
+        name for name in vars(db) if name.startswith("_") and name.endswith("QUERY")
+    }
+    assert "_CUSTOMER_JSON_QUERY" in check_query_plans.chat_queries()
+
+
+def test_allow_seq_scan_removes_tables_from_the_check():
+    args = check_query_plans.parse_args(["--allow-seq-scan", "Product"])
+
+    assert args.tables == ("User", "Order", "OrderItem", "CustomerSummary")
+
+
+def _normalized(sql):
+    return " ".join(sql.replace('"public".', "").split())
+
+
+def test_checks_the_summary_trigger_queries_as_the_migration_runs_them():
+    queries = check_query_plans.plan_queries()
+    migration = _normalized(MIGRATION_PATH.read_text(encoding="utf-8"))
+
+    assert set(check_query_plans.TRIGGER_QUERIES) <= set(queries)
+    for name, sql in check_query_plans.TRIGGER_QUERIES.items():
+        assert '"userId" = $1' in sql, name
+        assert _normalized(sql.replace("$1", "customer_id")) in migration, name
+    assert any('JOIN "OrderItem" i ON i."orderId" = o.id' in sql for sql in queries.values())
@@ -1,3 +1,6 @@
+import asyncio
+from datetime import datetime
+
 import db
 import pytest
 
@@ -85,3 +88,270 @@ async def test_connect_requires_database_url(monkeypatch):
 @pytest.fixture
 def anyio_backend():
     return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_connect_applies_statement_timeout(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:p@h:5432/d?schema=public")
+    captured = {}
+
+    async def fake_connect(dsn, **kwargs):
+        captured["dsn"] = dsn
+        captured.update(kwargs)
+        return object()
+
+    monkeypatch.setattr(db.asyncpg, "connect", fake_connect)
+    await db.connect(timeout=1.5)
+
+    assert captured["dsn"] == "postgresql://u:p@h:5432/d"
+    assert captured["timeout"] == 1.5
+    assert captured["command_timeout"] == 1.5
+    assert captured["server_settings"] == {"statement_timeout": "1500"}
+
+
+class FakeConnection:
+    def __init__(self, row=None, rows=()):
+        self.row = row
+        self.rows = list(rows)
+        self.queries = []
+        self.codecs = []
+        self.closed = False
+
+    async def set_type_codec(self, typename, **kwargs):
+        self.codecs.append((typename, kwargs))
+
+    async def fetchrow(self, query, *args):
+        self.queries.append(query)
+        return self.row
+
+    async def fetch(self, query, *args):
+        self.queries.append(query)
+        return self.rows
+
+    async def close(self):
+        self.closed = True
+
+
+def _user():
+    return {"id": "cust-1", "firstName": "Jane", "membership": "Gold"}
+
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    def install(connection):
+        async def connect(timeout=None):
+            return connection
+
+        monkeypatch.setattr(db, "connect", connect)
+        return connection
+
+    return install
+
+
+@pytest.mark.anyio
+async def test_fetch_customer_uses_one_aggregated_statement(monkeypatch, fake_connect):
+    monkeypatch.delenv("CUSTOMER_QUERY_MODE", raising=False)
+    product = {"id": "p1", "name": "Tent", "slug": "tent"}
+    orders = [
+        {
+            "id": "o1",
+            "userId": "cust-1",
+            "date": "2026-01-02T10:30:00.123",
+            "total": 10.0,
+            "createdAt": "2026-01-02T10:30:00",
+            "updatedAt": "2026-01-02T10:30:00",
+            "items": [
+                {
+                    "id": "i1",
+                    "orderId": "o1",
+                    "productId": "p1",
+                    "quantity": 2,
+                    "price": 5.0,
+                    "product": {**product, "createdAt": "2025-12-01T00:00:00", "updatedAt": None},
+                }
+            ],
+        }
+    ]
+    connection = fake_connect(FakeConnection(row={**_user(), "orders": orders}))
+
+    customer = await db.fetch_customer("cust-1")
+
+    assert connection.queries == [db._CUSTOMER_JSON_QUERY]
+    assert connection.codecs[0][0] == "json"
+    assert connection.codecs[0][1]["schema"] == "pg_catalog"
+    assert connection.closed
+    assert customer["firstName"] == "Jane"
+    order = customer["orders"][0]
+    assert order["date"] == datetime(2026, 1, 2, 10, 30, 0, 123000)
+    assert order["createdAt"] == datetime(2026, 1, 2, 10, 30)
+    assert order["items"][0]["product"]["createdAt"] == datetime(2025, 12, 1)
+    assert order["items"][0]["product"]["updatedAt"] is None
+
+
+@pytest.mark.anyio
+async def test_fetch_customer_split_mode_folds_order_rows(monkeypatch, fake_connect):
+    monkeypatch.setenv("CUSTOMER_QUERY_MODE", "split")
+    connection = fake_connect(
+        FakeConnection(row=_user(), rows=[_row("o1", "i1", "p1"), _row("o1", "i2", "p2")])
+    )
+
+    customer = await db.fetch_customer("cust-1")
+
+    assert connection.queries == [db._USER_QUERY, db._ORDER_ITEMS_QUERY]
+    assert connection.codecs == []
+    assert [item["id"] for item in customer["orders"][0]["items"]] == ["i1", "i2"]
+
+
+@pytest.mark.anyio
+async def test_fetch_customer_returns_none_for_unknown_customer(monkeypatch, fake_connect):
+    monkeypatch.delenv("CUSTOMER_QUERY_MODE", raising=False)
+    connection = fake_connect(FakeConnection(row=None))
+
+    assert await db.fetch_customer("nobody") is None
+    assert connection.closed
+
+
+def test_customer_query_mode_rejects_unknown_values(monkeypatch):
+    monkeypatch.setenv("CUSTOMER_QUERY_MODE", "graphql")
+
+    with pytest.raises(ValueError, match="CUSTOMER_QUERY_MODE"):
+        db.customer_query_mode()
+
+
+def test_json_codec_round_trips_through_orjson():
+    class Recorder:
+        async def set_type_codec(self, typename, **kwargs):
+            self.kwargs = kwargs
+
+    recorder = Recorder()
+    asyncio.run(db._use_orjson(recorder))
+
+    assert recorder.kwargs["decoder"](recorder.kwargs["encoder"]({"items": [1, "a"]})) == {"items": [1, "a"]}
+
+
+class TestReplicaRouting:
+    PRIMARY = "postgresql://u:p@primary:5432/d?schema=public"
+    REPLICAS = "postgresql://u:p@replica-a:5432/d,postgresql://u:p@replica-b:5433/d"
+
+    @pytest.fixture
+    def servers(self, monkeypatch):
+        """Fake asyncpg.connect: per-host lag, or an exception to raise."""
+        monkeypatch.setenv("DATABASE_URL", self.PRIMARY)
+        monkeypatch.setenv("DATABASE_REPLICA_URLS", self.REPLICAS)
+        monkeypatch.setattr(db, "_routers", {})
+        state = {"lag": {"replica-a": 0.0, "replica-b": 0.0}, "down": set(), "opened": []}
+
+        class Connection:
+            def __init__(self, host):
+                self.host = host
+                self.closed = False
+
+            async def fetchval(self, query):
+                assert query == db._REPLICA_LAG_SQL
+                return state["lag"][self.host]
+
+            async def close(self):
+                self.closed = True
+
+        async def fake_connect(dsn, **kwargs):
+            host = db.urlsplit(dsn).hostname
+            state["opened"].append(host)
+            if host in state["down"]:
+                raise OSError(f"{host} refused the connection")
+            return Connection(host)
+
+        monkeypatch.setattr(db.asyncpg, "connect", fake_connect)
+        return state
+
+    @pytest.mark.anyio
+    async def test_reads_alternate_between_current_replicas(self, servers):
+        hosts = [(await db.connect_for_read()).host for _ in range(4)]
+
+        assert hosts == ["replica-a", "replica-b", "replica-a", "replica-b"]
+        assert "primary" not in servers["opened"]
+
+    @pytest.mark.anyio
+    async def test_lagging_replica_is_skipped(self, servers, monkeypatch):
+        monkeypatch.setenv("DATABASE_REPLICA_MAX_LAG_SECONDS", "2")
+        servers["lag"]["replica-a"] = 30.0
+
+        hosts = [(await db.connect_for_read()).host for _ in range(3)]
+
+        assert hosts == ["replica-b", "replica-b", "replica-b"]
+        replica = db.replica_status()["replicas"][0]
+        assert replica == {
+            "host": "replica-a:5432",
+            "available": False,
+            "lag_seconds": 30.0,
+            "reads": 0,
+            "failures": 0,
+            "last_error": "replication lag 30.0s over 2s",
+        }
+
+    @pytest.mark.anyio
+    async def test_falls_back_to_the_primary(self, servers):
+        servers["down"].update({"replica-a", "replica-b"})
+
+        connection = await db.connect_for_read()
+
+        assert connection.host == "primary"
+        status = db.replica_status()
+        assert status["primary_reads"] == 1
+        assert [replica["failures"] for replica in status["replicas"]] == [1, 1]
+        # Replicas that failed are not retried until their cool-down ends.
+        servers["opened"].clear()
+        await db.connect_for_read()
+        assert servers["opened"] == ["primary"]
+
+    @pytest.mark.anyio
+    async def test_lag_is_not_measured_on_every_read(self, servers, monkeypatch):
+        monkeypatch.setenv("DATABASE_REPLICA_URLS", "postgresql://u:p@replica-a:5432/d")
+        await db.connect_for_read()
+        servers["lag"]["replica-a"] = 30.0
+
+        assert (await db.connect_for_read()).host == "replica-a"
+
+    @pytest.mark.anyio
+    async def test_without_replicas_reads_use_the_primary(self, servers, monkeypatch):
+        monkeypatch.delenv("DATABASE_REPLICA_URLS")
+
+        assert (await db.connect_for_read()).host == "primary"
+
+
+@pytest.mark.anyio
+async def test_fetch_customer_summary_reads_one_row(fake_connect):
+    summary = {
+        **_user(),
+        "orderCount": 3,
+        "recentPurchases": [{"name": "Tent", "category": "Tents", "brand": "OutdoorLiving"}],
+        "favoriteCategories": ["Tents"],
+        "favoriteBrands": ["OutdoorLiving"],
+    }
+    connection = fake_connect(FakeConnection(row=summary))
+
+    customer = await db.fetch_customer_summary("cust-1")
+
+    assert connection.queries == [db._CUSTOMER_SUMMARY_QUERY]
+    assert [typename for typename, _ in connection.codecs] == ["json", "jsonb"]
+    assert customer == summary
+    assert connection.closed
+
+
+@pytest.mark.anyio
+async def test_fetch_customer_summary_defaults_when_there_are_no_orders(fake_connect):
+    fake_connect(
+        FakeConnection(
+            row={
+                **_user(),
+                "orderCount": None,
+                "recentPurchases": None,
+                "favoriteCategories": None,
+                "favoriteBrands": None,
+            }
+        )
+    )
+
+    customer = await db.fetch_customer_summary("cust-1")
+
+    assert customer["orderCount"] == 0
+    assert customer["recentPurchases"] == customer["favoriteCategories"] == customer["favoriteBrands"] == []
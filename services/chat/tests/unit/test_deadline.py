@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from contoso_chat.deadline import Deadline, DeadlineExceededError
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_from_env_uses_the_configured_budget(monkeypatch):
+    monkeypatch.setenv("CHAT_REQUEST_BUDGET_SECONDS", "20")
+
+    assert Deadline.from_env().budget == 20
+    assert Deadline.from_env("2500").budget == 2.5
+    assert Deadline.from_env("60000").budget == 20
+    assert Deadline.from_env("not-a-number").budget == 20
+
+
+def test_stages_get_their_share_and_llm_gets_the_rest():
+    deadline = Deadline(10)
+
+    assert deadline.stage_timeout("customer") == pytest.approx(1.0)
+    assert deadline.stage_timeout("search") == pytest.approx(1.5)
+    assert deadline.stage_timeout("llm") == pytest.approx(10, abs=0.1)
+
+
+@pytest.mark.anyio
+async def test_run_cancels_the_stage_when_its_share_runs_out():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(DeadlineExceededError, match="during search"):
+        await Deadline(0.1).run("search", slow())
+
+    assert cancelled.is_set()
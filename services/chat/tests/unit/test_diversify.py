@@ -0,0 +1,35 @@
+import numpy as np
+from contoso_chat.diversify import hashed_vectors, mmr
+
+
+def test_mmr_with_lambda_one_is_relevance_order():
+    vectors = np.eye(3)
+
+    assert mmr([0.2, 0.9, 0.5], vectors, 3, 1.0) == [1, 2, 0]
+
+
+def test_mmr_skips_a_near_duplicate_of_the_first_pick():
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+
+    # The second candidate is almost as relevant but nearly identical to the first.
+    assert mmr([0.9, 0.88, 0.6], vectors, 2, 0.5) == [0, 2]
+    assert mmr([0.9, 0.88, 0.6], vectors, 2, 1.0) == [0, 1]
+
+
+def test_mmr_bounds():
+    assert mmr([], np.zeros((0, 2)), 3, 0.7) == []
+    assert mmr([0.5, 0.4], np.eye(2), 5, 0.7) == [0, 1]
+
+
+def test_hashed_vectors_put_variants_close_and_other_products_far():
+    tent_2p, tent_4p, stove = hashed_vectors(
+        [
+            "Alpine Explorer Tent 2-person, waterproof, aluminium poles",
+            "Alpine Explorer Tent 4-person, waterproof, aluminium poles",
+            "PowerBurner compact camping stove with piezo ignition",
+        ]
+    )
+
+    assert float(tent_2p @ tent_4p) > 0.7
+    assert abs(float(tent_2p @ stove)) < 0.3
+    assert np.isclose(np.linalg.norm(stove), 1.0)
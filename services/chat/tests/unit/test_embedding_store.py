@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pytest
+from contoso_chat.embedding_store import EmbeddingStore
+
+
+def write_store(directory, name, vectors, documents, metadatas=None):
+    np.save(directory / f"{name}.npy", np.asarray(vectors, dtype=np.float32))
+    sidecar = {
+        "ids": [f"id{number}" for number in range(len(documents))],
+        "metadatas": metadatas or [{"name": document} for document in documents],
+        "documents": documents,
+    }
+    (directory / f"{name}.json").write_text(json.dumps(sidecar), encoding="utf-8")
+
+
+def test_open_maps_the_matrix_read_only(tmp_path):
+    write_store(tmp_path, "products", [[1, 0], [0, 1]], ["tent", "stove"])
+
+    store = EmbeddingStore.open(str(tmp_path), "products")
+
+    assert isinstance(store.vectors, np.memmap)
+    assert not store.vectors.flags.writeable
+    assert len(store) == 2
+
+
+def test_search_ranks_by_cosine_and_respects_the_mask(tmp_path):
+    write_store(tmp_path, "products", [[1, 0], [0.6, 0.8], [0, 1]], ["tent", "tarp", "stove"])
+    store = EmbeddingStore.open(str(tmp_path), "products")
+
+    assert store.search([2, 0], limit=2) == [(0, 1.0), (1, pytest.approx(0.6))]
+    assert store.search([2, 0], limit=5, mask=np.array([False, False, True])) == [(2, 0.0)]
+    assert store.search([2, 0], limit=5, mask=np.zeros(3, dtype=bool)) == []
+
+
+def test_vector_reads_a_stored_row(tmp_path):
+    write_store(tmp_path, "products", [[1, 0], [0, 1]], ["tent", "stove"])
+    store = EmbeddingStore.open(str(tmp_path), "products")
+
+    assert store.vector(1).tolist() == [0.0, 1.0]
+
+
+def test_open_maps_the_matrix_the_sidecar_names(tmp_path):
+    # The previous generation's matrix is still on disk beside the new one.
+    write_store(tmp_path, "products", [[1, 0]], ["tent"])
+    np.save(tmp_path / "products.2.npy", np.asarray([[0, 1], [1, 0]], dtype=np.float32))
+    sidecar = {"vectors": "products.2.npy", "ids": ["a", "b"], "metadatas": [{}, {}], "documents": ["x", "y"]}
+    (tmp_path / "products.json").write_text(json.dumps(sidecar), encoding="utf-8")
+
+    store = EmbeddingStore.open(str(tmp_path), "products")
+
+    assert store.vectors.tolist() == [[0.0, 1.0], [1.0, 0.0]]
+    assert store.ids == ["a", "b"]
+
+
+def test_inconsistent_sidecar_is_rejected(tmp_path):
+    write_store(tmp_path, "products", [[1, 0]], ["tent", "stove"])
+
+    with pytest.raises(ValueError, match="inconsistent"):
+        EmbeddingStore.open(str(tmp_path), "products")
@@ -1,7 +1,7 @@
 import json
 import warnings
 from pathlib import Path
-from unittest.mock import AsyncMock, patch
+from unittest.mock import patch
 
 import pandas as pd
 from evaluate import create_response_data, create_summary, evaluate, load_data
@@ -23,20 +23,47 @@ def test_load_data_reads_jsonl(tmp_path, monkeypatch):
 
 def test_create_response_data_writes_result_file(tmp_path, monkeypatch):
     monkeypatch.chdir(tmp_path)
-    df = pd.DataFrame([{"customerId": "1", "question": "Best tent?"}])
-    mocked_response = {"context": [{"sku": "abc123"}], "answer": "Trailmaster X4"}
+    df = pd.DataFrame([{"customerId": "1", "question": "Best tent?"}, {"customerId": "2", "question": "Stove?"}])
+    calls = []
 
-    with patch("evaluate.get_response", new=AsyncMock(return_value=mocked_response)) as mock_get_response:
+    async def fake_get_responses(questions, traffic_class):
+        calls.append((questions, traffic_class))
+        # Completion order, not dataset order.
+        yield 1, {"context": [], "answer": "PowerBurner"}
+        yield 0, {"context": [{"sku": "abc123"}], "answer": "Trailmaster X4"}
+
+    with patch("evaluate.get_responses", new=fake_get_responses):
         results = create_response_data(df)
 
-    assert results == [{"question": "Best tent?", "context": [{"sku": "abc123"}], "answer": "Trailmaster X4"}]
-    mock_get_response.assert_awaited_once_with(customer_id="1", question="Best tent?", chat_history=[])
+    assert results == [
+        {"question": "Best tent?", "context": [{"sku": "abc123"}], "answer": "Trailmaster X4"},
+        {"question": "Stove?", "context": [], "answer": "PowerBurner"},
+    ]
+    assert calls == [([("1", "Best tent?"), ("2", "Stove?")], "batch")]
 
     result_lines = (tmp_path / "result.jsonl").read_text(encoding="utf-8").strip().splitlines()
-    assert len(result_lines) == 1
+    assert len(result_lines) == 2
     assert json.loads(result_lines[0])["question"] == "Best tent?"
 
 
+def test_create_response_data_records_failed_questions_and_keeps_going(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = pd.DataFrame([{"customerId": "1", "question": "Best tent?"}, {"customerId": "2", "question": "Stove?"}])
+
+    async def fake_get_responses(questions, traffic_class):
+        yield 0, TimeoutError("Request budget of 90s exhausted during llm")
+        yield 1, {"context": [], "answer": "PowerBurner"}
+
+    with patch("evaluate.get_responses", new=fake_get_responses):
+        results = create_response_data(df)
+
+    assert results[0] == {"question": "Best tent?", "error": "TimeoutError: Request budget of 90s exhausted during llm"}
+    assert results[1]["answer"] == "PowerBurner"
+    # Only answered questions go on to be scored.
+    result_lines = (tmp_path / "result.jsonl").read_text(encoding="utf-8").strip().splitlines()
+    assert [json.loads(line)["question"] for line in result_lines] == ["Stove?"]
+
+
 def test_evaluate_adds_scores_and_writes_outputs(tmp_path, monkeypatch):
     monkeypatch.chdir(tmp_path)
     Path("result.jsonl").write_text(
@@ -0,0 +1,52 @@
+import time
+
+from contoso_chat.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [
+    "Product: Alpine Explorer Tent\nBrand: AlpineGear\nDescription: A roomy 8-person tent.",
+    "Product: Summit Breeze Jacket\nBrand: MountainStyle\nDescription: GORE-TEX shell, waterproof.",
+    "Product: TrekReady Hiking Boots\nBrand: TrekReady\nDescription: Waterproof leather boots.",
+    "Product: Rainier Fleece\nBrand: MountainStyle\nDescription: A warm fleece for cold evenings.",
+]
+
+
+def test_tokenize_keeps_hyphenated_compounds_whole_and_split():
+    assert tokenize("The GORE-TEX shell") == ["goretex", "gore", "tex", "shell"]
+
+
+def test_exact_brand_term_ranks_its_documents_first():
+    index = BM25Index(DOCUMENTS)
+
+    assert [number for number, _ in index.search("goretex jacket", 5)] == [1]
+    assert [number for number, _ in index.search("mountainstyle fleece", 5)][0] == 3
+
+
+def test_rare_terms_outweigh_common_ones():
+    index = BM25Index(DOCUMENTS)
+    scores = index.scores("waterproof tent")
+
+    # "tent" appears once in the catalogue, "waterproof" twice.
+    assert scores[0] > scores[1]
+    assert scores[0] > scores[2]
+
+
+def test_unknown_terms_and_empty_index_return_nothing():
+    assert BM25Index(DOCUMENTS).search("kayak", 5) == []
+    assert BM25Index([]).search("tent", 5) == []
+
+
+def test_lookup_is_sub_millisecond_on_a_catalogue_sized_index():
+    catalogue = [f"{doc} item {i}" for i in range(50) for doc in DOCUMENTS]
+    index = BM25Index(catalogue)
+
+    started = time.perf_counter()
+    for _ in range(100):
+        index.search("waterproof goretex jacket", 5)
+    assert (time.perf_counter() - started) / 100 < 0.001
+
+
+def test_rrf_rewards_documents_both_rankings_agree_on():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+
+    assert fused[0] == "b"
+    assert set(fused) == {"a", "b", "c", "d"}
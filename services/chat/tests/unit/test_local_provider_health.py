@@ -1,9 +1,16 @@
 import urllib.error
 from unittest.mock import patch
 
+import pytest
 from local_provider_health import evaluate_local_provider_health
 
 
+@pytest.fixture(autouse=True)
+def loaded_models():
+    with patch("local_provider_health._fetch_loaded_models", return_value=["gemma3:12b"]) as mock:
+        yield mock
+
+
 @patch.dict("os.environ", {"LLM_PROVIDER": "gcp"}, clear=True)
 def test_non_local_provider_skips_checks():
     health = evaluate_local_provider_health()
@@ -89,3 +96,18 @@ def test_local_provider_uses_localhost_fallback_for_host_docker_internal(
     assert health["effective_ollama_base_url"] == "http://localhost:11434"
     assert any("fell back to http://localhost:11434" in warning for warning in health["warnings"])
     assert mock_fetch_ollama_models.call_count == 2
+
+
+@patch.dict("os.environ", {"LLM_PROVIDER": "local", "LOCAL_MODEL_NAME": "gemma3:12b"}, clear=True)
+@patch("local_provider_health._missing_python_packages", return_value=[])
+@patch("local_provider_health._fetch_ollama_models", return_value=["gemma3:12b"])
+def test_local_provider_warns_when_the_model_is_not_loaded(
+    _mock_fetch_ollama_models, _mock_missing_python_packages, loaded_models
+):
+    loaded_models.return_value = ["phi4"]
+
+    health = evaluate_local_provider_health()
+
+    assert health["ready"] is True
+    assert health["model_loaded"] is False
+    assert any("not loaded" in warning for warning in health["warnings"])
@@ -1,13 +1,17 @@
+import asyncio
+import json
 import os
 import sys
-from unittest.mock import patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 from fastapi.testclient import TestClient
 
 # Add the src/api directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src/api'))
 
-from main import app
+from contoso_chat.admission import OverloadedError
+from contoso_chat.deadline import DeadlineExceededError
+from main import app, cancel_on_disconnect
 
 client = TestClient(app)
 
@@ -135,7 +139,77 @@ def test_create_response_real_mode(mock_get_response):
         assert data["customer_id"] == "1"
 
         # Verify the function was called with correct parameters
-        mock_get_response.assert_called_once_with("1", "What are the best tents?", "[]")
+        mock_get_response.assert_called_once_with(
+            "1",
+            "What are the best tents?",
+            "[]",
+            traffic_class="interactive",
+            deadline=ANY,
+            diversity=None,
+        )
+
+CONTEXT = [
+    {
+        "id": "p1",
+        "name": "TrailMaster X4 Tent",
+        "slug": "trailmaster-x4-tent",
+        "description": "A roomy four-person tent. " * 50,
+        "score": 0.82,
+    },
+    {"manual": "Tent care", "product": "TrailMaster X4 Tent", "passages": ["Dry it first."], "score": 0.5},
+]
+
+
+@patch('main.get_response')
+def test_create_response_context_modes(mock_get_response):
+    mock_get_response.return_value = {"question": "Tents?", "answer": "Try the X4.", "context": CONTEXT}
+    payload = {"question": "Tents?", "customer_id": "1"}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        full = client.post("/api/create_response", json=payload).json()
+        ids = client.post("/api/create_response", json={**payload, "include_context": "ids"}).json()
+        none = client.post("/api/create_response", json={**payload, "include_context": "none"}).json()
+
+    assert full["context"] == CONTEXT
+    assert ids == {
+        "question": "Tents?",
+        "answer": "Try the X4.",
+        "context": [
+            {"id": "p1", "name": "TrailMaster X4 Tent", "slug": "trailmaster-x4-tent", "score": 0.82},
+            {"manual": "Tent care", "score": 0.5},
+        ],
+    }
+    assert none == {"question": "Tents?", "answer": "Try the X4."}
+
+
+@patch('main.get_response')
+def test_create_response_context_defaults_to_the_environment(mock_get_response):
+    mock_get_response.return_value = {"answer": "Try the X4.", "context": CONTEXT}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True), patch.dict(os.environ, {"CHAT_RESPONSE_CONTEXT": "none"}):
+        data = client.post("/api/create_response", json={"question": "Tents?"}).json()
+
+    assert data == {"answer": "Try the X4."}
+
+
+def test_create_response_rejects_unknown_context_modes():
+    response = client.post("/api/create_response", json={"question": "Tents?", "include_context": "some"})
+
+    assert response.status_code == 422
+
+
+@patch('main.get_response')
+def test_large_responses_are_gzipped(mock_get_response):
+    mock_get_response.return_value = {"answer": "Try the X4.", "context": CONTEXT}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post(
+            "/api/create_response", json={"question": "Tents?"}, headers={"Accept-Encoding": "gzip"}
+        )
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["context"] == CONTEXT
+
 
 @patch('main.get_response')
 def test_create_response_error_handling(mock_get_response):
@@ -190,3 +264,288 @@ def test_cors_headers():
     response = client.get("/")
     # Check that CORS headers are present in response
     assert response.status_code == 200
+
+@patch('main.get_response')
+def test_create_response_overloaded_returns_429(mock_get_response):
+    """A saturated LLM limiter is a fast, retryable refusal"""
+    mock_get_response.side_effect = OverloadedError("gcp/gemini is at capacity", retry_after=3)
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post("/api/create_response", json={"question": "Hello", "customer_id": "1"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    data = response.json()
+    assert data["retry_after"] == 3
+    assert data["customer_id"] == "1"
+    assert "answer" in data
+
+def test_health_admission_endpoint():
+    """Limiter state is exported"""
+    with patch('main.admission_snapshot', return_value={"gcp/gemini": {"queue_depth": 0}}):
+        response = client.get("/health/admission")
+
+    assert response.status_code == 200
+    assert response.json() == {"limiters": {"gcp/gemini": {"queue_depth": 0}}}
+
+@patch('main.get_response')
+def test_create_response_passes_traffic_class_header(mock_get_response):
+    """Bulk callers can mark themselves as batch traffic"""
+    mock_get_response.return_value = {"answer": "ok", "context": []}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post(
+            "/api/create_response",
+            json={"question": "Hello", "customer_id": "1"},
+            headers={"X-Traffic-Class": "batch"},
+        )
+
+    assert response.status_code == 200
+    assert mock_get_response.call_args.kwargs["traffic_class"] == "batch"
+
+def test_health_providers_endpoint():
+    """Provider health statistics are exported"""
+    with patch('main.providers_snapshot', return_value={"gcp": {"breaker": "closed"}}), patch(
+        'main.tiers_snapshot', return_value={"fast": {"requests": 3}}
+    ):
+        response = client.get("/health/providers")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "providers": {"gcp": {"breaker": "closed"}},
+        "tiers": {"fast": {"requests": 3}},
+    }
+
+
+@patch('main.get_response')
+def test_create_response_budget_header_can_only_shorten_the_deadline(mock_get_response):
+    """A caller's X-Request-Budget-Ms caps the budget but cannot extend it"""
+    mock_get_response.return_value = {"answer": "ok", "context": []}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True), patch.dict(
+        os.environ, {"CHAT_REQUEST_BUDGET_SECONDS": "30"}
+    ):
+        client.post(
+            "/api/create_response",
+            json={"question": "Hello"},
+            headers={"X-Request-Budget-Ms": "5000"},
+        )
+        client.post(
+            "/api/create_response",
+            json={"question": "Hello"},
+            headers={"X-Request-Budget-Ms": "900000"},
+        )
+
+    budgets = [call.kwargs["deadline"].budget for call in mock_get_response.call_args_list]
+    assert budgets == [5.0, 30.0]
+
+@patch('main.get_response')
+def test_create_response_deadline_exceeded_returns_504(mock_get_response):
+    """Running out of budget is a gateway timeout, not a 200 fallback"""
+    mock_get_response.side_effect = DeadlineExceededError("search", 1.0)
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post("/api/create_response", json={"question": "Hello", "customer_id": "1"})
+
+    assert response.status_code == 504
+    data = response.json()
+    assert data["fallback"] is True
+    assert "search" in data["error"]
+
+def test_cancel_on_disconnect_cancels_pending_work():
+    """A client that goes away cancels the in-flight response"""
+    async def scenario():
+        disconnected = MagicMock()
+        disconnected.is_disconnected = AsyncMock(return_value=True)
+        work = asyncio.ensure_future(asyncio.sleep(10))
+
+        cancelled = await cancel_on_disconnect(disconnected, work)
+        await asyncio.sleep(0)
+        return cancelled, work.cancelled()
+
+    assert asyncio.run(scenario()) == (True, True)
+
+def test_startup_runs_warm_up_and_reports_it():
+    """Warm-up runs before traffic and its report is exported"""
+    with patch('main.REAL_CHAT_AVAILABLE', True), patch(
+        'main.warm_up', return_value={"seconds": 0.1, "steps": {}}
+    ) as mock_warm_up, patch.dict(os.environ, {"CHAT_WARMUP": "1"}):
+        with TestClient(app) as started:
+            response = started.get("/health/startup")
+
+    mock_warm_up.assert_called_once_with()
+    assert response.json() == {"warmup": {"seconds": 0.1, "steps": {}}}
+
+
+def test_startup_preloads_the_local_model():
+    """With the local provider configured, the Ollama model is loaded before traffic"""
+    preload = AsyncMock(return_value={"model": "gemma3:12b", "seconds": 1.5})
+
+    with patch('main.REAL_CHAT_AVAILABLE', True), patch(
+        'main.warm_up', return_value={"seconds": 0.1, "steps": {}}
+    ), patch('main.preload_local_model', new=preload), patch.dict(
+        os.environ, {"CHAT_WARMUP": "1", "LLM_PROVIDER": "local"}
+    ):
+        with TestClient(app) as started:
+            response = started.get("/health/startup")
+
+    preload.assert_awaited_once_with("gemma3:12b")
+    assert response.json()["ollama"] == [{"model": "gemma3:12b", "seconds": 1.5}]
+
+
+def test_startup_preloads_every_tier_model():
+    """With model tiering on, the fast tier's local model is loaded too"""
+    preload = AsyncMock(side_effect=lambda model: {"model": model, "seconds": 1.0})
+
+    with patch('main.REAL_CHAT_AVAILABLE', True), patch(
+        'main.warm_up', return_value={"seconds": 0.1, "steps": {}}
+    ), patch('main.preload_local_model', new=preload), patch.dict(
+        os.environ,
+        {"CHAT_WARMUP": "1", "LLM_PROVIDER": "local", "MODEL_TIERING": "1", "LOCAL_FAST_MODEL_NAME": "phi4-mini"},
+    ):
+        with TestClient(app) as started:
+            response = started.get("/health/startup")
+
+    assert [report["model"] for report in response.json()["ollama"]] == ["gemma3:12b", "phi4-mini"]
+
+
+@patch('main.get_response')
+def test_create_response_passes_diversity_through(mock_get_response):
+    """A per-request diversity reaches retrieval; out-of-range values are rejected"""
+    mock_get_response.return_value = {"answer": "ok", "context": []}
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post(
+            "/api/create_response", json={"question": "Tents?", "diversity": 0.6}
+        )
+        rejected = client.post(
+            "/api/create_response", json={"question": "Tents?", "diversity": 2}
+        )
+
+    assert response.status_code == 200
+    assert mock_get_response.call_args.kwargs["diversity"] == 0.6
+    assert rejected.status_code == 422
+
+
+async def _batch_results(results):
+    for item in results:
+        yield item
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@patch('main.get_responses')
+def test_create_response_batch_streams_ndjson_lines(mock_get_responses):
+    mock_get_responses.return_value = _batch_results([
+        (1, {"question": "Stoves?", "answer": "Try the PowerBurner.", "context": CONTEXT}),
+        (0, DeadlineExceededError("llm", 90)),
+    ])
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post(
+            "/api/create_response/batch",
+            json={
+                "questions": [{"question": "Tents?", "customer_id": "1"}, {"question": "Stoves?"}],
+                "include_context": "none",
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert _ndjson(response) == [
+        {"index": 1, "question": "Stoves?", "answer": "Try the PowerBurner."},
+        {"index": 0, "question": "Tents?", "error": "Request budget of 90s exhausted during llm", "status": 504},
+    ]
+    args, kwargs = mock_get_responses.call_args
+    assert args == ([("1", "Tents?"), (None, "Stoves?")],)
+    assert kwargs["traffic_class"] == "batch"
+
+
+@patch('main.get_responses')
+def test_create_response_batch_sends_each_line_as_it_completes(mock_get_responses):
+    """gzip must not hold a finished line back until the batch is done"""
+    async def scenario():
+        last_answer = asyncio.Event()
+
+        async def results():
+            yield 0, {"question": "Tents?", "answer": "Try the X4.", "context": CONTEXT}
+            await last_answer.wait()
+            yield 1, {"question": "Stoves?", "answer": "Try the PowerBurner.", "context": CONTEXT}
+
+        mock_get_responses.return_value = results()
+        body = json.dumps({"questions": [{"question": "Tents?"}, {"question": "Stoves?"}]}).encode()
+        requests = [{"type": "http.request", "body": body, "more_body": False}]
+        sent: asyncio.Queue = asyncio.Queue()
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.Event().wait()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/create_response/batch",
+            "raw_path": b"/api/create_response/batch",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"content-type", b"application/json"), (b"accept-encoding", b"gzip")],
+            "client": ("test", 1),
+            "server": ("test", 80),
+        }
+        task = asyncio.create_task(app(scope, receive, sent.put))
+
+        start = await asyncio.wait_for(sent.get(), 5)
+        first = b""
+        while not first:
+            first = (await asyncio.wait_for(sent.get(), 5)).get("body", b"")
+        last_answer.set()
+        await asyncio.wait_for(task, 5)
+        return dict(start["headers"]), first
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        headers, first = asyncio.run(scenario())
+
+    assert headers[b"content-encoding"] == b"identity"
+    assert json.loads(first)["index"] == 0
+
+
+@patch('main.get_responses')
+def test_create_response_batch_rejects_a_saturated_model_up_front(mock_get_responses):
+    async def overloaded():
+        raise OverloadedError("gcp/gemini is at capacity", retry_after=3)
+        yield
+
+    mock_get_responses.return_value = overloaded()
+
+    with patch('main.REAL_CHAT_AVAILABLE', True):
+        response = client.post("/api/create_response/batch", json={"questions": [{"question": "Tents?"}]})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+
+
+def test_create_response_batch_limits_its_size():
+    questions = [{"question": f"q{n}"} for n in range(3)]
+
+    with patch.dict(os.environ, {"CHAT_BATCH_MAX_QUESTIONS": "2"}):
+        response = client.post("/api/create_response/batch", json={"questions": questions})
+    empty = client.post("/api/create_response/batch", json={"questions": []})
+
+    assert response.status_code == 413
+    assert empty.status_code == 422
+
+
+def test_create_response_batch_mock_mode():
+    with patch('main.REAL_CHAT_AVAILABLE', False):
+        response = client.post(
+            "/api/create_response/batch", json={"questions": [{"question": "Tents?"}, {"question": "Stoves?"}]}
+        )
+
+    assert [line["index"] for line in _ndjson(response)] == [0, 1]
+    assert all(line["mock"] for line in _ndjson(response))
@@ -0,0 +1,91 @@
+from contoso_chat import model_tiers
+from contoso_chat.model_tiers import (
+    FAST,
+    STRONG,
+    ModelTier,
+    TieringConfig,
+    choose_tier,
+    strong_reasons,
+)
+
+CONFIG = TieringConfig(
+    enabled=True,
+    fast=ModelTier(FAST, "gemini-fast", "gemma-fast", 512),
+    strong=ModelTier(STRONG, "gemini-strong", "gemma-strong"),
+)
+ONE_MATCH = [{"name": "TrailMaster X4 Tent", "score": 0.9}]
+
+
+def test_a_short_lookup_with_one_confident_match_is_fast():
+    decision = choose_tier("Is the TrailMaster X4 waterproof?", ONE_MATCH, CONFIG)
+
+    assert decision.tier.name == FAST
+    assert decision.tier.gemini_model == "gemini-fast"
+    assert decision.reasons == ()
+
+
+def test_questions_that_ask_to_weigh_options_are_strong():
+    decision = choose_tier("Which tent should I buy?", ONE_MATCH, CONFIG)
+
+    assert decision.tier.name == STRONG
+    assert decision.reasons == ("asks to which",)
+
+
+def test_every_reason_is_reported():
+    question = " ".join(["tent"] * 25)
+    context = [{"name": f"Tent {i}", "score": 0.2} for i in range(5)]
+
+    assert strong_reasons(question, context, CONFIG) == ["long question", "5 products", "no confident match"]
+
+
+def test_manual_passages_do_not_count_as_products():
+    context = ONE_MATCH + [{"manual": "TrailMaster X4 Tent", "content": "Setup", "score": 0.1}] * 4
+
+    assert choose_tier("How do I set up the TrailMaster X4?", context, CONFIG).tier.name == FAST
+
+
+def test_a_large_context_is_strong():
+    context = [{"name": "TrailMaster X4 Tent", "score": 0.9, "description": "roomy " * 2000}]
+
+    assert strong_reasons("Is it waterproof?", context, CONFIG) == ["large context"]
+
+
+def test_tiering_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("MODEL_TIERING", raising=False)
+    monkeypatch.setenv("GEMINI_MODEL_NAME", "gemini-2.5-pro")
+
+    decision = choose_tier("Is it waterproof?", ONE_MATCH)
+
+    assert decision.tier.name == STRONG
+    assert decision.tier.gemini_model == "gemini-2.5-pro"
+    assert decision.tier.max_output_tokens is None
+
+
+def test_config_reads_the_environment(monkeypatch):
+    monkeypatch.setenv("MODEL_TIERING", "1")
+    monkeypatch.setenv("GEMINI_FAST_MODEL_NAME", "gemini-lite")
+    monkeypatch.setenv("LOCAL_FAST_MODEL_NAME", "phi4-mini")
+    monkeypatch.setenv("MODEL_TIER_FAST_MAX_OUTPUT_TOKENS", "")
+    monkeypatch.setenv("MODEL_TIER_STRONG_MAX_OUTPUT_TOKENS", "2048")
+    monkeypatch.setenv("MODEL_TIER_FAST_MAX_PRODUCTS", "1")
+
+    config = TieringConfig.from_env()
+
+    assert config.enabled
+    assert config.fast == ModelTier(FAST, "gemini-lite", "phi4-mini", None)
+    assert config.strong.max_output_tokens == 2048
+    assert config.max_products == 1
+    assert config.max_words == 20
+
+
+def test_tier_latency_is_summarised():
+    model_tiers.reset_tier_stats()
+    for latency in (0.1, 0.2, 0.3):
+        model_tiers.record_tier_latency(FAST, latency)
+
+    snapshot = model_tiers.tiers_snapshot()
+    model_tiers.reset_tier_stats()
+
+    assert snapshot == {
+        FAST: {"requests": 3, "latency_seconds": {"p50": 0.2, "p95": 0.3, "samples": 3}}
+    }
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import httpx2
+import pytest
+from contoso_chat import ollama
+from contoso_chat.ollama import OllamaClient, OllamaConfig, keep_alive_value
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    ollama.reset_ollama_clients()
+    yield
+    ollama.reset_ollama_clients()
+
+
+def _recording_transport(requests, reply):
+    def handle(request):
+        requests.append((request.url.path, json.loads(request.content)))
+        return httpx2.Response(200, json=reply)
+
+    return httpx2.MockTransport(handle)
+
+
+def test_config_reads_the_environment(monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://ollama:11434/")
+    monkeypatch.setenv("LOCAL_MODEL_NAME", "phi4")
+    monkeypatch.setenv("OLLAMA_KEEP_ALIVE", "-1")
+    monkeypatch.setenv("OLLAMA_NUM_CTX", "8192")
+    monkeypatch.delenv("OLLAMA_NUM_THREAD", raising=False)
+
+    config = OllamaConfig.from_env()
+
+    assert config.base_url == "http://ollama:11434"
+    assert config.model == "phi4"
+    assert config.keep_alive == -1
+    assert config.options == (("num_ctx", 8192),)
+
+
+def test_keep_alive_accepts_durations_and_seconds():
+    assert keep_alive_value(None) == "30m"
+    assert keep_alive_value("1h") == "1h"
+    assert keep_alive_value("600") == 600
+
+
+@pytest.mark.anyio
+async def test_chat_sends_the_model_options_and_keep_alive():
+    requests = []
+    config = OllamaConfig(base_url="http://ollama:11434", model="phi4", options=(("num_thread", 4),))
+    client = OllamaClient(config, transport=_recording_transport(requests, {"message": {"content": "hi"}}))
+
+    reply = await client.chat([{"role": "user", "content": "Hello"}], temperature=0.7)
+    await client.aclose()
+
+    assert reply == {"message": {"content": "hi"}}
+    assert requests == [
+        (
+            "/api/chat",
+            {
+                "model": "phi4",
+                "messages": [{"role": "user", "content": "Hello"}],
+                "stream": False,
+                "keep_alive": "30m",
+                "options": {"num_thread": 4, "temperature": 0.7},
+            },
+        )
+    ]
+
+
+@pytest.mark.anyio
+async def test_preload_loads_the_model_without_a_prompt():
+    requests = []
+    client = OllamaClient(OllamaConfig(model="phi4"), transport=_recording_transport(requests, {"done": True}))
+
+    await client.preload()
+    await client.preload("gemma3:4b")
+    await client.aclose()
+
+    assert requests == [
+        ("/api/generate", {"model": "phi4", "keep_alive": "30m"}),
+        ("/api/generate", {"model": "gemma3:4b", "keep_alive": "30m"}),
+    ]
+
+
+@pytest.mark.anyio
+async def test_requests_on_one_loop_share_a_client(monkeypatch):
+    monkeypatch.setenv("LOCAL_MODEL_NAME", "phi4")
+
+    assert ollama.get_ollama_client() is ollama.get_ollama_client()
+
+
+def test_a_client_replaced_for_a_new_loop_is_closed(monkeypatch):
+    monkeypatch.setenv("LOCAL_MODEL_NAME", "phi4")
+
+    async def current():
+        return ollama.get_ollama_client()
+
+    loop = asyncio.new_event_loop()
+    try:
+        first = loop.run_until_complete(current())
+        second = asyncio.run(current())
+        # The close was handed to the first client's own loop.
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+    assert second is not first
+    assert first.http.is_closed
+
+
+@pytest.mark.anyio
+async def test_close_ollama_clients_closes_every_pool(monkeypatch):
+    monkeypatch.setenv("LOCAL_MODEL_NAME", "phi4")
+    client = ollama.get_ollama_client()
+
+    await ollama.close_ollama_clients()
+
+    assert client.http.is_closed
+    assert ollama.get_ollama_client() is not client
+
+
+@pytest.mark.anyio
+async def test_preload_local_model_reports_instead_of_raising(monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:9")
+
+    report = await ollama.preload_local_model()
+
+    assert "ConnectError" in report["error"]
+    assert report["seconds"] >= 0
+
+
+@pytest.mark.anyio
+async def test_preload_local_model_reports_the_load_time(monkeypatch):
+    requests = []
+    client = OllamaClient(OllamaConfig(), transport=_recording_transport(requests, {"load_duration": 2_500_000_000}))
+    monkeypatch.setattr(ollama, "get_ollama_client", lambda: client)
+
+    report = await ollama.preload_local_model()
+
+    assert report["load_seconds"] == 2.5
+    assert report["model"] == "gemma3:12b"
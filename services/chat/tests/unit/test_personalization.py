@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from contoso_chat.personalization import MAX_RECENT_PURCHASES, profile_block
+
+SUMMARY = {
+    "firstName": "Taylor",
+    "membership": "Gold",
+    "orderCount": 12,
+    "recentPurchases": [
+        {"name": f"Product {n}", "category": "Tents", "brand": "OutdoorLiving", "purchasedAt": "2026-01-02T10:30:00"}
+        for n in range(5)
+    ],
+    "favoriteCategories": ["Tents", "Backpacks", "Hiking Clothing", "Cooking Gear"],
+    "favoriteBrands": ["OutdoorLiving"],
+}
+
+
+def test_profile_lists_membership_purchases_and_favourites():
+    block = profile_block(SUMMARY)
+
+    assert block.splitlines() == [
+        "Shopper profile (use it to tailor suggestions; do not recite it):",
+        "- Membership: Gold",
+        "- Recent purchases: "
+        + "; ".join(f"Product {n} (Tents, OutdoorLiving)" for n in range(MAX_RECENT_PURCHASES)),
+        "- Favourite categories: Tents, Backpacks, Hiking Clothing",
+        "- Favourite brands: OutdoorLiving",
+    ]
+
+
+def test_profile_is_bounded_however_long_the_history():
+    long_history = {
+        **SUMMARY,
+        "recentPurchases": SUMMARY["recentPurchases"] * 100,
+        "favoriteCategories": SUMMARY["favoriteCategories"] * 100,
+    }
+
+    assert profile_block(long_history) == profile_block(SUMMARY)
+
+
+def test_no_profile_for_guests_or_customers_without_a_summary():
+    assert profile_block(None) == ""
+    assert profile_block({"firstName": "Taylor", "recentPurchases": [], "favoriteCategories": []}) == ""
+
+
+def test_personalization_can_be_switched_off():
+    with patch.dict("os.environ", {"CHAT_PERSONALIZATION": "0"}):
+        assert profile_block(SUMMARY) == ""
@@ -0,0 +1,228 @@
+import asyncio
+
+import pytest
+from contoso_chat import admission, provider_router
+from contoso_chat.admission import OverloadedError
+from contoso_chat.deadline import Deadline, DeadlineExceededError
+from contoso_chat.provider_router import (
+    HEDGE_MIN_SAMPLES,
+    CircuitBreaker,
+    ProviderRouter,
+    ProviderSpec,
+    ProvidersUnavailableError,
+    provider_health,
+    providers_snapshot,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    admission.reset_limiters()
+    provider_router.reset_provider_health()
+    yield
+    admission.reset_limiters()
+    provider_router.reset_provider_health()
+
+
+GCP = ProviderSpec("gcp", "gemini-2.5-flash", timeout=1.0)
+LOCAL = ProviderSpec("local", "gemma3:12b", timeout=1.0)
+
+
+def test_from_env_orders_primary_then_fallbacks(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "gcp")
+    monkeypatch.setenv("LLM_FALLBACK_PROVIDERS", "local, gcp")
+    monkeypatch.setenv("LLM_LOCAL_TIMEOUT_SECONDS", "45")
+    monkeypatch.setenv("LOCAL_MODEL_NAME", "mistral")
+
+    router = ProviderRouter.from_env("gemini-2.5-pro")
+
+    assert [(p.name, p.model) for p in router.providers] == [
+        ("gcp", "gemini-2.5-pro"),
+        ("local", "mistral"),
+    ]
+    assert router.providers[1].timeout == 45
+    assert router.hedge is False
+
+
+@pytest.mark.anyio
+async def test_fails_over_to_the_next_provider():
+    calls = []
+
+    async def call(spec):
+        calls.append(spec.name)
+        if spec.name == "gcp":
+            raise RuntimeError("quota exceeded")
+        return "local answer"
+
+    answer = await ProviderRouter([GCP, LOCAL]).generate(call)
+
+    assert answer == "local answer"
+    assert calls == ["gcp", "local"]
+    snapshot = providers_snapshot()
+    assert snapshot["gcp"]["failures"] == 1
+    assert snapshot["local"]["successes"] == 1
+
+
+@pytest.mark.anyio
+async def test_timeout_counts_as_a_failure_and_fails_over():
+    slow = ProviderSpec("gcp", "gemini-2.5-flash", timeout=0.01)
+
+    async def call(spec):
+        if spec.name == "gcp":
+            await asyncio.sleep(1)
+        return spec.name
+
+    assert await ProviderRouter([slow, LOCAL]).generate(call) == "local"
+    assert provider_health("gcp").timeouts == 1
+
+
+@pytest.mark.anyio
+async def test_raises_when_every_provider_fails():
+    async def call(spec):
+        raise RuntimeError(f"{spec.name} down")
+
+    with pytest.raises(ProvidersUnavailableError, match="gcp down.*local down"):
+        await ProviderRouter([GCP, LOCAL]).generate(call)
+
+
+@pytest.mark.anyio
+async def test_open_breaker_skips_the_provider(monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURES", "2")
+    calls = []
+
+    async def failing(spec):
+        calls.append(spec.name)
+        raise RuntimeError("boom")
+
+    router = ProviderRouter([GCP])
+    for _ in range(2):
+        with pytest.raises(ProvidersUnavailableError):
+            await router.generate(failing)
+
+    assert provider_health("gcp").breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(ProvidersUnavailableError, match="circuit breakers open"):
+        await router.generate(failing)
+    assert calls == ["gcp", "gcp"]
+
+
+def test_breaker_half_opens_after_the_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() is False  # one probe at a time
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_available_does_not_take_the_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+
+    assert breaker.available() is True
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() is True  # the probe is still there for generate
+    assert breaker.available() is False
+
+
+@pytest.mark.anyio
+async def test_check_counts_a_fallback_whose_breaker_may_probe(monkeypatch):
+    monkeypatch.setenv("LLM_BREAKER_FAILURES", "1")
+    monkeypatch.setenv("LLM_BREAKER_RESET_SECONDS", "0")
+    monkeypatch.setenv("LLM_GCP_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("LLM_GCP_MAX_QUEUE", "0")
+    router = ProviderRouter([GCP, LOCAL])
+    provider_health("local").breaker.record_failure()
+    release = asyncio.Event()
+
+    async def hold():
+        async with admission.get_limiter(GCP.name, GCP.model).acquire():
+            await release.wait()
+
+    task = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    router.check()  # local's reset timeout has passed, so it can take the request
+
+    provider_health("local").breaker.allow()
+    with pytest.raises(OverloadedError):
+        router.check()  # its probe is in flight; only the saturated primary is left
+
+    release.set()
+    await task
+
+
+@pytest.mark.anyio
+async def test_overload_everywhere_surfaces_as_overloaded():
+    async def call(spec):
+        raise AssertionError("should not be called")
+
+    for spec in (GCP, LOCAL):
+        limiter = admission.get_limiter(spec.name, spec.model)
+        limiter.config = admission.LimiterConfig(max_concurrency=1, max_queue=0)
+        limiter.limit = 1
+        limiter._in_flight = 1
+
+    with pytest.raises(OverloadedError):
+        await ProviderRouter([GCP, LOCAL]).generate(call)
+    # A full queue is capacity, not ill health.
+    assert provider_health("gcp").breaker.consecutive_failures == 0
+
+
+@pytest.mark.anyio
+async def test_hedge_fires_after_p95_and_cancels_the_loser():
+    for _ in range(HEDGE_MIN_SAMPLES):
+        provider_health("gcp").record_success(0.01)
+    cancelled = []
+
+    async def call(spec):
+        if spec.name == "gcp":
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(spec.name)
+                raise
+            return "slow"
+        return "hedged"
+
+    answer = await ProviderRouter([GCP, LOCAL], hedge=True).generate(call)
+
+    assert answer == "hedged"
+    await asyncio.sleep(0)
+    assert cancelled == ["gcp"]
+    assert provider_health("local").hedges_won == 1
+    assert admission.get_limiter("gcp", GCP.model).in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_no_hedge_without_latency_history():
+    calls = []
+
+    async def call(spec):
+        calls.append(spec.name)
+        await asyncio.sleep(0.01)
+        return spec.name
+
+    assert await ProviderRouter([GCP, LOCAL], hedge=True).generate(call) == "gcp"
+    assert calls == ["gcp"]
+
+
+@pytest.mark.anyio
+async def test_deadline_stops_the_router_without_blaming_the_provider():
+    async def call(spec):
+        await asyncio.sleep(1)
+        return spec.name
+
+    with pytest.raises(DeadlineExceededError):
+        await ProviderRouter([GCP, LOCAL]).generate(call, deadline=Deadline(0.01))
+
+    assert provider_health("gcp").failures == 0
+    assert "local" not in providers_snapshot()
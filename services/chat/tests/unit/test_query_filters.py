@@ -0,0 +1,95 @@
+import pytest
+from contoso_chat.query_filters import ProductFilters, parse_query
+
+BRANDS = {"AlpineGear", "MountainStyle", "TrekReady"}
+
+
+@pytest.mark.parametrize(
+    ("query", "min_price", "max_price"),
+    [
+        ("tents under $200", None, 200.0),
+        ("boots below 150 dollars", None, 150.0),
+        ("stoves over $80", 80.0, None),
+        ("jackets between $50 and $120", 50.0, 120.0),
+        ("backpacks $1,000-$1,500", 1000.0, 1500.0),
+        ("tents priced under 200", None, 200.0),
+        ("boots that cost at least 90", 90.0, None),
+        ("jackets between 50 and 120 dollars", 50.0, 120.0),
+        ("stoves with a price between 40 and 60", 40.0, 60.0),
+    ],
+)
+def test_price_constraints(query, min_price, max_price):
+    filters = parse_query(query, BRANDS).filters
+
+    assert (filters.min_price, filters.max_price) == (min_price, max_price)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "a tent for under 4 people",
+        "sleeps more than 2 persons",
+        "up to 3 season",
+        "a stove with at least 3 burners",
+        "a backpack with more than 2 pockets",
+        "tents under 200",
+    ],
+)
+def test_capacities_and_units_are_not_prices(query):
+    filters = parse_query(query, BRANDS).filters
+
+    assert filters.min_price is None
+    assert filters.max_price is None
+
+
+def test_a_number_that_is_not_a_price_stays_in_the_search_text():
+    parsed = parse_query("a stove with at least 3 burners", BRANDS, ["Camping Stoves"])
+
+    assert parsed.text == "a stove with at least 3 burners"
+    assert parsed.filters == ProductFilters(categories=("Camping Stoves",))
+
+
+def test_brands_and_categories_come_from_the_vocabulary():
+    parsed = parse_query("Any mountainstyle jackets or trekready boots under $100?", BRANDS)
+
+    assert parsed.filters.brands == ("MountainStyle", "TrekReady")
+    assert parsed.filters.categories == ("Hiking Clothing", "Hiking Footwear")
+    assert parsed.text == "Any mountainstyle jackets or trekready boots ?"
+
+
+def test_unknown_brand_is_ignored_when_the_vocabulary_is_known():
+    assert parse_query("tents from Daybird", BRANDS).filters.brands == ()
+
+
+def test_brand_hint_is_used_without_a_vocabulary():
+    assert parse_query("tents from Daybird").filters.brands == ("Daybird",)
+
+
+def test_categories_outside_the_index_are_not_matched():
+    assert parse_query("best tent", BRANDS, categories={"Backpacks"}).filters.categories == ()
+
+
+def test_plain_question_has_no_filters():
+    parsed = parse_query("what should I bring for a weekend hike?", BRANDS)
+
+    assert not parsed.filters
+    assert parsed.text == "what should I bring for a weekend hike?"
+
+
+def test_filter_rendering():
+    filters = ProductFilters(min_price=50, max_price=100, brands=('Say "hi"',), categories=("Tents",))
+
+    assert filters.chroma_where() == {
+        "$and": [
+            {"price": {"$gte": 50}},
+            {"price": {"$lte": 100}},
+            {"brand": {"$in": ['Say "hi"']}},
+            {"category": {"$in": ["Tents"]}},
+        ]
+    }
+    assert ProductFilters(max_price=10).chroma_where() == {"price": {"$lte": 10}}
+    assert filters.discovery_engine_filter() == (
+        'price >= 50 AND price <= 100 AND brand: ANY("Say \\"hi\\"") AND category: ANY("Tents")'
+    )
+    assert filters.matches({"price": 75, "brand": 'Say "hi"', "category": "Tents"})
+    assert not filters.matches({"price": 175, "brand": 'Say "hi"', "category": "Tents"})
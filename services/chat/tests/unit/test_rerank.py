@@ -0,0 +1,212 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+from contoso_chat.rerank import (
+    EmbeddingScorer,
+    LexicalScorer,
+    RetrievalConfig,
+    adaptive_k,
+    document_text,
+    estimate_tokens,
+    group_passages,
+    rerank,
+    retrieve,
+)
+from contoso_chat.search_service import SearchService
+
+TENT = {"name": "Alpine Explorer Tent", "category": "Tents", "content": "Product: Alpine Explorer Tent"}
+JACKET = {"name": "Summit Breeze Jacket", "category": "Hiking Clothing", "content": "GORE-TEX shell jacket"}
+STOVE = {"name": "PowerBurner Stove", "category": "Camping Stoves", "content": "Compact camping stove"}
+
+
+class FixedScorer:
+    default_min_score = 0.5
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def score(self, query, documents):
+        return self.scores[: len(documents)]
+
+    def vectors(self, documents):
+        return np.eye(len(documents))
+
+
+def test_rerank_orders_by_score_and_drops_irrelevant_candidates():
+    config = RetrievalConfig(max_score_gap=None)
+    kept = rerank("jacket", [TENT, JACKET, STOVE], FixedScorer([0.3, 0.9, 0.6]), config)
+
+    assert kept == [{**JACKET, "score": 0.9}, {**STOVE, "score": 0.6}]
+
+
+def test_rerank_keeps_the_best_candidate_even_below_the_threshold():
+    kept = rerank("kayak", [TENT, JACKET], FixedScorer([0.1, 0.05]), RetrievalConfig())
+
+    assert kept == [{**TENT, "score": 0.1}]
+
+
+def test_rerank_stops_at_the_token_budget_and_max_results():
+    scored = [{**TENT, "score": 0.9}, {**JACKET, "score": 0.8}]
+    budget = estimate_tokens(scored[0]) + estimate_tokens(scored[1])
+    scorer = FixedScorer([0.9, 0.8, 0.7])
+
+    assert rerank("q", [TENT, JACKET, STOVE], scorer, RetrievalConfig(context_tokens=budget)) == scored
+    assert rerank("q", [TENT, JACKET, STOVE], scorer, RetrievalConfig(max_results=1)) == scored[:1]
+
+
+def test_embedding_scorer_batches_and_memoises_document_vectors():
+    vectors = {"tent": [1.0, 0.0], "jacket": [0.0, 1.0], "waterproof jacket?": [0.1, 1.0]}
+    embed = MagicMock(side_effect=lambda texts: [vectors[text] for text in texts])
+    scorer = EmbeddingScorer(embed)
+
+    first = scorer.score("waterproof jacket?", ["tent", "jacket"])
+    scorer.score("waterproof jacket?", ["jacket", "tent"])
+
+    assert first[1] > first[0]
+    # One query embedding per call, documents embedded once in one batch.
+    assert [call.args[0] for call in embed.call_args_list] == [
+        ["waterproof jacket?"],
+        ["tent", "jacket"],
+        ["waterproof jacket?"],
+    ]
+
+
+def test_lexical_scorer_blends_term_matches_with_backend_rank():
+    scores = LexicalScorer().score("gore-tex jacket", [document_text(TENT), document_text(JACKET)])
+
+    assert scores[1] > scores[0]
+
+
+def test_document_text_reads_discovery_engine_struct_data():
+    item = {"id": "product_1", "struct_data": {"name": "Tent", "brand": "AlpineGear", "price": 250}}
+
+    assert document_text(item) == "Tent\nAlpineGear"
+
+
+def test_retrieve_fetches_wide_then_cuts():
+    service = MagicMock()
+    service.search.return_value = [TENT, JACKET, STOVE]
+
+    kept = retrieve(service, "gore-tex jacket", RetrievalConfig(candidates=30, max_results=2))
+
+    service.search.assert_called_once_with("gore-tex jacket", limit=30)
+    assert kept[0]["name"] == JACKET["name"]
+    assert len(kept) <= 2
+
+
+def test_retrieve_single_stage_applies_adaptive_k_to_search_scores():
+    service = MagicMock()
+    service.search.return_value = [{**TENT, "score": 0.82}, {**JACKET, "score": 0.41}, STOVE]
+
+    kept = retrieve(service, "tent", RetrievalConfig(enabled=False))
+
+    service.search.assert_called_once_with("tent", limit=5)
+    # The jacket trails the best hit by more than the gap; the stove has no
+    # score to judge it by, so it stays.
+    assert [item["name"] for item in kept] == [TENT["name"], STOVE["name"]]
+
+
+def test_adaptive_k_thresholds_gap_and_bounds():
+    scored = [(0.9, "a"), (0.85, "b"), (0.5, "c"), (0.2, "d")]
+
+    assert adaptive_k(scored, None, 0.1, 1, 5) == ["a", "b"]
+    assert adaptive_k(scored, 0.6, None, 1, 5) == ["a", "b"]
+    assert adaptive_k(scored, 0.95, None, 1, 5) == ["a"]
+    assert adaptive_k(scored, 0.95, None, 3, 5) == ["a", "b", "c"]
+    assert adaptive_k(scored, None, None, 1, 2) == ["a", "b"]
+
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("RETRIEVAL_CANDIDATES", "50")
+    monkeypatch.setenv("RETRIEVAL_MIN_SCORE", "0.4")
+    monkeypatch.setenv("RETRIEVAL_RERANK", "0")
+
+    monkeypatch.setenv("RETRIEVAL_MAX_SCORE_GAP", "")
+
+    monkeypatch.setenv("RETRIEVAL_DIVERSITY", "0.5")
+
+    assert RetrievalConfig.from_env() == RetrievalConfig(
+        enabled=False, candidates=50, max_results=5, min_score=0.4, max_score_gap=None, diversity=0.5
+    )
+
+
+def test_rerank_diversifies_near_duplicate_variants():
+    variants = [
+        {"name": "Alpine Explorer Tent 2P", "content": "Alpine Explorer Tent waterproof two person"},
+        {"name": "Alpine Explorer Tent 3P", "content": "Alpine Explorer Tent waterproof three person"},
+        {"name": "TrailMaster Tent", "content": "TrailMaster lightweight backpacking tent"},
+    ]
+    scorer = FixedScorer([0.9, 0.89, 0.8])
+    scorer.vectors = lambda documents: np.array([[1.0, 0.0], [0.99, 0.05], [0.2, 1.0]])
+
+    plain = rerank("tent", variants, scorer, RetrievalConfig(max_results=2, diversity=0))
+    diverse = rerank("tent", variants, scorer, RetrievalConfig(max_results=2, diversity=0.5))
+
+    assert [item["name"] for item in plain] == ["Alpine Explorer Tent 2P", "Alpine Explorer Tent 3P"]
+    assert [item["name"] for item in diverse] == ["Alpine Explorer Tent 2P", "TrailMaster Tent"]
+
+
+def test_embedding_scorer_vectors_are_unit_rows():
+    scorer = EmbeddingScorer(lambda texts: [[3.0, 4.0] for _ in texts])
+
+    assert np.allclose(scorer.vectors(["a", "b"]), [[0.6, 0.8], [0.6, 0.8]])
+
+
+def passage(parent, text, score, **extra):
+    return {"parent": parent, "title": f"{parent} manual", "name": parent, "text": text, "score": score, **extra}
+
+
+def test_group_passages_caps_parents_and_chunks_and_drops_weak_hits():
+    passages = [
+        passage("tent", "Stake the corners.", 0.8),
+        passage("tent", "Dry before storing.", 0.7),
+        passage("tent", "Replace the poles.", 0.6),
+        passage("stove", "Prime the burner.", 0.5),
+        passage("jacket", "Wash cold.", 0.45),
+        passage("boots", "Too weak.", 0.1),
+    ]
+
+    groups = group_passages(passages, RetrievalConfig(manual_products=2, manual_chunks_per_product=2))
+
+    assert groups == [
+        {"manual": "tent manual", "product": "tent", "passages": ["Stake the corners.", "Dry before storing."], "score": 0.8},
+        {"manual": "stove manual", "product": "stove", "passages": ["Prime the burner."], "score": 0.5},
+    ]
+
+
+def test_retrieve_appends_manual_passages_after_products():
+    service = MagicMock(spec=SearchService)
+    service.search.return_value = [{**TENT, "score": 0.9}]
+    service.search_manuals.return_value = [passage("tent", "Stake the corners.", 0.8)]
+
+    kept = retrieve(service, "how do I pitch the tent", RetrievalConfig(enabled=False, manual_candidates=7))
+
+    service.search_manuals.assert_called_once_with("how do I pitch the tent", limit=7)
+    assert kept[0]["name"] == TENT["name"]
+    assert kept[1]["passages"] == ["Stake the corners."]
+
+
+def test_retrieve_ignores_manual_search_failures():
+    service = MagicMock(spec=SearchService)
+    service.search.return_value = [{**TENT, "score": 0.9}]
+    service.search_manuals.side_effect = RuntimeError("no manuals collection")
+
+    assert retrieve(service, "tent", RetrievalConfig(enabled=False)) == [{**TENT, "score": 0.9}]
+
+
+def test_embedding_scorer_reads_indexed_vectors_instead_of_embedding():
+    embed = MagicMock(side_effect=lambda texts: [[0.0, 1.0] for _ in texts])
+    known = {"tent": np.array([1.0, 0.0])}
+    scorer = EmbeddingScorer(embed, known=known.get)
+
+    assert scorer.vectors(["tent", "stove"]).tolist() == [[1.0, 0.0], [0.0, 1.0]]
+    embed.assert_called_once_with(["stove"])
+
+
+def test_embedding_scorer_uses_a_query_vector_embedded_ahead():
+    embed = MagicMock(side_effect=lambda texts: [[1.0, 0.0] for _ in texts])
+    primed = {"tent?": np.asarray([0.0, 2.0], dtype=np.float32)}
+    scorer = EmbeddingScorer(embed, known_query=primed.get)
+
+    assert scorer.score("tent?", ["tent"]) == [0.0]
+    embed.assert_called_once_with(["tent"])
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import numpy as np
+import orjson
+import pytest
+from contoso_chat.responses import OrjsonResponse, context_mode, shape_context
+
+
+def test_orjson_response_encodes_datetimes_and_numpy_scalars():
+    response = OrjsonResponse({"at": datetime(2026, 1, 2, 10, 30), "score": np.float32(0.5)})
+
+    assert orjson.loads(response.body) == {"at": "2026-01-02T10:30:00", "score": 0.5}
+
+
+def test_ids_keep_only_identifying_fields():
+    context = [{"id": "p1", "name": "Tent", "description": "Long text", "price": 10.0, "score": 0.9}, "raw"]
+
+    assert shape_context(context, "ids") == [{"id": "p1", "name": "Tent", "score": 0.9}, "raw"]
+    assert shape_context(context, "full") == context
+    assert shape_context(context, "none") is None
+
+
+def test_context_mode_prefers_the_request(monkeypatch):
+    monkeypatch.setenv("CHAT_RESPONSE_CONTEXT", "ids")
+
+    assert context_mode("none") == "none"
+    assert context_mode(None) == "ids"
+    monkeypatch.delenv("CHAT_RESPONSE_CONTEXT")
+    assert context_mode(None) == "full"
+
+
+def test_context_mode_rejects_unknown_environment_values(monkeypatch):
+    monkeypatch.setenv("CHAT_RESPONSE_CONTEXT", "everything")
+
+    with pytest.raises(ValueError, match="CHAT_RESPONSE_CONTEXT"):
+        context_mode(None)
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from contoso_chat.admission import ConcurrencyLimiter, LimiterConfig, OverloadedError
+from contoso_chat.scheduling import (
+    BATCH,
+    INTERACTIVE,
+    Priority,
+    WeightedFairQueue,
+    membership_tier,
+    traffic_class,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_membership_tier_maps_known_tiers_and_defaults_to_base():
+    assert membership_tier({"membership": "Platinum"}) == "platinum"
+    assert membership_tier({"membership": "Gold"}) == "gold"
+    assert membership_tier({"membership": "nan"}) == "base"
+    assert membership_tier(None) == "base"
+
+
+def test_traffic_class_defaults_to_interactive():
+    assert traffic_class("BATCH") == BATCH
+    assert traffic_class("bogus") == INTERACTIVE
+    assert traffic_class(None) == INTERACTIVE
+
+
+def test_weights_combine_class_and_tier(monkeypatch):
+    monkeypatch.setenv("SCHEDULER_TIER_WEIGHTS", "platinum=10")
+
+    assert Priority(INTERACTIVE, "platinum").weight == 80
+    assert Priority(BATCH, "base").weight == 1
+
+
+@pytest.mark.anyio
+async def test_single_class_is_served_in_arrival_order():
+    queue = WeightedFairQueue(max_wait=60)
+    loop = asyncio.get_running_loop()
+    waiters = [loop.create_future() for _ in range(3)]
+    for waiter in waiters:
+        queue.push(waiter, Priority())
+
+    assert [queue.pop() for _ in range(3)] == waiters
+    assert queue.pop() is None
+
+
+@pytest.mark.anyio
+async def test_interactive_overtakes_queued_batch_work():
+    queue = WeightedFairQueue(max_wait=60)
+    loop = asyncio.get_running_loop()
+    batch = [loop.create_future() for _ in range(4)]
+    for waiter in batch:
+        queue.push(waiter, Priority(BATCH))
+    shopper = loop.create_future()
+    queue.push(shopper, Priority(INTERACTIVE))
+
+    assert queue.pop() is shopper
+    assert queue.pop() is batch[0]
+
+
+@pytest.mark.anyio
+async def test_share_under_contention_follows_weights():
+    queue = WeightedFairQueue(max_wait=60)
+    loop = asyncio.get_running_loop()
+    gold = Priority(INTERACTIVE, "gold")
+    base = Priority(INTERACTIVE, "base")
+    owners = {}
+    for _ in range(30):
+        for priority in (gold, base):
+            waiter = loop.create_future()
+            owners[waiter] = priority.key
+            queue.push(waiter, priority)
+
+    served = [owners[queue.pop()] for _ in range(15)]
+
+    assert served.count(gold.key) == 10
+    assert served.count(base.key) == 5
+
+
+@pytest.mark.anyio
+async def test_starved_waiters_are_served_first():
+    queue = WeightedFairQueue(max_wait=0.0)
+    loop = asyncio.get_running_loop()
+    batch = loop.create_future()
+    queue.push(batch, Priority(BATCH))
+    shopper = loop.create_future()
+    queue.push(shopper, Priority(INTERACTIVE, "platinum"))
+
+    assert queue.pop() is batch
+
+
+@pytest.mark.anyio
+async def test_full_queue_sheds_batch_work_for_a_shopper():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1, max_queue=1))
+    release = asyncio.Event()
+
+    async def hold(priority):
+        async with limiter.acquire(priority):
+            await release.wait()
+
+    running = asyncio.create_task(hold(Priority(BATCH)))
+    await asyncio.sleep(0)
+    queued_batch = asyncio.create_task(hold(Priority(BATCH)))
+    await asyncio.sleep(0)
+
+    shopper = asyncio.create_task(hold(Priority(INTERACTIVE, "gold")))
+    await asyncio.sleep(0)
+
+    with pytest.raises(OverloadedError):
+        await queued_batch
+
+    release.set()
+    await asyncio.gather(running, shopper)
+
+    classes = limiter.snapshot()["classes"]
+    assert classes["batch:base"]["shed"] == 1
+    assert classes["interactive:gold"]["admitted"] == 1
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_full_queue_still_rejects_equal_priority():
+    limiter = ConcurrencyLimiter("test", LimiterConfig(max_concurrency=1, max_queue=1))
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire(Priority()):
+            await release.wait()
+
+    tasks = [asyncio.create_task(hold()) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(OverloadedError):
+        limiter.check(Priority())
+
+    release.set()
+    await asyncio.gather(*tasks)
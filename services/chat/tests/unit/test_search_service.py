@@ -1,9 +1,24 @@
+import json
 from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import contoso_chat.rerank as rerank
 import contoso_chat.search_service as search_service
+import numpy as np
 import pytest
-from contoso_chat.search_service import LocalVectorSearch, VertexAISearch, get_search_service
+from contoso_chat.search_service import (
+    LocalVectorSearch,
+    MappedVectorSearch,
+    VertexAISearch,
+    get_search_service,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_service_cache():
+    search_service.reset_search_services()
+    yield
+    search_service.reset_search_services()
 
 
 def test_local_vector_search_formats_results():
@@ -41,9 +56,13 @@ def test_local_vector_search_returns_empty_on_init_error():
     assert service.search("anything") == []
 
 
+def _document(doc_id: str, **fields):
+    return SimpleNamespace(id=doc_id, name=f"documents/{doc_id}", struct_data=fields)
+
+
 def test_vertex_ai_search_returns_document_dicts():
     mock_client = MagicMock()
-    mock_client.search.return_value = SimpleNamespace(results=[SimpleNamespace(document="doc-1")])
+    mock_client.search.return_value = SimpleNamespace(results=[SimpleNamespace(document=_document("doc-1"))])
 
     with patch(
         "contoso_chat.search_service.discoveryengine.SearchServiceClient",
@@ -53,7 +72,6 @@ def test_vertex_ai_search_returns_document_dicts():
         side_effect=lambda **kwargs: kwargs,
     ) as mock_request, patch(
         "contoso_chat.search_service.discoveryengine.Document.to_dict",
-        return_value={"id": "doc-1"},
     ) as mock_to_dict:
         service = VertexAISearch("project-1", "us-central1", "search-app-1")
         results = service.search("tent", limit=2)
@@ -63,8 +81,48 @@ def test_vertex_ai_search_returns_document_dicts():
         serving_config=service.serving_config,
         query="tent",
         page_size=2,
+        filter='category: ANY("Tents")',
+    )
+    mock_to_dict.assert_not_called()
+
+
+def test_vertex_ai_search_projects_the_prompt_fields():
+    document = _document(
+        "product_1",
+        id="1",
+        name="TrailMaster X4 Tent",
+        price=250.0,
+        category="Tents",
+        brand="OutdoorLiving",
+        description="A roomy four-person tent.",
+        url="/products/trailmaster-x4-tent",
+        content="A roomy four-person tent.",
+        embedding=[0.1, 0.2],
     )
-    mock_to_dict.assert_called_once_with("doc-1")
+    mock_client = MagicMock()
+    mock_client.search.return_value = SimpleNamespace(results=[SimpleNamespace(document=document)])
+
+    with patch(
+        "contoso_chat.search_service.discoveryengine.SearchServiceClient",
+        return_value=mock_client,
+    ), patch(
+        "contoso_chat.search_service.discoveryengine.SearchRequest",
+        side_effect=lambda **kwargs: kwargs,
+    ):
+        service = VertexAISearch("project-1", "us-central1", "search-app-1")
+        results = service.search("roomy tent", limit=1)
+
+    assert results == [
+        {
+            "id": "1",
+            "name": "TrailMaster X4 Tent",
+            "price": 250.0,
+            "category": "Tents",
+            "brand": "OutdoorLiving",
+            "description": "A roomy four-person tent.",
+            "url": "/products/trailmaster-x4-tent",
+        }
+    ]
 
 
 def test_vertex_ai_search_returns_empty_on_error():
@@ -138,3 +196,390 @@ def test_get_search_service_returns_vertex_provider():
 
     assert result is vertex_service
     mock_vertex.assert_called_once_with("project-1", "us-central1", "search-app-1")
+
+
+def test_get_search_service_reuses_the_built_service():
+    with patch.dict(
+        "os.environ",
+        {
+            "LLM_PROVIDER": "gcp",
+            "PROJECT_ID": "project-1",
+            "REGION": "us-central1",
+            "DISCOVERY_ENGINE_DATASTORE_ID": "search-app-1",
+        },
+        clear=True,
+    ), patch("contoso_chat.search_service.VertexAISearch", side_effect=lambda *a: object()) as mock_vertex:
+        first = get_search_service()
+        second = get_search_service()
+
+    assert first is second
+    mock_vertex.assert_called_once()
+
+
+def test_get_search_service_does_not_cache_a_missing_local_index():
+    unbuilt = SimpleNamespace(collection=None)
+    with patch.dict("os.environ", {"LLM_PROVIDER": "local"}, clear=True), patch(
+        "contoso_chat.search_service.LocalVectorSearch", return_value=unbuilt
+    ) as mock_local:
+        get_search_service()
+        get_search_service()
+
+    assert mock_local.call_count == 2
+
+
+def test_provider_sdks_are_not_imported_with_the_module():
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    api_dir = Path(__file__).resolve().parents[2] / "src" / "api"
+    probe = (
+        "import sys, contoso_chat.search_service, contoso_chat.chat_request; "
+        "print(sorted(m for m in ('chromadb', 'google.cloud.discoveryengine_v1alpha', "
+        "'vertexai', 'httpx2') if m in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", probe], cwd=api_dir, capture_output=True, text=True, check=True
+    )
+
+    assert completed.stdout.strip() == "[]"
+
+
+def _hybrid_collection():
+    collection = MagicMock()
+    collection.get.return_value = {
+        "ids": ["p1", "p2", "p3"],
+        "documents": [
+            "Product: Alpine Explorer Tent",
+            "Product: Summit Breeze Jacket\nDescription: GORE-TEX shell",
+            "Product: TrekReady Hiking Boots",
+        ],
+        "metadatas": [{"name": "Tent"}, {"name": "Jacket"}, {"name": "Boots"}],
+    }
+    return collection
+
+
+def test_hybrid_search_promotes_exact_term_matches():
+    collection = _hybrid_collection()
+    # The embedding model ranks the jacket last for its own brand term.
+    collection.query.return_value = {"ids": [["p1", "p3", "p2"]]}
+    client = MagicMock()
+    client.get_collection.return_value = collection
+
+    with patch("contoso_chat.search_service.chromadb.PersistentClient", return_value=client), patch(
+        "contoso_chat.search_service.embedding_functions.DefaultEmbeddingFunction",
+        return_value="embedding-fn",
+    ):
+        service = search_service.HybridSearch()
+
+    results = service.search("gore-tex", limit=2)
+
+    assert [item["name"] for item in results] == ["Jacket", "Tent"]
+    assert results[0]["content"].endswith("GORE-TEX shell")
+    collection.query.assert_called_once_with(query_texts=["gore-tex"], n_results=3)
+
+
+def test_get_search_service_selects_hybrid_backend():
+    with patch.dict(
+        "os.environ", {"LLM_PROVIDER": "local", "SEARCH_BACKEND": "hybrid"}, clear=True
+    ), patch("contoso_chat.search_service.HybridSearch", return_value="hybrid") as mock_hybrid:
+        assert get_search_service() == "hybrid"
+    mock_hybrid.assert_called_once_with()
+
+
+def test_get_search_service_rejects_unknown_backend():
+    with patch.dict("os.environ", {"LLM_PROVIDER": "local", "SEARCH_BACKEND": "bm42"}, clear=True):
+        with pytest.raises(ValueError, match="Unknown SEARCH_BACKEND"):
+            get_search_service()
+
+
+def _local_service(collection):
+    client = MagicMock()
+    client.get_collection.return_value = collection
+    with patch("contoso_chat.search_service.chromadb.PersistentClient", return_value=client), patch(
+        "contoso_chat.search_service.embedding_functions.DefaultEmbeddingFunction",
+        return_value="embedding-fn",
+    ):
+        return LocalVectorSearch()
+
+
+def test_local_vector_search_pushes_filters_into_chroma_where():
+    collection = MagicMock()
+    collection.get.return_value = {
+        "metadatas": [
+            {"brand": "AlpineGear", "category": "Tents"},
+            {"brand": "MountainStyle", "category": "Hiking Clothing"},
+        ]
+    }
+    collection.query.return_value = {
+        "ids": [["p1"]],
+        "metadatas": [[{"name": "Alpine Explorer Tent"}]],
+        "documents": [["Product: Alpine Explorer Tent"]],
+    }
+    service = _local_service(collection)
+
+    results = service.search("AlpineGear tents under $200", limit=3)
+
+    assert [item["name"] for item in results] == ["Alpine Explorer Tent"]
+    collection.query.assert_called_once_with(
+        query_texts=["AlpineGear tents"],
+        n_results=3,
+        where={
+            "$and": [
+                {"price": {"$lte": 200.0}},
+                {"brand": {"$in": ["AlpineGear"]}},
+                {"category": {"$in": ["Tents"]}},
+            ]
+        },
+    )
+
+
+def test_local_vector_search_falls_back_when_nothing_matches_the_filters():
+    collection = MagicMock()
+    collection.get.return_value = {"metadatas": [{"brand": "AlpineGear", "category": "Tents"}]}
+    collection.query.side_effect = [
+        {"ids": [[]], "metadatas": [[]], "documents": [[]]},
+        {"ids": [["p1"]], "metadatas": [[{"name": "Tent"}]], "documents": [["Tent"]]},
+    ]
+    service = _local_service(collection)
+
+    results = service.search("tents under $20", limit=3)
+
+    assert [item["name"] for item in results] == ["Tent"]
+    assert collection.query.call_args_list[1].kwargs == {
+        "query_texts": ["tents under $20"],
+        "n_results": 3,
+    }
+
+
+def test_hybrid_search_ranks_only_products_that_pass_the_filters():
+    collection = _hybrid_collection()
+    collection.get.return_value["metadatas"] = [
+        {"name": "Tent", "category": "Tents", "price": 250.0},
+        {"name": "Jacket", "category": "Hiking Clothing", "price": 120.0},
+        {"name": "Boots", "category": "Hiking Footwear", "price": 110.0},
+    ]
+    collection.query.return_value = {"ids": [["p2"]]}
+    client = MagicMock()
+    client.get_collection.return_value = collection
+
+    with patch("contoso_chat.search_service.chromadb.PersistentClient", return_value=client), patch(
+        "contoso_chat.search_service.embedding_functions.DefaultEmbeddingFunction",
+        return_value="embedding-fn",
+    ):
+        service = search_service.HybridSearch()
+
+    results = service.search("gore-tex jacket under $150", limit=2)
+
+    assert [item["name"] for item in results] == ["Jacket"]
+    collection.query.assert_called_once_with(
+        query_texts=["gore-tex jacket"],
+        n_results=1,
+        where={"$and": [{"price": {"$lte": 150.0}}, {"category": {"$in": ["Hiking Clothing"]}}]},
+    )
+
+
+def test_vertex_ai_search_retries_without_a_rejected_filter():
+    mock_client = MagicMock()
+    mock_client.search.side_effect = [
+        RuntimeError("field price is not filterable"),
+        SimpleNamespace(results=[SimpleNamespace(document=_document("doc-1"))]),
+    ]
+
+    with patch(
+        "contoso_chat.search_service.discoveryengine.SearchServiceClient",
+        return_value=mock_client,
+    ), patch(
+        "contoso_chat.search_service.discoveryengine.SearchRequest",
+        side_effect=lambda **kwargs: kwargs,
+    ) as mock_request:
+        service = VertexAISearch("project-1", "us-central1", "search-app-1")
+        results = service.search("tents under $200 from Daybird", limit=5)
+
+    assert results == [{"id": "doc-1"}]
+    first, second = (call.kwargs for call in mock_request.call_args_list)
+    assert first["query"] == "tents from Daybird"
+    assert first["filter"] == 'price <= 200 AND brand: ANY("Daybird") AND category: ANY("Tents")'
+    assert second["query"] == "tents under $200 from Daybird"
+    assert "filter" not in second
+
+
+def test_local_vector_search_returns_similarity_scores():
+    collection = MagicMock()
+    collection.metadata = None
+    collection.query.return_value = {
+        "ids": [["p1", "p2"]],
+        "metadatas": [[{"name": "Tent"}, {"name": "Stove"}]],
+        "documents": [["Tent", "Stove"]],
+        "distances": [[0.4, 1.5]],
+    }
+    service = _local_service(collection)
+
+    results = service.search("roomy tent", limit=2)
+
+    # Squared L2 between unit vectors is 2 - 2cos.
+    assert [item["score"] for item in results] == [0.8, 0.25]
+
+
+def test_similarity_follows_the_collection_distance_space():
+    collection = MagicMock()
+    collection.metadata = {"hnsw:space": "cosine"}
+    service = _local_service(collection)
+
+    assert service.similarity(0.3) == 0.7
+    assert service.similarity(1.4) == 0.0
+
+
+def test_vertex_ai_search_surfaces_relevance_scores():
+    mock_client = MagicMock()
+    mock_client.search.return_value = SimpleNamespace(
+        results=[
+            SimpleNamespace(
+                document=_document("doc-1"),
+                model_scores={"relevance_score": SimpleNamespace(values=[0.734567])},
+            )
+        ]
+    )
+
+    with patch(
+        "contoso_chat.search_service.discoveryengine.SearchServiceClient",
+        return_value=mock_client,
+    ), patch(
+        "contoso_chat.search_service.discoveryengine.SearchRequest",
+    ) as mock_request, patch.dict("os.environ", {"VERTEX_SEARCH_RELEVANCE_THRESHOLD": "medium"}):
+        service = VertexAISearch("project-1", "us-central1", "search-app-1")
+        results = service.search("what should I pack?", limit=5)
+
+    assert results == [{"id": "doc-1", "score": 0.7346}]
+    assert mock_request.call_args.kwargs["relevance_threshold"] is mock_request.RelevanceThreshold.__getitem__.return_value
+    mock_request.RelevanceThreshold.__getitem__.assert_called_once_with("MEDIUM")
+
+
+def test_local_vector_search_returns_manual_passages():
+    products = MagicMock()
+    products.metadata = None
+    manuals = MagicMock()
+    manuals.query.return_value = {
+        "metadatas": [[{"parent": "product-1", "section": "Tent > Setup"}]],
+        "documents": [["Stake the corners first."]],
+        "distances": [[0.6]],
+    }
+    service = _local_service(products)
+    service.client.get_collection.side_effect = lambda name, embedding_function: manuals
+
+    passages = service.search_manuals("how do I pitch it", limit=4)
+
+    assert passages == [
+        {"parent": "product-1", "section": "Tent > Setup", "text": "Stake the corners first.", "score": 0.7}
+    ]
+    manuals.query.assert_called_once_with(query_texts=["how do I pitch it"], n_results=4)
+
+
+def test_local_vector_search_without_a_manuals_collection_returns_no_passages():
+    service = _local_service(MagicMock())
+    service.client.get_collection.side_effect = ValueError("Collection manuals does not exist")
+
+    assert service.search_manuals("how do I pitch it") == []
+
+
+def _mapped_service(tmp_path, monkeypatch):
+    tents = [{"name": "Tent", "brand": "AlpineGear", "category": "Tents", "price": 250.0},
+             {"name": "Trail Tent", "brand": "Daybird", "category": "Tents", "price": 120.0}]
+    stove = {"name": "Stove", "brand": "Daybird", "category": "Camping Stoves", "price": 60.0}
+    np.save(tmp_path / "products.npy", np.asarray([[1, 0], [0.8, 0.6], [0, 1]], dtype=np.float32))
+    (tmp_path / "products.json").write_text(
+        json.dumps({"ids": ["p1", "p2", "p3"], "metadatas": [*tents, stove], "documents": ["t1", "t2", "s"]}),
+        encoding="utf-8",
+    )
+    monkeypatch.setenv("EMBEDDING_STORE_PATH", str(tmp_path))
+    with patch(
+        "contoso_chat.search_service.embedding_functions.DefaultEmbeddingFunction",
+        return_value=lambda texts: [[1.0, 0.0] for _ in texts],
+    ):
+        return MappedVectorSearch()
+
+
+def test_mapped_vector_search_reads_the_store_with_filters(tmp_path, monkeypatch):
+    service = _mapped_service(tmp_path, monkeypatch)
+
+    assert [item["name"] for item in service.search("tent", limit=2)] == ["Tent", "Trail Tent"]
+    cheap = service.search("tent under $200", limit=2)
+    assert [(item["name"], item["content"], item["score"]) for item in cheap] == [("Trail Tent", "t2", 0.8)]
+    # Nothing matches: the whole catalogue is ranked instead.
+    assert len(service.search("tents under $10", limit=3)) == 3
+    assert service.document_vector("Stove\nCamping Stoves\nDaybird\ns").tolist() == [0.0, 1.0]
+    assert service.document_vector("s") is None
+
+
+def test_rerank_reads_mapped_vectors_instead_of_embedding_candidates(tmp_path, monkeypatch):
+    service = _mapped_service(tmp_path, monkeypatch)
+    service.ef = MagicMock(side_effect=lambda texts: [[1.0, 0.0] for _ in texts])
+    service.query_vectors.embed = service.ef
+    monkeypatch.setattr(rerank, "_embedding_scorers", {})
+
+    results = rerank.retrieve(service, "tent", rerank.RetrievalConfig(max_score_gap=None))
+
+    assert [item["name"] for item in results] == ["Tent", "Trail Tent"]
+    # Only the question is embedded; every candidate's vector comes from the store.
+    assert [call.args[0] for call in service.ef.call_args_list] == [["tent"], ["tent"]]
+
+
+def test_mapped_vector_search_without_a_store_is_empty_and_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_STORE_PATH", str(tmp_path / "missing"))
+    with patch.dict("os.environ", {"LLM_PROVIDER": "local", "SEARCH_BACKEND": "mapped"}), patch(
+        "contoso_chat.search_service.embedding_functions.DefaultEmbeddingFunction",
+        return_value=lambda texts: [[1.0, 0.0] for _ in texts],
+    ):
+        service = get_search_service()
+        assert isinstance(service, MappedVectorSearch)
+        assert service.search("tent") == []
+        assert service.search_manuals("tent") == []
+        assert get_search_service() is not service
+
+
+def test_embedding_store_defaults_next_to_chroma(monkeypatch):
+    monkeypatch.delenv("EMBEDDING_STORE_PATH", raising=False)
+    monkeypatch.setenv("CHROMA_DB_PATH", "/data/chroma_db/")
+
+    assert search_service.embedding_store_path() == "/data/embeddings"
+
+
+def test_local_vector_search_prepare_embeds_the_batch_in_one_call():
+    collection = MagicMock()
+    collection.get.return_value = {"metadatas": [{"brand": "AlpineGear", "category": "Tents"}]}
+    collection.query.return_value = {"ids": [["p1"]], "metadatas": [[{"name": "Tent"}]], "documents": [["Tent"]]}
+    service = _local_service(collection)
+    embed = MagicMock(side_effect=lambda texts: [[float(len(text)), 1.0] for text in texts])
+    service.query_vectors.embed = embed
+
+    service.prepare(["best tent", "AlpineGear tents", "best tent"])
+    service.search("best tent", limit=3)
+    service.search("something else", limit=3)
+
+    embed.assert_called_once_with(["best tent", "AlpineGear tents"])
+    assert collection.query.call_args_list[0].kwargs["query_embeddings"] == [[9.0, 1.0]]
+    # Not part of the batch: Chroma embeds it as before.
+    assert collection.query.call_args_list[1].kwargs == {"query_texts": ["something else"], "n_results": 3}
+
+
+def test_mapped_vector_search_uses_prepared_query_vectors(tmp_path, monkeypatch):
+    service = _mapped_service(tmp_path, monkeypatch)
+    calls = []
+    service.query_vectors.embed = lambda texts: calls.append(list(texts)) or [[0.0, 1.0] for _ in texts]
+
+    service.prepare(["stove", "tent"])
+    results = service.search("stove", limit=1)
+
+    assert calls == [["stove", "tent"]]
+    assert [item["name"] for item in results] == ["Stove"]
+
+
+def test_query_vectors_keep_the_most_recently_used():
+    vectors = search_service.QueryVectors(lambda texts: [[1.0] for _ in texts], size=2)
+
+    vectors.prime(["a", "b"])
+    vectors.get("a")
+    vectors.prime(["c"])
+
+    assert vectors.get("a") is not None
+    assert vectors.get("b") is None
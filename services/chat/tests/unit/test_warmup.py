@@ -0,0 +1,35 @@
+from unittest.mock import patch
+
+from contoso_chat import search_service, warmup
+
+
+def test_configured_providers_include_fallbacks(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "gcp")
+    monkeypatch.setenv("LLM_FALLBACK_PROVIDERS", "local")
+
+    assert warmup.configured_providers() == ["gcp", "local"]
+
+
+def test_warm_up_imports_only_the_configured_providers_modules():
+    imported = []
+
+    with patch.object(warmup, "import_module", side_effect=imported.append), patch.object(search_service, "get_search_service") as mock_get_search_service:
+        report = warmup.warm_up(["local"])
+
+    assert imported == list(warmup.PROVIDER_MODULES["local"])
+    mock_get_search_service.assert_called_once_with()
+    assert set(report["steps"]) == {
+        *(f"import {module}" for module in warmup.PROVIDER_MODULES["local"]),
+        "search service",
+    }
+    assert report["rss_mb_after"] > 0
+
+
+def test_warm_up_reports_failures_instead_of_raising():
+    with patch.object(
+        warmup, "import_module", side_effect=ImportError("no module named httpx2")
+    ), patch.object(search_service, "get_search_service", side_effect=ValueError("not configured")):
+        report = warmup.warm_up(["local"])
+
+    assert "ImportError" in report["steps"]["import httpx2"]["error"]
+    assert "ValueError" in report["steps"]["search service"]["error"]
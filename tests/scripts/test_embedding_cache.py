@@ -0,0 +1,75 @@
+"""The indexers' on-disk embedding cache (infrastructure/scripts/embedding_cache.py)."""
+
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SCRIPT = REPO_ROOT / "infrastructure/scripts/embedding_cache.py"
+
+spec = importlib.util.spec_from_file_location("embedding_cache", SCRIPT)
+embedding_cache = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(embedding_cache)
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class EmbeddingCacheTests(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = temp_dir.name
+
+    def test_only_misses_reach_the_model_and_survive_a_restart(self):
+        model = CountingModel()
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+        first = cache.embed(["tent", "stove", "tent"], model)
+        self.assertEqual([vector.tolist() for vector in first], [[4.0, 1.0], [5.0, 1.0], [4.0, 1.0]])
+
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+        again = cache.embed(["stove", "boots"], model)
+
+        self.assertEqual([vector.tolist() for vector in again], [[5.0, 1.0], [5.0, 1.0]])
+        self.assertEqual(model.calls, [["tent", "stove"], ["boots"]])
+        self.assertEqual(cache.stats(), {"model": "model-a", "hits": 1, "misses": 1, "hit_rate": 0.5, "cached": 3})
+
+    def test_a_model_that_drops_vectors_is_named_and_nothing_is_cached(self):
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+
+        with self.assertRaisesRegex(ValueError, "'model-a' returned 1 vectors for 2 texts"):
+            cache.embed(["tent", "stove"], lambda texts: [[1.0, 1.0]])
+        self.assertEqual(len(cache), 0)
+
+    def test_models_do_not_share_vectors(self):
+        model = CountingModel()
+        embedding_cache.EmbeddingCache(self.root, "model-a").embed(["tent"], model)
+        embedding_cache.EmbeddingCache(self.root, "model-b").embed(["tent"], model)
+        self.assertEqual(model.calls, [["tent"], ["tent"]])
+
+    def test_an_interrupted_write_is_ignored_and_overwritten(self):
+        model = CountingModel()
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+        cache.embed(["tent"], model)
+        with open(cache.vectors_path, "ab") as handle:
+            handle.write(b"\x00\x01")
+        with open(cache.index_path, "ab") as handle:
+            handle.write(b"\x02")
+
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+        cache.embed(["stove"], model)
+        cache = embedding_cache.EmbeddingCache(self.root, "model-a")
+
+        self.assertEqual([vector.tolist() for vector in cache.embed(["tent", "stove"], model)], [[4.0, 1.0], [5.0, 1.0]])
+        self.assertEqual(model.calls, [["tent"], ["stove"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
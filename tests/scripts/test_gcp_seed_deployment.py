@@ -6,6 +6,7 @@ import json
 import os
 import re
 import subprocess
+import sys
 import tempfile
 import unittest
 from pathlib import Path
@@ -51,7 +52,10 @@ def load_product_seed_module():
         "vertexai.language_models": language_models,
     }
 
-    with mock.patch.dict("sys.modules", import_stubs):
+    # As when run as a script, its sibling modules are importable.
+    with mock.patch.dict("sys.modules", import_stubs), mock.patch.object(
+        sys, "path", [str(script_path.parent), *sys.path]
+    ):
         spec.loader.exec_module(module)
     return module
 
@@ -268,5 +272,64 @@ class SetupProjectSeedTests(unittest.TestCase):
         self.assertNotIn("Project setup and deployment complete", output)
 
 
+
+class ProductSeederEmbeddingTests(unittest.TestCase):
+    def test_unchanged_descriptions_are_not_embedded_again(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            calls = []
+
+            def get_embeddings(texts):
+                calls.append(list(texts))
+                return [mock.Mock(values=[float(len(text)), 1.0]) for text in texts]
+
+            for _ in range(2):
+                seeder = seed_gcp_products.ProductSeeder("project", "region", "datastore", cache_dir=cache_dir)
+                seeder.embedding_model = mock.Mock(get_embeddings=get_embeddings)
+                self.assertEqual(seeder.generate_embeddings("A roomy tent."), [13.0, 1.0])
+
+            self.assertEqual(calls, [["A roomy tent."]])
+            self.assertEqual(seeder.embedding_cache.stats()["hits"], 1)
+
+
+class ProductSeederDocumentTests(unittest.TestCase):
+    PRODUCT = {
+        "id": "1",
+        "name": "TrailMaster X4 Tent",
+        "price": 250.0,
+        "category": "Tents",
+        "brand": "OutdoorLiving",
+        "description": "A roomy four-person tent.",
+    }
+
+    def create_document(self, cache_dir, **options):
+        seeder = seed_gcp_products.ProductSeeder("project", "region", "datastore", cache_dir=cache_dir, **options)
+        seeder.embedding_model = mock.Mock(
+            get_embeddings=lambda texts: [mock.Mock(values=[0.5, 1.0]) for _ in texts]
+        )
+        document_type = seed_gcp_products.discoveryengine_v1.Document
+        document_type.reset_mock()
+        seeder.create_document(self.PRODUCT)
+        return seeder, document_type.call_args.kwargs
+
+    def test_the_description_is_stored_once_without_embeddings(self):
+        with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, clear=True):
+            seeder, document = self.create_document(cache_dir)
+
+        self.assertEqual(set(document), {"id", "struct_data"})
+        self.assertEqual(document["id"], "product_1")
+        self.assertEqual(
+            document["struct_data"],
+            {**self.PRODUCT, "url": "/products/trailmaster-x4-tent"},
+        )
+        self.assertEqual(seeder.embedding_cache.stats()["misses"], 0)
+
+    def test_embeddings_go_in_the_configured_schema_field(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            _seeder, document = self.create_document(cache_dir, embedding_field="description_embedding")
+
+        self.assertEqual(document["struct_data"]["description_embedding"], [0.5, 1.0])
+        self.assertEqual(list(document["struct_data"].values()).count(self.PRODUCT["description"]), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
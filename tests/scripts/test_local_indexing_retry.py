@@ -28,42 +28,75 @@ CHAT_DOCKERFILE = REPO_ROOT / "services/chat/Dockerfile"
 # The indexer imports these at module scope. `chromadb` is only installed by the
 # full local profile (`make setup-chat-full`), so the stubs keep this guard
 # runnable under the core profile as well as pinning the failure point.
-PRISMA_STUB = '''
+ASYNCPG_STUB = '''
+import json
 import os
 
 FAIL_AT = os.environ["STUB_FAIL_AT"]
+RECORD = os.environ["STUB_RECORD"]
+
+
+def _product(index):
+    return {
+        "id": f"p{index}",
+        "name": f"Product {index}",
+        "description": "A description.",
+        "price": 10.0 + index,
+        "slug": f"product-{index}",
+        "category": "Tents",
+        "brand": "Contoso",
+    }
+
 
+class _Transaction:
+    def __init__(self, options):
+        self.options = options
 
-class _Product:
-    def __init__(self, index):
-        self.id = f"p{index}"
-        self.name = f"Product {index}"
-        self.slug = f"product-{index}"
-        self.price = 10 + index
-        self.description = "A description."
-        self.category = type("C", (), {"name": "Tents"})()
-        self.brand = type("B", (), {"name": "Contoso"})()
+    async def __aenter__(self):
+        with open(RECORD + ".transaction", "w", encoding="utf-8") as handle:
+            json.dump(self.options, handle)
 
+    async def __aexit__(self, *exc_info):
+        return False
 
-class _Products:
-    async def find_many(self, **kwargs):
-        if FAIL_AT == "find_many":
+
+class _Cursor:
+    def __init__(self, prefetch):
+        self.prefetch = prefetch
+        self.rows = [_product(1), _product(2)]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if FAIL_AT == "fetch":
             raise RuntimeError("stub: database read failed")
-        if FAIL_AT == "empty":
-            return []
-        return [_Product(1), _Product(2)]
+        if not self.rows:
+            raise StopAsyncIteration
+        return self.rows.pop(0)
+
 
+class _Connection:
+    def transaction(self, **options):
+        return _Transaction(options)
 
-class Prisma:
-    def __init__(self):
-        self.product = _Products()
+    async def fetchval(self, query):
+        return 0 if FAIL_AT == "empty" else 2
 
-    async def connect(self):
-        if FAIL_AT == "connect":
-            raise RuntimeError("stub: database is still starting up")
+    def cursor(self, query, prefetch):
+        assert "JOIN" in query
+        return _Cursor(prefetch)
 
-    async def disconnect(self):
+    async def close(self):
         pass
+
+
+async def connect(dsn):
+    if FAIL_AT == "connect":
+        raise RuntimeError("stub: database is still starting up")
+    # asyncpg rejects Prisma's ?schema=public.
+    assert "schema=" not in dsn, dsn
+    return _Connection()
 '''
 
 CHROMADB_STUB = '''
@@ -75,16 +108,31 @@ RECORD = os.environ["STUB_RECORD"]
 
 
 class _Collection:
-    def upsert(self, documents, metadatas, ids):
+    def __init__(self, name):
+        self.name = name
+
+    def upsert(self, documents, metadatas, ids, embeddings=None):
         if FAIL_AT == "upsert":
             raise RuntimeError("stub: chroma rejected the upsert")
+        record = {}
+        if os.path.exists(RECORD):
+            with open(RECORD, encoding="utf-8") as handle:
+                record = json.load(handle)
+        entry = record.setdefault(self.name, {"ids": [], "metadatas": [], "batches": 0})
+        entry["ids"].extend(ids)
+        entry["metadatas"].extend(metadatas)
+        entry["batches"] += 1
+        entry["embedded"] = entry.get("embedded", 0) + len(embeddings or [])
         with open(RECORD, "w", encoding="utf-8") as handle:
-            json.dump({"ids": list(ids)}, handle)
+            json.dump(record, handle)
 
 
 class _Client:
     def get_or_create_collection(self, name, embedding_function):
-        return _Collection()
+        return _Collection(name)
+
+    def delete_collection(self, name):
+        pass
 
 
 def PersistentClient(path):
@@ -94,8 +142,14 @@ def PersistentClient(path):
 '''
 
 CHROMADB_UTILS_STUB = '''
+import os
+
+
 class _EmbeddingFunction:
-    pass
+    def __call__(self, input):
+        with open(os.environ["STUB_RECORD"] + ".embedded", "a", encoding="utf-8") as handle:
+            handle.write(f"{len(input)}\\n")
+        return [[float(len(text)), 1.0, 0.0] for text in input]
 
 
 class embedding_functions:
@@ -103,32 +157,71 @@ class embedding_functions:
 '''
 
 
-def run_indexer(fail_at):
-    """Run the real indexer against stubbed boundaries. Returns the process."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        fixture = Path(temp_dir)
-        stub_root = fixture / "stubs"
-        (stub_root / "chromadb").mkdir(parents=True)
-        (stub_root / "prisma.py").write_text(PRISMA_STUB, encoding="utf-8")
-        (stub_root / "chromadb/__init__.py").write_text(CHROMADB_STUB, encoding="utf-8")
-        (stub_root / "chromadb/utils.py").write_text(CHROMADB_UTILS_STUB, encoding="utf-8")
+CATALOG = [
+    {"id": 1, "name": "Product 1", "slug": "product-1", "category": "Tents", "manual": "/manuals/product_info_1.md"},
+    {"id": 2, "name": "Product 2", "slug": "product-2", "category": "Tents", "manual": "/manuals/manual_tents.md"},
+    {"id": 3, "name": "Product 3", "slug": "product-3", "category": "Tents", "manual": "/manuals/manual_tents.md"},
+]
+PRODUCT_MANUAL = "# Product 1\n\n## Setup\n" + "Stake the corners first.\n" * 60 + "\n## Care\nDry before storing.\n"
+CATEGORY_MANUAL = "# Tent User Guide\n\n## Care\nDry the tent before storing it.\n"
 
-        record = fixture / "upserted.json"
-        env = dict(os.environ)
-        env["PYTHONPATH"] = str(stub_root)
-        env["STUB_FAIL_AT"] = fail_at
-        env["STUB_RECORD"] = str(record)
-        env["CHROMA_DB_PATH"] = str(fixture / "chroma_db")
 
-        completed = subprocess.run(
-            [sys.executable, str(INDEXER)],
-            capture_output=True,
-            text=True,
-            env=env,
-            timeout=120,
+def run_indexer(fail_at, extra_env=None, args=(), fixture=None):
+    """Run the real indexer against stubbed boundaries. Returns the process.
+
+    Runs sharing a `fixture` directory share the live index and artifact
+    directories, as successive container starts on one volume would.
+    """
+    if fixture is None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            return run_indexer(fail_at, extra_env, args, Path(temp_dir))
+
+    catalog = fixture / "catalog"
+    if not catalog.exists():
+        (catalog / "manuals").mkdir(parents=True)
+        (catalog / "products.json").write_text(json.dumps(CATALOG), encoding="utf-8")
+        (catalog / "manuals/product_info_1.md").write_text(PRODUCT_MANUAL, encoding="utf-8")
+        (catalog / "manuals/manual_tents.md").write_text(CATEGORY_MANUAL, encoding="utf-8")
+    stub_root = fixture / "stubs"
+    (stub_root / "chromadb").mkdir(parents=True, exist_ok=True)
+    (stub_root / "asyncpg.py").write_text(ASYNCPG_STUB, encoding="utf-8")
+    (stub_root / "chromadb/__init__.py").write_text(CHROMADB_STUB, encoding="utf-8")
+    (stub_root / "chromadb/utils.py").write_text(CHROMADB_UTILS_STUB, encoding="utf-8")
+
+    record = fixture / "upserted.json"
+    embedded = fixture / "upserted.json.embedded"
+    for stale in (record, embedded):
+        if stale.exists():
+            stale.unlink()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(stub_root)
+    env["STUB_FAIL_AT"] = fail_at
+    env["STUB_RECORD"] = str(record)
+    env["DATABASE_URL"] = "postgresql://postgres:postgres@db:5432/contoso-db?schema=public"
+    env["CHROMA_DB_PATH"] = str(fixture / "chroma_db")
+    env["PRODUCT_CATALOG_DIR"] = str(catalog)
+    env["EMBEDDING_STORE_PATH"] = str(fixture / "embeddings")
+    env["INDEX_ARTIFACT_PATH"] = str(fixture / "artifact")
+    env["EMBEDDING_CACHE_DIR"] = str(fixture / "embedding-cache")
+    env.update(extra_env or {})
+
+    completed = subprocess.run(
+        [sys.executable, str(INDEXER), *args],
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=120,
+    )
+    upserted = json.loads(record.read_text(encoding="utf-8")) if record.exists() else None
+    if upserted is not None:
+        upserted["store"] = sorted(path.name for path in (fixture / "embeddings").glob("*"))
+        upserted["model_calls"] = (
+            [int(line) for line in embedded.read_text(encoding="utf-8").split()] if embedded.exists() else []
         )
-        upserted = json.loads(record.read_text(encoding="utf-8")) if record.exists() else None
-        return completed, upserted
+        sidecar = fixture / "embeddings/products.json"
+        if sidecar.exists():
+            upserted["store_ids"] = json.loads(sidecar.read_text(encoding="utf-8"))["ids"]
+    return completed, upserted
 
 
 def run_entrypoint(failures_before_success):
@@ -205,7 +298,90 @@ class IndexerExitStatusTests(unittest.TestCase):
         )
         # Vacuity guard: the stubs were reached and the real indexing path ran,
         # so a zero here is a success rather than an import that never got going.
-        self.assertEqual(upserted, {"ids": ["p1", "p2"]})
+        self.assertEqual(upserted["products"]["ids"], ["p1", "p2"])
+
+    def test_manuals_are_chunked_into_their_own_collection(self):
+        completed, upserted = run_indexer(
+            "none", {"MANUAL_CHUNK_SIZE": "300", "MANUAL_CHUNK_OVERLAP": "50", "MANUAL_EMBED_BATCH": "2"}
+        )
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        manuals = upserted["manuals"]
+        # The shared category manual is indexed once, parented to the manual;
+        # the product manual is split into several chunks parented to its product.
+        parents = [meta["parent"] for meta in manuals["metadatas"]]
+        self.assertEqual(parents.count("/manuals/manual_tents.md"), 1)
+        self.assertGreater(parents.count("product-1"), 2)
+        self.assertEqual(len(manuals["ids"]), len(set(manuals["ids"])))
+        self.assertEqual(manuals["batches"], (len(manuals["ids"]) + 1) // 2)
+        product_chunk = manuals["metadatas"][parents.index("product-1")]
+        self.assertEqual(product_chunk["product_id"], "p1")
+        self.assertEqual(product_chunk["section"], "Product 1 > Setup")
+
+    def test_embeddings_are_written_once_for_chroma_and_the_mapped_store(self):
+        completed, upserted = run_indexer("none")
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        # Chroma gets the vectors the indexer computed rather than embedding again.
+        self.assertEqual(upserted["products"]["embedded"], 2)
+        self.assertEqual(upserted["manuals"]["embedded"], len(upserted["manuals"]["ids"]))
+        store = [re.sub(r"\.\d{8}T\d+\.npy$", ".<generation>.npy", name) for name in upserted["store"]]
+        self.assertEqual(
+            store,
+            ["manifest.json", "manuals.<generation>.npy", "manuals.json", "products.<generation>.npy", "products.json"],
+        )
+        self.assertEqual(upserted["store_ids"], ["p1", "p2"])
+
+    def test_a_reindex_swaps_vectors_and_rows_together(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fixture = Path(temp_dir)
+            store = fixture / "embeddings"
+            for _ in range(3):
+                completed, _ = run_indexer("none", fixture=fixture)
+                self.assertEqual(completed.returncode, 0, completed.stderr)
+            sidecar = json.loads((store / "products.json").read_text(encoding="utf-8"))
+            matrices = sorted(path.name for path in store.glob("products.*.npy"))
+        # The sidecar names the newest matrix; one previous generation is kept
+        # for workers that read the old sidecar just before the swap.
+        self.assertEqual(len(matrices), 2)
+        self.assertEqual(sidecar["vectors"], matrices[-1])
+
+    def test_products_stream_in_batches_from_one_read_only_snapshot(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fixture = Path(temp_dir)
+            completed, upserted = run_indexer("none", {"INDEX_BATCH_SIZE": "1"}, fixture=fixture)
+            transaction = json.loads((fixture / "upserted.json.transaction").read_text(encoding="utf-8"))
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertEqual(upserted["products"]["batches"], 2)
+        self.assertEqual(upserted["products"]["embedded"], 2)
+        self.assertEqual(upserted["store_ids"], ["p1", "p2"])
+        self.assertEqual(transaction, {"isolation": "repeatable_read", "readonly": True})
+
+    def test_an_empty_catalogue_is_not_an_error(self):
+        completed, upserted = run_indexer("empty")
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertIn("No products found in database", completed.stdout)
+        self.assertIsNone(upserted)
+
+    def test_a_reindex_only_embeds_changed_texts(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fixture = Path(temp_dir)
+            completed, first = run_indexer("none", fixture=fixture)
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            self.assertEqual(sum(first["model_calls"]), 2 + len(first["manuals"]["ids"]))
+
+            completed, second = run_indexer("none", fixture=fixture)
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            self.assertEqual(second["model_calls"], [])
+            self.assertIn("0 misses (100% hit rate)", completed.stdout)
+            # Cached vectors still reach Chroma and the store.
+            self.assertEqual(second["products"]["embedded"], 2)
+            self.assertEqual(second["store_ids"], ["p1", "p2"])
+
+            # A changed manual section is the only text embedded again.
+            (fixture / "catalog/manuals/manual_tents.md").write_text(
+                CATEGORY_MANUAL + "Pack it dry.\n", encoding="utf-8"
+            )
+            completed, third = run_indexer("none", fixture=fixture)
+            self.assertEqual(third["model_calls"], [1])
 
     def test_database_failure_exits_nonzero(self):
         completed, _ = run_indexer("connect")
@@ -232,11 +408,67 @@ class IndexerExitStatusTests(unittest.TestCase):
         )
 
     def test_failure_is_still_reported(self):
-        completed, _ = run_indexer("find_many")
+        completed, _ = run_indexer("fetch")
         output = completed.stdout + completed.stderr
         self.assertIn("stub: database read failed", output)
 
 
+class IndexArtifactTests(unittest.TestCase):
+    """`--if-stale` embeds nothing when a current index or artifact exists."""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.fixture = Path(temp_dir.name)
+
+    def build_artifact(self):
+        completed, upserted = run_indexer("none", args=["--build-artifact", str(self.fixture / "artifact")], fixture=self.fixture)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertEqual(upserted["products"]["ids"], ["p1", "p2"])
+        # The image ships the directory with its README; that is not index data.
+        (self.fixture / "artifact/README.md").write_text("notes", encoding="utf-8")
+        return json.loads((self.fixture / "artifact/manifest.json").read_text(encoding="utf-8"))
+
+    def test_the_artifact_is_versioned_and_checksummed(self):
+        manifest = self.build_artifact()
+        self.assertEqual(manifest["format_version"], 1)
+        self.assertEqual(len(manifest["catalog_fingerprint"]), 64)
+        self.assertTrue(any(re.fullmatch(r"embeddings/products\.\w+\.npy", path) for path in manifest["files"]))
+        # Building the artifact leaves the live index alone.
+        self.assertFalse((self.fixture / "embeddings").exists())
+
+    def test_a_matching_artifact_is_installed_instead_of_indexing(self):
+        self.build_artifact()
+        completed, upserted = run_indexer("none", args=["--if-stale"], fixture=self.fixture)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertIn("Installed index artifact", completed.stdout)
+        self.assertIsNone(upserted)
+        sidecar = json.loads((self.fixture / "embeddings/products.json").read_text(encoding="utf-8"))
+        self.assertTrue((self.fixture / "embeddings" / sidecar["vectors"]).is_file())
+
+        completed, upserted = run_indexer("none", args=["--if-stale"], fixture=self.fixture)
+        self.assertIn("is current. Skipping indexing.", completed.stdout)
+        self.assertIsNone(upserted)
+
+    def test_a_stale_artifact_falls_back_to_live_indexing(self):
+        self.build_artifact()
+        # Different chunking is a different catalogue index.
+        completed, upserted = run_indexer(
+            "none", {"MANUAL_CHUNK_SIZE": "300"}, args=["--if-stale"], fixture=self.fixture
+        )
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertIn("built from a different catalogue", completed.stdout)
+        self.assertEqual(upserted["products"]["ids"], ["p1", "p2"])
+
+    def test_a_corrupted_artifact_falls_back_to_live_indexing(self):
+        self.build_artifact()
+        with open(self.fixture / "artifact/embeddings/products.json", "a", encoding="utf-8") as handle:
+            handle.write(" ")
+        completed, upserted = run_indexer("none", args=["--if-stale"], fixture=self.fixture)
+        self.assertIn("fails its checksums", completed.stdout)
+        self.assertEqual(upserted["products"]["ids"], ["p1", "p2"])
+
+
 class IndexerDeliveryTests(unittest.TestCase):
     """The entrypoint's relative path and the Dockerfile's COPY have to agree.
 